@@ -0,0 +1,200 @@
+"""
+Shared Athena query execution for the Tools scripts.
+
+    from athena_runner import AthenaRunner
+
+    runner = AthenaRunner(session.client('athena'), 's3://bucket/athena-results/')
+    runner.run("CREATE DATABASE x", "Creating database")           # waits, raises on failure
+    runner.run_many([(sql_a, 'Table A'), (sql_b, 'Table B')])        # independent queries in parallel
+    for row in runner.iter_rows(runner.run(select_sql)['QueryExecutionId']):
+        ...
+    columns, rows = runner.fetch(select_sql, partition_range=('2025-10-01', '2025-10-07'))
+
+- Polling backs off exponentially (ATHENA_POLL_INITIAL, default 0.25s, doubling
+  up to ATHENA_POLL_MAX, default 5s): short DDL returns in well under a second
+  and long scans are not polled every second.
+- SELECTs ask Athena to reuse a previous identical result for up to
+  ATHENA_REUSE_MINUTES (default 60), which costs nothing to scan.
+- fetch() also keeps results in a local content-addressed cache
+  (ATHENA_CACHE_DIR, default ~/.cache/alibaba-cdn-athena), keyed by the
+  normalised SQL, the database and the partition range the query reads.
+  A range that ends before today never changes and is cached for good; one
+  that reaches today expires after ATHENA_CACHE_OPEN_TTL seconds (300).
+- Results are read page by page with get_query_results, so large results
+  stream instead of being loaded at once.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+POLL_INITIAL = float(os.environ.get('ATHENA_POLL_INITIAL', '0.25'))
+POLL_MAX = float(os.environ.get('ATHENA_POLL_MAX', '5'))
+REUSE_MINUTES = int(os.environ.get('ATHENA_REUSE_MINUTES', '60'))
+# Athena's default limit is 20 running DML queries per account and region
+MAX_CONCURRENCY = int(os.environ.get('ATHENA_MAX_CONCURRENCY', '5'))
+CACHE_DIR = os.environ.get('ATHENA_CACHE_DIR', os.path.expanduser('~/.cache/alibaba-cdn-athena'))
+CACHE_OPEN_TTL = int(os.environ.get('ATHENA_CACHE_OPEN_TTL', '300'))
+PAGE_SIZE = 1000
+
+_FINAL_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+# String literals are kept as they are; comments and whitespace runs are not
+_SQL_TOKENS = re.compile(r"('(?:[^']|'')*')|(?:--[^\n]*|/\*.*?\*/|\s+)+", re.DOTALL)
+
+
+class AthenaQueryError(Exception):
+    def __init__(self, description, execution):
+        status = execution['Status']
+        self.execution = execution
+        self.state = status['State']
+        self.reason = status.get('StateChangeReason', 'No error details available')
+        super().__init__(f"{description}: {self.state}: {self.reason}")
+
+
+def normalize_sql(sql):
+    return _SQL_TOKENS.sub(lambda m: m.group(1) or ' ', sql).strip().rstrip(';').strip()
+
+
+def is_select(sql):
+    return normalize_sql(sql).split(' ', 1)[0].upper() in ('SELECT', 'WITH')
+
+
+class AthenaRunner:
+    def __init__(self, athena_client, output_location, database=None, workgroup=None,
+                 reuse_minutes=REUSE_MINUTES, max_concurrency=MAX_CONCURRENCY, cache_dir=CACHE_DIR):
+        self.athena = athena_client
+        self.output_location = output_location
+        self.database = database
+        self.workgroup = workgroup
+        self.reuse_minutes = reuse_minutes
+        self.max_concurrency = max_concurrency
+        self.cache_dir = cache_dir
+
+    def start(self, sql, reuse=True):
+        request = {
+            'QueryString': sql,
+            'ResultConfiguration': {'OutputLocation': self.output_location},
+        }
+        if self.database:
+            request['QueryExecutionContext'] = {'Database': self.database}
+        if self.workgroup:
+            request['WorkGroup'] = self.workgroup
+        if reuse and self.reuse_minutes and is_select(sql):
+            request['ResultReuseConfiguration'] = {
+                'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': self.reuse_minutes}
+            }
+        delay = POLL_INITIAL
+        while True:
+            try:
+                return self.athena.start_query_execution(**request)['QueryExecutionId']
+            except ClientError as e:
+                # Too many queued queries: back off instead of failing the batch
+                if e.response['Error']['Code'] != 'TooManyRequestsException' or delay > 60:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def wait(self, query_id):
+        delay = POLL_INITIAL
+        while True:
+            execution = self.athena.get_query_execution(QueryExecutionId=query_id)['QueryExecution']
+            if execution['Status']['State'] in _FINAL_STATES:
+                return execution
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX)
+
+    def run(self, sql, description=None, reuse=True, quiet=False):
+        """Run one query to completion. Returns its QueryExecution, raises AthenaQueryError."""
+        description = description or normalize_sql(sql)[:60]
+        if not quiet:
+            print(f"{description}...")
+        started = time.monotonic()
+        execution = self.wait(self.start(sql, reuse))
+        if execution['Status']['State'] != 'SUCCEEDED':
+            print(f"❌ {description} failed: {execution['Status'].get('StateChangeReason', execution['Status']['State'])}")
+            raise AthenaQueryError(description, execution)
+        if not quiet:
+            stats = execution.get('Statistics', {})
+            reused = stats.get('ResultReuseInformation', {}).get('ReusedPreviousResult')
+            scanned = stats.get('DataScannedInBytes', 0) / (1024 ** 3)
+            print(f"✅ {description} completed in {time.monotonic() - started:.1f}s "
+                  f"({'reused result' if reused else f'{scanned:.2f}GB scanned'})")
+        return execution
+
+    def run_many(self, queries, reuse=True, raise_on_error=True):
+        """
+        Run independent queries at the same time, at most max_concurrency at
+        once. queries is a list of sql strings or (sql, description) pairs.
+        Returns their QueryExecutions (or AthenaQueryErrors) in order.
+        """
+        queries = [q if isinstance(q, tuple) else (q, None) for q in queries]
+
+        def run_one(query):
+            try:
+                return self.run(query[0], query[1], reuse)
+            except AthenaQueryError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as pool:
+            results = list(pool.map(run_one, queries))
+        errors = [r for r in results if isinstance(r, AthenaQueryError)]
+        if errors and raise_on_error:
+            raise errors[0]
+        return results
+
+    def iter_pages(self, query_id, page_size=PAGE_SIZE):
+        # (columns, rows) per page; rows are lists of strings (None for NULL)
+        paginator = self.athena.get_paginator('get_query_results')
+        columns = None
+        for page in paginator.paginate(QueryExecutionId=query_id, PaginationConfig={'PageSize': page_size}):
+            rows = [[field.get('VarCharValue') for field in row['Data']] for row in page['ResultSet']['Rows']]
+            if columns is None:
+                columns = [c['Name'] for c in page['ResultSet']['ResultSetMetadata']['ColumnInfo']]
+                # The first row of a SELECT result repeats the column names
+                if rows and rows[0] == columns:
+                    rows = rows[1:]
+            yield columns, rows
+
+    def iter_rows(self, query_id, page_size=PAGE_SIZE):
+        for columns, rows in self.iter_pages(query_id, page_size):
+            for row in rows:
+                yield dict(zip(columns, row))
+
+    def _cache_path(self, sql, partition_range):
+        identity = json.dumps([normalize_sql(sql), self.database, partition_range])
+        digest = hashlib.sha256(identity.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.json.gz")
+
+    def fetch(self, sql, partition_range=None, description=None, use_cache=True):
+        """
+        Run a SELECT and return (columns, rows), served from the local cache
+        when possible. partition_range is the (first_day, last_day) the query
+        reads, as 'YYYY-MM-DD' strings; None means it is never cached.
+        """
+        path = self._cache_path(sql, partition_range) if use_cache and partition_range else None
+        if path and os.path.exists(path):
+            with gzip.open(path, 'rt') as f:
+                entry = json.load(f)
+            closed = partition_range[1] < datetime.utcnow().strftime('%Y-%m-%d')
+            if closed or time.time() - entry['created'] < CACHE_OPEN_TTL:
+                print(f"💾 {description or 'Query'}: {len(entry['rows'])} rows from local cache")
+                return entry['columns'], entry['rows']
+
+        execution = self.run(sql, description)
+        columns, rows = [], []
+        for columns, page in self.iter_pages(execution['QueryExecutionId']):
+            rows.extend(page)
+
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, 'wt') as f:
+                json.dump({'sql': normalize_sql(sql), 'partition_range': partition_range, 'created': time.time(),
+                           'query_id': execution['QueryExecutionId'], 'columns': columns, 'rows': rows}, f)
+            os.replace(tmp_path, path)
+        return columns, rows
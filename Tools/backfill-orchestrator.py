@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Parallel, resumable backfill of Alibaba CDN logs.
+
+Splits a date range into shards of --shard-hours (2 by default, must divide
+24) and runs the log downloader once per shard, either as concurrent Lambda
+invocations or in a local process pool:
+
+    python Tools/backfill-orchestrator.py --start-date 2025-07-01 --end-date 2025-09-30
+    python Tools/backfill-orchestrator.py --start-date 2025-10-01 --end-date 2025-10-07 --mode local --concurrency 4
+
+- Every shard that finishes without a failed file is checkpointed as a small
+  JSON object under s3://spl-live-cdn-logs/alibaba-cdn/_manifests/backfill/<run-id>/.
+  Re-running the same command (same range and shard size, so the same run
+  id) skips the checkpointed shards and only redoes the rest.
+- --concurrency caps the shards in flight and --max-workers the downloads
+  inside each shard, so at most concurrency x max_workers files are fetched
+  from the CDN at once. Shard starts are spaced by --start-interval seconds
+  to keep DescribeCdnDomainLogs under Alibaba's API rate limits.
+- A failed shard is retried --retries times with backoff; shards still
+  failing are listed at the end and the script exits with status 1.
+- The downloader's ingest manifest still skips files already in S3, so
+  overlapping or repeated shards never download a file twice (--force
+  disables both the manifest and the checkpoints).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET = 'spl-live-cdn-logs'
+CHECKPOINT_PREFIX = 'alibaba-cdn/_manifests/backfill'
+DOMAIN = 'alibaba-live.servers8.com'
+STACK_NAME = 'AlibabaCdnLogsStack'
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Lambda runs up to 15 minutes; wait a little longer for its response
+INVOKE_READ_TIMEOUT = 960
+
+
+def make_shards(start_date, end_date, shard_hours):
+    if 24 % shard_hours:
+        raise ValueError(f"--shard-hours must divide 24 (got {shard_hours})")
+    shards = []
+    current = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+    while current < end:
+        shard_end = current + timedelta(hours=shard_hours) - timedelta(seconds=1)
+        shards.append((current.strftime(TIME_FORMAT), shard_end.strftime(TIME_FORMAT)))
+        current += timedelta(hours=shard_hours)
+    return shards
+
+
+class CheckpointStore:
+    """One S3 object per completed shard, under the prefix of one backfill run."""
+
+    def __init__(self, s3_client, bucket, run_id, prefix=CHECKPOINT_PREFIX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = f"{prefix}/{run_id}/"
+
+    def _key(self, shard):
+        return f"{self.prefix}{shard[0]}.json"
+
+    def completed(self):
+        done = set()
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                done.add(obj['Key'][len(self.prefix):-len('.json')])
+        return done
+
+    def mark_done(self, shard, summary):
+        body = dict(summary, start_time=shard[0], end_time=shard[1],
+                    completed_at=datetime.utcnow().strftime(TIME_FORMAT))
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._key(shard), Body=json.dumps(body).encode('utf-8'),
+                                  ContentType='application/json')
+
+
+def shard_event(shard, args):
+    event = {
+        'domain': args.domain,
+        'start_time': shard[0],
+        'end_time': shard[1],
+        'max_workers': args.max_workers,
+    }
+    if args.fused is not None:
+        event['fused'] = args.fused
+    if args.force:
+        event['force'] = True
+    return event
+
+
+def summarize(response):
+    # Downloader response -> (ok, summary); a shard with any failed file is not done
+    body = json.loads(response.get('body') or '{}')
+    if response.get('statusCode') != 200:
+        return False, {'error': body.get('error', f"status {response.get('statusCode')}")}
+    summary = {
+        'uploaded': len(body.get('uploaded_files', [])),
+        'skipped': body.get('skipped_count', 0),
+        'failed': body.get('failed_count', 0),
+        'bytes': sum(entry.get('bytes') or 0 for entry in body.get('report', [])),
+        'seconds': body.get('elapsed_seconds'),
+    }
+    if summary['failed']:
+        errors = [entry.get('error') for entry in body.get('report', []) if entry.get('error')]
+        summary['error'] = f"{summary['failed']} files failed: {errors[0] if errors else 'unknown error'}"
+    return not summary['failed'], summary
+
+
+class LambdaRunner:
+    def __init__(self, session, function_name):
+        self.function_name = function_name
+        # No SDK retries: a retried invoke would run the shard twice at once
+        self.client = session.client('lambda', config=Config(read_timeout=INVOKE_READ_TIMEOUT,
+                                                             retries={'max_attempts': 0},
+                                                             max_pool_connections=64))
+
+    def __call__(self, event):
+        response = self.client.invoke(FunctionName=self.function_name, InvocationType='RequestResponse',
+                                      Payload=json.dumps(event).encode('utf-8'))
+        payload = json.loads(response['Payload'].read() or b'{}')
+        if response.get('FunctionError'):
+            return {'statusCode': 500, 'body': json.dumps({'error': payload.get('errorMessage', 'Lambda error')})}
+        return payload
+
+
+def _local_handler(event):
+    # Runs in a pool process: the downloader with its layers on sys.path
+    sys.path[:0] = [
+        os.path.join(ROOT, 'lib', 'lambda', 'log_downloader'),
+        os.path.join(ROOT, 'lib', 'lambda', 'shared'),
+        os.path.join(ROOT, 'lib', 'lambda', 'parquet_converter'),
+    ]
+    import lambda_function
+    return lambda_function.lambda_handler(event, None)
+
+
+class LocalRunner:
+    def __init__(self, concurrency):
+        self.pool = ProcessPoolExecutor(max_workers=concurrency)
+
+    def __call__(self, event):
+        return self.pool.submit(_local_handler, event).result()
+
+
+def resolve_function_name(session):
+    outputs = session.client('cloudformation').describe_stacks(StackName=STACK_NAME)['Stacks'][0].get('Outputs', [])
+    for output in outputs:
+        if output['OutputKey'] == 'FunctionName':
+            return output['OutputValue']
+    raise RuntimeError(f"No FunctionName output on stack {STACK_NAME}; pass --function-name")
+
+
+def run_backfill(runner, checkpoints, shards, args):
+    done = set() if args.force else checkpoints.completed()
+    pending = [shard for shard in shards if shard[0] not in done]
+    print(f"🧩 {len(shards)} shards of {args.shard_hours}h, {len(shards) - len(pending)} already checkpointed, "
+          f"{len(pending)} to run with concurrency {args.concurrency} x {args.max_workers} downloads")
+
+    start_lock = threading.Lock()
+    last_start = [0.0]
+    totals = {'uploaded': 0, 'skipped': 0, 'bytes': 0}
+    failed = {}
+
+    def run_shard(shard):
+        for attempt in range(args.retries + 1):
+            with start_lock:
+                # Space shard starts: each one begins with a listing call
+                wait = last_start[0] + args.start_interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                last_start[0] = time.monotonic()
+            try:
+                ok, summary = summarize(runner(shard_event(shard, args)))
+            except Exception as e:
+                ok, summary = False, {'error': str(e)}
+            if ok:
+                checkpoints.mark_done(shard, summary)
+                return shard, True, summary
+            if attempt < args.retries:
+                delay = 5 * 2 ** attempt
+                print(f"🔁 {shard[0]} failed ({summary.get('error')}), retrying in {delay}s")
+                time.sleep(delay)
+        return shard, False, summary
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_shard, shard) for shard in pending]
+        for index, future in enumerate(as_completed(futures), 1):
+            shard, ok, summary = future.result()
+            if ok:
+                for key in totals:
+                    totals[key] += summary.get(key) or 0
+                print(f"✅ [{index}/{len(pending)}] {shard[0]}: {summary['uploaded']} uploaded, "
+                      f"{summary['skipped']} already ingested ({summary.get('seconds')}s)")
+            else:
+                failed[shard[0]] = summary.get('error')
+                print(f"❌ [{index}/{len(pending)}] {shard[0]}: {summary.get('error')}")
+
+    elapsed = time.monotonic() - started
+    print(f"\n📊 Backfill finished in {elapsed / 60:.1f} min: {len(pending) - len(failed)} shards done, "
+          f"{len(failed)} failed, {totals['uploaded']} files uploaded "
+          f"({totals['bytes'] / (1024 ** 3):.2f}GB), {totals['skipped']} already ingested")
+    for shard_start, error in sorted(failed.items()):
+        print(f"   ❌ {shard_start}: {error}")
+    if failed:
+        print("   Re-run the same command to retry only the failed shards")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel, checkpointed backfill of Alibaba CDN logs')
+    parser.add_argument('--start-date', required=True, help='First day (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='Last day, inclusive (default: start date)')
+    parser.add_argument('--shard-hours', type=int, default=2, help='Shard size in hours, must divide 24')
+    parser.add_argument('--mode', choices=['lambda', 'local'], default='lambda')
+    parser.add_argument('--function-name', help=f'Downloader Lambda (default: output of {STACK_NAME})')
+    parser.add_argument('--concurrency', type=int, default=8, help='Shards in flight at once')
+    parser.add_argument('--max-workers', type=int, default=4, help='Concurrent downloads inside each shard')
+    parser.add_argument('--start-interval', type=float, default=0.5, help='Minimum seconds between shard starts')
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--fused', dest='fused', action='store_true', default=None,
+                        help='Convert to Parquet while downloading (default: the function setting)')
+    parser.add_argument('--no-fused', dest='fused', action='store_false')
+    parser.add_argument('--force', action='store_true', help='Ignore checkpoints and the ingest manifest')
+    parser.add_argument('--run-id', help='Checkpoint namespace (default: derived from the range and shard size)')
+    parser.add_argument('--domain', default=DOMAIN)
+    parser.add_argument('--bucket', default=BUCKET)
+    parser.add_argument('--profile', default='spl')
+    args = parser.parse_args()
+    args.end_date = args.end_date or args.start_date
+
+    shards = make_shards(args.start_date, args.end_date, args.shard_hours)
+    run_id = args.run_id or f"{args.start_date}_{args.end_date}_{args.shard_hours}h"
+
+    session = boto3.Session(profile_name=args.profile)
+    checkpoints = CheckpointStore(session.client('s3'), args.bucket, run_id)
+    if args.mode == 'lambda':
+        function_name = args.function_name or resolve_function_name(session)
+        print(f"🚀 Backfill {run_id} on Lambda {function_name}")
+        runner = LambdaRunner(session, function_name)
+    else:
+        # Pool processes build their own clients from the same profile
+        os.environ['AWS_PROFILE'] = args.profile
+        print(f"🚀 Backfill {run_id} in {args.concurrency} local processes")
+        runner = LocalRunner(args.concurrency)
+
+    try:
+        failed = run_backfill(runner, checkpoints, shards, args)
+    except ClientError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
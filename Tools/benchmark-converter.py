@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Offline throughput benchmark for the Parquet converter.
+
+Generates synthetic Alibaba CDN logs in the exact bracketed format the
+parser expects, then times:
+  • parse_log_line      (regex path, per line)
+  • process_chunk       (Arrow block parser + derived columns)
+  • Parquet encoding    (output size and time per codec)
+  • process_file_in_chunks end to end against moto's in-memory S3
+
+Reports rows/sec, MB/sec (uncompressed log bytes) and peak RSS. Save a run
+with --json and pass it back with --baseline to flag regressions:
+
+    python Tools/benchmark-converter.py --lines 500000 --json before.json
+    python Tools/benchmark-converter.py --lines 500000 --baseline before.json
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT, 'lib', 'lambda', 'parquet_converter'),
+    os.path.join(ROOT, 'lib', 'lambda', 'shared'),
+]
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from log_parser import parse_log_line
+
+BENCH_BUCKET = 'benchmark-cdn-logs'
+CODECS = ['snappy', 'zstd', 'gzip', 'none']
+PLAYLISTS = ['index.m3u8', 'll-index.m3u8', 'index-720p.m3u8']
+CACHE_STATUSES = ['HIT', 'HIT-REFRESH', 'MISS', 'EXPIRED']
+ERROR_STATUSES = [403, 404, 499, 502, 503, 504]
+USER_AGENTS = [
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36',
+    'AppleCoreMedia/1.0.0.21F90 (Apple TV; U; CPU OS 17_5 like Mac OS X; en_us)',
+    'ExoPlayerLib/2.19.1',
+    '-',
+]
+
+
+def generate_logs(lines, seed=42, m3u8_ratio=0.3, ts_ratio=0.5, hit_ratio=0.85, error_ratio=0.02,
+                  channels=40, sessions=2000, start=datetime(2025, 10, 10, 8, 0, 0)):
+    """
+    Return synthetic log bytes. Requests are spread over one hour per 500k
+    lines, and sessions keep their token, channel, IP and user agent, so
+    cardinalities look like the real CDN logs.
+    """
+    rng = random.Random(seed)
+    viewers = []
+    for _ in range(sessions):
+        viewers.append((
+            ''.join(rng.choice('abcdef0123456789') for _ in range(32)),
+            rng.randint(1, channels),
+            f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            rng.choice(USER_AGENTS),
+        ))
+    span = max(1, lines * 3600 // 500000)
+    out = []
+    for i in range(lines):
+        token, channel, client_ip, user_agent = rng.choice(viewers)
+        moment = start + timedelta(seconds=i * span // lines)
+        kind = rng.random()
+        if kind < m3u8_ratio:
+            name = rng.choice(PLAYLISTS + ['720p/chunklist.m3u8', '1080p/chunklist.m3u8'])
+            file_type, size = 'application/vnd.apple.mpegurl', rng.randint(300, 3000)
+        elif kind < m3u8_ratio + ts_ratio:
+            name = f"720p/segment_{i // 100}.ts"
+            file_type, size = 'video/mp2t', rng.randint(200000, 2500000)
+        else:
+            name = f"1080p/segment_{i // 100}.mp4"
+            file_type, size = 'video/mp4', rng.randint(300000, 3500000)
+        if rng.random() < error_ratio:
+            status, size = rng.choice(ERROR_STATUSES), 0
+        else:
+            status = 206 if rng.random() < 0.03 else 200
+        cache = 'HIT' if rng.random() < hit_ratio else rng.choice(CACHE_STATUSES[1:])
+        response_time = int(rng.lognormvariate(4.5, 1.2))
+        url = f"http://alibaba-live.servers8.com/{token}/live/ch{channel:02d}/{name}"
+        out.append(
+            f"[{moment.strftime('%d/%b/%Y:%H:%M:%S')} +0800] {client_ip} - {response_time} \"-\" "
+            f"\"GET {url}\" {status} {rng.randint(200, 900)} {size} {cache} \"{user_agent}\" "
+            f"\"{file_type}\" 47.246.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        )
+    return ('\n'.join(out) + '\n').encode('utf-8')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux; children covers the parse worker processes
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(self_rss, child_rss) / 1024, 1)
+
+
+def rate(rows, size, seconds):
+    seconds = max(seconds, 1e-9)
+    return {
+        'seconds': round(seconds, 3),
+        'rows_per_sec': int(rows / seconds),
+        'mb_per_sec': round(size / seconds / 1024 / 1024, 1),
+    }
+
+
+def bench_parse_line(data, sample_lines):
+    lines = data.decode('utf-8').splitlines()[:sample_lines]
+    start = time.perf_counter()
+    for line in lines:
+        parse_log_line(line.strip())
+    elapsed = time.perf_counter() - start
+    return rate(len(lines), sum(len(line) + 1 for line in lines), elapsed)
+
+
+class NullWriter:
+    def __init__(self):
+        self.tables = []
+
+    def write_table(self, table):
+        self.tables.append(table)
+
+
+def bench_process_chunk(data, block_bytes):
+    from converter import process_chunk
+
+    writer = NullWriter()
+    rows = 0
+    start = time.perf_counter()
+    offset = 0
+    while offset < len(data):
+        end = len(data)
+        if offset + block_bytes < len(data):
+            end = data.rfind(b'\n', offset, offset + block_bytes) + 1 or len(data)
+        processed, _ = process_chunk(writer, data[offset:end])
+        rows += processed
+        offset = end
+    elapsed = time.perf_counter() - start
+    table = pa.concat_tables(writer.tables) if writer.tables else None
+    return rate(rows, len(data), elapsed), table
+
+
+def bench_codecs(table):
+    results = {}
+    for codec in CODECS:
+        sink = pa.BufferOutputStream()
+        start = time.perf_counter()
+        pq.write_table(table, sink, compression=codec)
+        elapsed = time.perf_counter() - start
+        results[codec] = {
+            'bytes': sink.getvalue().size,
+            'seconds': round(elapsed, 3),
+            'bytes_per_row': round(sink.getvalue().size / max(table.num_rows, 1), 1),
+        }
+    return results
+
+
+def bench_end_to_end(data, workers):
+    try:
+        from moto import mock_aws
+    except ImportError:
+        print("⚠️  moto not installed, skipping end-to-end benchmark (pip install moto)")
+        return None
+    import boto3
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    compressed = gzip.compress(data, 6)
+    key = 'alibaba-cdn/alibaba-cdn_partitioned/year=2025/month=10/day=10/benchmark.log.gz'
+
+    with mock_aws():
+        import lambda_function
+
+        s3_client = boto3.client('s3')
+        s3_client.create_bucket(Bucket=BENCH_BUCKET)
+        s3_client.put_object(Bucket=BENCH_BUCKET, Key=key, Body=compressed)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lambda_function.process_file_in_chunks(s3_client, None, BENCH_BUCKET, key,
+                                                   '2025', '10', '10', workers=workers)
+        elapsed = time.perf_counter() - start
+
+        outputs = {}
+        for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=BENCH_BUCKET):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith('.parquet'):
+                    outputs[obj['Key']] = obj['Size']
+
+    result = rate(data.count(b'\n'), len(data), elapsed)
+    result.update({'workers': workers, 'gz_bytes': len(compressed), 'outputs': outputs})
+    return result
+
+
+def compare(results, baseline, tolerance):
+    # Flag throughput drops and size growth beyond the tolerance
+    regressions = []
+    for name in ('parse_log_line', 'process_chunk', 'end_to_end'):
+        old, new = baseline.get(name), results.get(name)
+        if old and new and new['rows_per_sec'] < old['rows_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {old['rows_per_sec']} -> {new['rows_per_sec']} rows/sec")
+    for codec, new in results.get('codecs', {}).items():
+        old = baseline.get('codecs', {}).get(codec)
+        if old and new['bytes_per_row'] > old['bytes_per_row'] * (1 + tolerance):
+            regressions.append(f"{codec}: {old['bytes_per_row']} -> {new['bytes_per_row']} bytes/row")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Alibaba CDN log to Parquet converter')
+    parser.add_argument('--lines', type=int, default=500000, help='Synthetic log lines to generate')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--m3u8-ratio', type=float, default=0.3)
+    parser.add_argument('--hit-ratio', type=float, default=0.85)
+    parser.add_argument('--error-ratio', type=float, default=0.02)
+    parser.add_argument('--line-sample', type=int, default=100000, help='Lines timed through parse_log_line')
+    parser.add_argument('--block-mb', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parse workers for end to end')
+    parser.add_argument('--skip-e2e', action='store_true')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--baseline', help='Compare against a previous --json output')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed regression (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    print(f"🧪 Generating {args.lines} synthetic log lines...")
+    data = generate_logs(args.lines, seed=args.seed, m3u8_ratio=args.m3u8_ratio,
+                         hit_ratio=args.hit_ratio, error_ratio=args.error_ratio)
+    print(f"   {len(data) / 1024 / 1024:.1f} MB uncompressed")
+
+    results = {'lines': args.lines, 'bytes': len(data), 'python': sys.version.split()[0],
+               'pyarrow': pa.__version__, 'cpus': os.cpu_count()}
+
+    results['parse_log_line'] = bench_parse_line(data, args.line_sample)
+    print(f"⏱️  parse_log_line: {results['parse_log_line']}")
+
+    results['process_chunk'], table = bench_process_chunk(data, args.block_mb * 1024 * 1024)
+    print(f"⏱️  process_chunk: {results['process_chunk']}")
+
+    if table is not None:
+        results['codecs'] = bench_codecs(table)
+        for codec, stats in results['codecs'].items():
+            print(f"🗜️  {codec:<7} {stats['bytes'] / 1024 / 1024:8.1f} MB  "
+                  f"{stats['bytes_per_row']:6.1f} B/row  {stats['seconds']:.2f}s")
+        del table
+
+    if not args.skip_e2e:
+        results['end_to_end'] = bench_end_to_end(data, args.workers)
+        if results['end_to_end']:
+            print(f"⏱️  process_file_in_chunks: {results['end_to_end']}")
+
+    results['peak_rss_mb'] = peak_rss_mb()
+    print(f"📈 Peak RSS: {results['peak_rss_mb']} MB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Regressions against baseline:")
+            for regression in regressions:
+                print(f"   {regression}")
+            sys.exit(1)
+        print("✅ No regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
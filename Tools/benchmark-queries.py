@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 import boto3
-import time
+from athena_runner import AthenaQueryError, AthenaRunner
 
 def benchmark_queries():
     session = boto3.Session(profile_name='spl')
@@ -10,38 +10,19 @@ def benchmark_queries():
     database_name = 'cdn_logs_alibaba_partitioned'
     result_location = f's3://{bucket_name}/athena-results/'
     
-    def run_timed_query(query, description):
-        print(f"\n🔍 Running {description}...")
-        start_time = time.time()
-        
-        response = athena.start_query_execution(
-            QueryString=query,
-            ResultConfiguration={'OutputLocation': result_location}
-        )
-        
-        query_id = response['QueryExecutionId']
-        while True:
-            result = athena.get_query_execution(QueryExecutionId=query_id)
-            status = result['QueryExecution']['Status']['State']
-            if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                break
-            time.sleep(1)
-        
-        end_time = time.time()
-        duration = end_time - start_time
-        
-        if status == 'SUCCEEDED':
-            # Get data scanned
-            stats = result['QueryExecution']['Statistics']
-            data_scanned = stats.get('DataScannedInBytes', 0) / (1024**3)  # GB
-            print(f"✅ {description}: {duration:.1f}s | {data_scanned:.2f}GB scanned")
-        else:
-            # Get detailed error information
-            error_info = result['QueryExecution']['Status'].get('StateChangeReason', 'No error details available')
-            print(f"❌ {description} failed: {status}")
-            print(f"   Error: {error_info}")
-        
-        return duration, status == 'SUCCEEDED'
+    runner = AthenaRunner(athena, result_location)
+    
+    def report(execution, description):
+        # Engine time is not skewed by queueing or by running both queries at once
+        if isinstance(execution, AthenaQueryError):
+            print(f"❌ {description} failed: {execution.state}")
+            print(f"   Error: {execution.reason}")
+            return None, False
+        stats = execution['Statistics']
+        duration = stats.get('EngineExecutionTimeInMillis', 0) / 1000
+        data_scanned = stats.get('DataScannedInBytes', 0) / (1024**3)  # GB
+        print(f"✅ {description}: {duration:.1f}s | {data_scanned:.2f}GB scanned")
+        return duration, True
     
     # Simple total volume query - using broader date range to find actual data
     base_query = """
@@ -65,11 +46,13 @@ def benchmark_queries():
     print(f"📊 Benchmarking total volume query (Oct 2025)")
     print("=" * 50)
     
-    # Run original query
-    orig_time, orig_success = run_timed_query(original_query, "Original (gzipped)")
-    
-    # Run parquet query
-    parquet_time, parquet_success = run_timed_query(parquet_query, "Parquet optimized")
+    # Run both queries at once, without Athena result reuse (it would skip the scan)
+    original, parquet = runner.run_many(
+        [(original_query, "Original (gzipped)"), (parquet_query, "Parquet optimized")],
+        reuse=False, raise_on_error=False,
+    )
+    orig_time, orig_success = report(original, "Original (gzipped)")
+    parquet_time, parquet_success = report(parquet, "Parquet optimized")
     
     # Show comparison
     if orig_success and parquet_success:
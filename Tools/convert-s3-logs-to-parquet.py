@@ -4,7 +4,7 @@ Convert existing S3 CDN logs to Parquet format using Athena CTAS
 This is the fastest way to convert your existing partitioned logs
 """
 import boto3
-import time
+from athena_runner import AthenaRunner
 
 def convert_logs_to_parquet():
     session = boto3.Session(profile_name='spl')
@@ -16,30 +16,7 @@ def convert_logs_to_parquet():
     database_name = 'cdn_logs_alibaba_parquet'
     result_location = f's3://{bucket_name}/athena-results/'
     
-    def run_query(query, description):
-        print(f"{description}...")
-        response = athena.start_query_execution(
-            QueryString=query,
-            ResultConfiguration={'OutputLocation': result_location}
-        )
-        query_id = response['QueryExecutionId']
-        
-        # Wait for completion
-        while True:
-            result = athena.get_query_execution(QueryExecutionId=query_id)
-            status = result['QueryExecution']['Status']['State']
-            if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                break
-            time.sleep(5)
-            print(f"  Status: {status}")
-        
-        if status == 'FAILED':
-            error = result['QueryExecution']['Status'].get('StateChangeReason', 'Unknown error')
-            print(f"❌ Query failed: {error}")
-            return None
-        
-        print(f"✅ {description} completed")
-        return query_id
+    runner = AthenaRunner(athena, result_location)
     
     # First, create a temporary table to read from your existing partitioned logs
     temp_table_query = f"""
@@ -67,15 +44,18 @@ def convert_logs_to_parquet():
     )
     ROW FORMAT SERDE 'org.apache.hadoop.hive.serde2.RegexSerDe'
     WITH SERDEPROPERTIES (
-        'input.regex' = '\\\\[([^\\\\s]+)\\\\s+([^\\\\]]+)\\\\]\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+"([^"]*)"\\\\s+"([^\\\\s]+)\\\\s+([^\\\\s]+)"\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+"([^"]*)"\\\\s+"([^"]*)"\\\\s+([^\\\\s]+)'
+        'input.regex' = '\\\\[([^\\\\s]+)\\\\s+([^\\\\]]+)\\\\]\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+"([^"]*)"\\\\s+"([^\\\\s]+)\\\\s+([^"]*?)"\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+([^\\\\s]+)\\\\s+"([^"]*)"\\\\s+"([^"]*)"\\\\s+([^\\\\s]+)'
     )
     LOCATION 's3://{bucket_name}/{source_logs_path}/'
     TBLPROPERTIES (
       'has_encrypted_data'='false',
       'compressionType'='gzip',
       'projection.enabled'='true',
-      'projection.year.type'='integer',
-      'projection.year.range'='2024,2026',
+      'projection.year.type'='date',
+      'projection.year.format'='yyyy',
+      'projection.year.range'='2024,NOW',
+      'projection.year.interval'='1',
+      'projection.year.interval.unit'='YEARS',
       'projection.month.type'='integer',
       'projection.month.range'='01,12',
       'projection.month.digits'='2',
@@ -86,10 +66,10 @@ def convert_logs_to_parquet():
     )
     """
     
-    run_query(temp_table_query, "Creating temporary table to read existing logs")
+    runner.run(temp_table_query, "Creating temporary table to read existing logs")
     
-    # Repair table to load partitions
-    run_query(f"MSCK REPAIR TABLE {database_name}.temp_alibaba_logs", "Loading partitions")
+    # No MSCK REPAIR needed: partition projection derives the partitions, up
+    # to the current year
     
     # Convert to Parquet using CTAS (Create Table As Select)
     ctas_query = f"""
@@ -129,7 +109,11 @@ def convert_logs_to_parquet():
     print("🚀 Starting conversion to Parquet format...")
     print("⏳ This may take several minutes depending on data size...")
     
-    run_query(ctas_query, "Converting logs to Parquet format")
+    try:
+        runner.run(ctas_query, "Converting logs to Parquet format")
+    finally:
+        # Clean up temporary table, also when the conversion failed
+        runner.run(f"DROP TABLE IF EXISTS {database_name}.temp_alibaba_logs", "Cleaning up temporary table")
     
     # Create optimized view
     view_query = f"""
@@ -168,10 +152,7 @@ def convert_logs_to_parquet():
     FROM {database_name}.alibaba_cdn_logs_parquet
     """
     
-    run_query(view_query, "Creating optimized view")
-    
-    # Clean up temporary table
-    run_query(f"DROP TABLE {database_name}.temp_alibaba_logs", "Cleaning up temporary table")
+    runner.run(view_query, "Creating optimized view")
     
     print("\n✅ Conversion complete!")
     print(f"📊 Database: {database_name}")
@@ -190,7 +171,10 @@ def convert_logs_to_parquet():
     """
     
     print("\n🔍 Running verification query...")
-    run_query(test_query, "Verifying converted data")
+    execution = runner.run(test_query, "Verifying converted data", reuse=False)
+    for row in runner.iter_rows(execution['QueryExecutionId']):
+        for name, value in row.items():
+            print(f"   {name}: {value}")
 
 if __name__ == "__main__":
     convert_logs_to_parquet()
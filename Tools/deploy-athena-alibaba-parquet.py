@@ -4,7 +4,7 @@ Athena deployment with Parquet format for alibaba-live CDN logs
 Parquet provides better compression, columnar storage, and faster queries
 """
 import boto3
-import time
+from athena_runner import AthenaRunner
 """
 old way to create table
 CREATE EXTERNAL TABLE cdn_logs_alibaba_live.alibaba_cdn_logs (
@@ -31,7 +31,7 @@ CREATE EXTERNAL TABLE cdn_logs_alibaba_live.alibaba_cdn_logs (
     )
     ROW FORMAT SERDE 'org.apache.hadoop.hive.serde2.RegexSerDe'
     WITH SERDEPROPERTIES (
-        'input.regex' = '\\[([^\\s]+)\\s+([^\\]]+)\\]\\s+([^\\s]+)\\s+([^\\s]+)\\s+([^\\s]+)\\s+"([^"]*)"\\s+"([^\\s]+)\\s+([^\\s]+)"\\s+([^\\s]+)\\s+([^\\s]+)\\s+([^\\s]+)\\s+([^\\s]+)\\s+"([^"]*)"\\s+"([^"]*)"\\s+([^\\s]+)'
+        'input.regex' = '\\[([^\\s]+)\\s+([^\\]]+)\\]\\s+([^\\s]+)\\s+([^\\s]+)\\s+([^\\s]+)\\s+"([^"]*)"\\s+"([^\\s]+)\\s+([^"]*?)"\\s+([^\\s]+)\\s+([^\\s]+)\\s+([^\\s]+)\\s+([^\\s]+)\\s+"([^"]*)"\\s+"([^"]*)"\\s+([^\\s]+)'
     )
     LOCATION 's3://spl-live-foundationstack-hostingvideofilebucketc54-s8wpjvayhncf/logs/alibaba-live-cdn/'
     TBLPROPERTIES (
@@ -58,28 +58,28 @@ def setup_athena_parquet():
     logs_path = "logs/alibaba-cdn_parquet/"
     database_name = 'cdn_logs_alibaba_parquet'
     result_location = f's3://{bucket_name}/athena-results/'
+    rollups_location = "spl-live-cdn-logs/alibaba-cdn/alibaba-cdn_rollups"
+    sketches_location = "spl-live-cdn-logs/alibaba-cdn/alibaba-cdn_sketches"
     
-    def run_query(query, description):
-        print(f"{description}...")
-        response = athena.start_query_execution(
-            QueryString=query,
-            ResultConfiguration={'OutputLocation': result_location}
-        )
-        time.sleep(3)
-        return response['QueryExecutionId']
+    # Waits for each statement and stops on the first failure
+    runner = AthenaRunner(athena, result_location)
     
     # Drop and recreate database
-    run_query(f"DROP DATABASE IF EXISTS {database_name} CASCADE", "Dropping database")
-    run_query(f"CREATE DATABASE {database_name}", "Creating database")
+    runner.run(f"DROP DATABASE IF EXISTS {database_name} CASCADE", "Dropping database")
+    runner.run(f"CREATE DATABASE {database_name}", "Creating database")
     
-    # Create Parquet table with optimized schema
+    # Create Parquet table with optimized schema. Matches log_parser.LOG_SCHEMA:
+    # dictionary columns are plain STRING to Athena, and response_time (int32)
+    # and http_status (int16) widen to BIGINT/INT, as in files written before
+    # those types were narrowed. The year is projected as a date up to NOW, so
+    # new years never need a redeploy
     create_table = f"""
     CREATE EXTERNAL TABLE {database_name}.alibaba_cdn_logs_parquet (
-      date_time TIMESTAMP,
+      date_time STRING,
       timezone STRING,
       client_ip STRING,
       proxy_ip STRING,
-      response_time DOUBLE,
+      response_time BIGINT,
       referrer STRING,
       http_method STRING,
       request_url STRING,
@@ -89,7 +89,15 @@ def setup_athena_parquet():
       cache_status STRING,
       user_agent STRING,
       file_type STRING,
-      access_ip STRING
+      access_ip STRING,
+      event_time TIMESTAMP,
+      event_minute TIMESTAMP,
+      event_hour TIMESTAMP,
+      channel_id STRING,
+      request_kind STRING,
+      playlist STRING,
+      status_class STRING,
+      session_token STRING
     )
     PARTITIONED BY (
       year STRING,
@@ -102,8 +110,11 @@ def setup_athena_parquet():
       'has_encrypted_data'='false',
       'parquet.compression'='SNAPPY',
       'projection.enabled'='true',
-      'projection.year.type'='integer',
-      'projection.year.range'='2024,2026',
+      'projection.year.type'='date',
+      'projection.year.format'='yyyy',
+      'projection.year.range'='2024,NOW',
+      'projection.year.interval'='1',
+      'projection.year.interval.unit'='YEARS',
       'projection.month.type'='integer',
       'projection.month.range'='01,12',
       'projection.month.digits'='2',
@@ -114,8 +125,6 @@ def setup_athena_parquet():
     )
     """
     
-    run_query(create_table, "Creating Parquet table")
-    
     # Create a view for easier querying with proper data types
     create_view = f"""
     CREATE OR REPLACE VIEW {database_name}.alibaba_cdn_logs_view AS
@@ -135,17 +144,25 @@ def setup_athena_parquet():
       user_agent,
       file_type,
       access_ip,
+      event_time,
+      event_minute,
+      event_hour,
+      channel_id,
+      request_kind,
+      playlist,
+      session_token,
       year,
       month,
       day,
-      -- Add computed columns for common queries
-      CASE 
+      -- Add computed columns for common queries (status_class is precomputed
+      -- at ingest, the CASE only covers files written before it existed)
+      COALESCE(status_class, CASE 
         WHEN http_status BETWEEN 200 AND 299 THEN '2xx'
         WHEN http_status BETWEEN 300 AND 399 THEN '3xx'
         WHEN http_status BETWEEN 400 AND 499 THEN '4xx'
         WHEN http_status BETWEEN 500 AND 599 THEN '5xx'
         ELSE 'other'
-      END as status_category,
+      END) as status_category,
       -- Extract domain from request_url
       regexp_extract(request_url, 'https?://([^/]+)', 1) as domain,
       -- Extract file extension
@@ -153,21 +170,129 @@ def setup_athena_parquet():
     FROM {database_name}.alibaba_cdn_logs_parquet
     """
     
-    run_query(create_view, "Creating optimized view")
+    # Per-minute KPI rollups written by the converter next to the Parquet logs
+    # (minute x channel x file_type x cache_status x http_status), projected
+    # like the logs table
+    create_rollup_table = f"""
+    CREATE EXTERNAL TABLE IF NOT EXISTS {database_name}.alibaba_cdn_rollup_minute (
+      event_minute TIMESTAMP,
+      channel_id STRING,
+      file_type STRING,
+      cache_status STRING,
+      http_status INT,
+      requests BIGINT,
+      request_bytes BIGINT,
+      response_bytes BIGINT,
+      response_time_sum BIGINT,
+      rt_lt_100 BIGINT,
+      rt_lt_200 BIGINT,
+      rt_lt_500 BIGINT,
+      rt_lt_1000 BIGINT,
+      rt_lt_2000 BIGINT,
+      rt_lt_5000 BIGINT,
+      rt_lt_10000 BIGINT,
+      rt_lt_30000 BIGINT,
+      rt_ge_30000 BIGINT,
+      response_time_max BIGINT
+    )
+    PARTITIONED BY (
+      year STRING,
+      month STRING,
+      day STRING
+    )
+    STORED AS PARQUET
+    LOCATION 's3://{rollups_location}/'
+    TBLPROPERTIES (
+      'has_encrypted_data'='false',
+      'projection.enabled'='true',
+      'projection.year.type'='date',
+      'projection.year.format'='yyyy',
+      'projection.year.range'='2024,NOW',
+      'projection.year.interval'='1',
+      'projection.year.interval.unit'='YEARS',
+      'projection.month.type'='integer',
+      'projection.month.range'='01,12',
+      'projection.month.digits'='2',
+      'projection.day.type'='integer',
+      'projection.day.range'='01,31',
+      'projection.day.digits'='2',
+      'storage.location.template'='s3://{rollups_location}/year=${{year}}/month=${{month}}/day=${{day}}/'
+    )
+    """
+    
+    # Per-minute, per-channel sketches (sketches.py): one row per HyperLogLog
+    # register (sketch = session_token/client_ip, value = rank, merged with
+    # max) or DDSketch bucket (sketch = response_time, value = count, merged
+    # with sum). The estimates themselves come from sketches.distinct_count
+    # and sketches.quantiles
+    create_sketch_table = f"""
+    CREATE EXTERNAL TABLE IF NOT EXISTS {database_name}.alibaba_cdn_sketches_minute (
+      event_minute TIMESTAMP,
+      channel_id STRING,
+      sketch STRING,
+      key INT,
+      value BIGINT
+    )
+    PARTITIONED BY (
+      year STRING,
+      month STRING,
+      day STRING
+    )
+    STORED AS PARQUET
+    LOCATION 's3://{sketches_location}/'
+    TBLPROPERTIES (
+      'has_encrypted_data'='false',
+      'projection.enabled'='true',
+      'projection.year.type'='date',
+      'projection.year.format'='yyyy',
+      'projection.year.range'='2024,NOW',
+      'projection.year.interval'='1',
+      'projection.year.interval.unit'='YEARS',
+      'projection.month.type'='integer',
+      'projection.month.range'='01,12',
+      'projection.month.digits'='2',
+      'projection.day.type'='integer',
+      'projection.day.range'='01,31',
+      'projection.day.digits'='2',
+      'storage.location.template'='s3://{sketches_location}/year=${{year}}/month=${{month}}/day=${{day}}/'
+    )
+    """
+    
+    # The three tables are independent; the view needs the Parquet table
+    runner.run_many([
+        (create_table, "Creating Parquet table"),
+        (create_rollup_table, "Creating per-minute rollup table"),
+        (create_sketch_table, "Creating per-minute sketch table"),
+    ])
+    runner.run(create_view, "Creating optimized view")
     
     print("✅ Parquet setup complete!")
     print(f"✅ Database: {database_name}")
     print(f"✅ Table: {database_name}.alibaba_cdn_logs_parquet")
     print(f"✅ View: {database_name}.alibaba_cdn_logs_view")
+    print(f"✅ Rollups: {database_name}.alibaba_cdn_rollup_minute")
+    print(f"✅ Sketches: {database_name}.alibaba_cdn_sketches_minute")
     print("\n📊 Performance benefits:")
     print("  • Columnar storage for faster analytics")
     print("  • Snappy compression for reduced storage costs")
     print("  • Optimized data types (INT, BIGINT, TIMESTAMP)")
+    print("  • event_time is already UTC (no date_parse / -8h shift needed)")
     print("  • Pre-computed status categories and domain extraction")
+    print("  • channel_id, request_kind, playlist and session_token stored at ingest (no regexp_extract)")
     print("\n💡 Usage example:")
     print(f"  SELECT * FROM {database_name}.alibaba_cdn_logs_view")
     print("  WHERE year = '2024' AND month = '12' AND status_category = '4xx'")
+    print("    AND event_time >= TIMESTAMP '2024-12-01 00:00:00'")
     print("  LIMIT 10;")
+    print("\n💡 Long ranges (weeks) should read the rollups instead:")
+    print(f"  SELECT date_trunc('hour', event_minute) AS time, SUM(requests) / 3600.0 AS rps,")
+    print("         SUM(response_bytes) * 8 / 1048576.0 / 3600 AS mbps, MAX(response_time_max) AS max_rt")
+    print(f"  FROM {database_name}.alibaba_cdn_rollup_minute")
+    print("  WHERE year = '2024' AND month = '12' GROUP BY 1 ORDER BY 1;")
+    print("\n💡 Merged sketches (max for HyperLogLog registers, sum for DDSketch buckets):")
+    print("  SELECT channel_id, sketch, key, IF(sketch = 'response_time', SUM(value), MAX(value)) AS value")
+    print(f"  FROM {database_name}.alibaba_cdn_sketches_minute")
+    print("  WHERE year = '2024' AND month = '12' GROUP BY 1, 2, 3;")
 
 if __name__ == "__main__":
     setup_athena_parquet()
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Local KPI query service over the Parquet lake, for dashboard panels that
+cannot wait for Athena's queue and startup latency.
+
+    python Tools/kpi-query-server.py --profile spl --port 8088
+    python Tools/kpi-query-server.py --source rollups              # minute rollups, cheapest
+    python Tools/kpi-query-server.py --root /data/alibaba-cdn_parquet   # local copy of the layout
+
+    curl 'localhost:8088/kpi/requests?from=2025-10-10T08:00:00Z&to=2025-10-10T09:00:00Z'
+    curl 'localhost:8088/kpi/channels?from=${__from}&to=${__to}&playlist=index.m3u8'
+
+Endpoints (all take from / to as ISO 8601 or epoch milliseconds, default the
+last hour, plus optional step=minute|hour|day, channel= and playlist=):
+  /kpi/requests    requests and requests per second per time bucket
+  /kpi/bandwidth   response bytes and Mbps per time bucket
+  /kpi/cache       HIT (+HIT-REFRESH), MISS and EXPIRED ratios per time bucket
+  /kpi/status      share of each HTTP status over the range
+  /kpi/channels    requests per channel per time bucket
+  /kpi/summary     totals over the range
+Times in the responses are epoch milliseconds (UTC), ready for the Grafana
+JSON/Infinity datasources.
+
+How a query is answered:
+- Only the year=/month=/day= directories the time range can touch are
+  listed (KPI_PARTITION_SLACK_HOURS, default 8, covers files named after the
+  CDN's UTC+8 day). Listings are kept KPI_LISTING_TTL seconds (30).
+- Row groups are sorted by event_minute and carry statistics, so
+  split_by_row_group() skips the ones outside the range without reading them.
+- Each row group read is reduced straight away to one row per minute x
+  channel x cache status x HTTP status x playlist, and kept in an in-memory
+  LRU (KPI_CACHE_MB, default 512) keyed by file path, size, mtime and row
+  group. Parquet files are immutable, so a refresh of the last hour only
+  reads the row groups written since the previous refresh.
+- Row groups are fetched on KPI_READ_WORKERS threads (8).
+Results have minute resolution. Files converted before event_minute existed
+are skipped (and counted as skipped_files).
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import boto3
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+DEFAULT_BUCKET = 'spl-live-cdn-logs'
+SOURCE_PREFIXES = {
+    'parquet': 'alibaba-cdn/alibaba-cdn_parquet',
+    'rollups': 'alibaba-cdn/alibaba-cdn_rollups',
+}
+CACHE_MB = int(os.environ.get('KPI_CACHE_MB', '512'))
+LISTING_TTL = int(os.environ.get('KPI_LISTING_TTL', '30'))
+READ_WORKERS = int(os.environ.get('KPI_READ_WORKERS', '8'))
+PARTITION_SLACK_HOURS = int(os.environ.get('KPI_PARTITION_SLACK_HOURS', '8'))
+# Parquet footers kept in memory, so row group pruning does not re-read them
+METADATA_ENTRIES = 20000
+
+# Dimensions every cached row group is reduced to
+KEYS = ['event_minute', 'channel_id', 'cache_status', 'http_status', 'playlist']
+STEP_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+# Same groups as the "Cache Hit Ratio" panel
+CACHE_HIT = ('HIT', 'HIT-REFRESH')
+_REDUCED_SCHEMA = pa.schema([
+    ('event_minute', pa.timestamp('ms')),
+    ('channel_id', pa.string()),
+    ('cache_status', pa.string()),
+    ('http_status', pa.int32()),
+    ('playlist', pa.string()),
+    ('requests', pa.int64()),
+    ('response_bytes', pa.int64()),
+])
+
+
+class QueryError(ValueError):
+    pass
+
+
+class RowGroupCache:
+    """Thread-safe LRU of reduced row groups, bounded by their Arrow size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            table = self._entries.get(key)
+            if table is not None:
+                self._entries.move_to_end(key)
+            return table
+
+    def put(self, key, table):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = table
+            self._bytes += table.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def stats(self):
+        with self._lock:
+            return {'row_groups': len(self._entries), 'megabytes': round(self._bytes / (1024 * 1024), 1)}
+
+
+def _reduce(table, source):
+    # One row per minute and dimension; a 100k line row group shrinks to a few thousand rows
+    if source == 'rollups':
+        columns = {name: table[name] for name in KEYS if name in table.column_names}
+        columns['playlist'] = pa.nulls(table.num_rows, pa.string())
+        columns['requests'] = table['requests']
+    else:
+        columns = {name: table[name] for name in KEYS}
+        columns['requests'] = pa.nulls(table.num_rows, pa.int64()).fill_null(1)
+    columns['response_bytes'] = table['response_bytes']
+    table = pa.table({name: pc.cast(columns[name], _REDUCED_SCHEMA.field(name).type) for name in _REDUCED_SCHEMA.names})
+    grouped = table.group_by(KEYS, use_threads=False).aggregate([('requests', 'sum'), ('response_bytes', 'sum')])
+    return grouped.rename_columns([name[:-4] if name.endswith('_sum') else name for name in grouped.column_names])
+
+
+class KpiStore:
+    """Partition-pruned, row-group-cached reads of one year=/month=/day= layout."""
+
+    def __init__(self, filesystem, root, source='parquet', cache_mb=CACHE_MB, workers=READ_WORKERS):
+        self.filesystem = filesystem
+        self.root = root.rstrip('/')
+        self.source = source
+        self.format = ds.ParquetFileFormat()
+        self.cache = RowGroupCache(cache_mb * 1024 * 1024)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._listings = {}
+        self._metadata = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _columns(self):
+        if self.source == 'rollups':
+            return ['event_minute', 'channel_id', 'cache_status', 'http_status', 'requests', 'response_bytes']
+        return KEYS + ['response_bytes']
+
+    def _days(self, start, end):
+        slack = timedelta(hours=PARTITION_SLACK_HOURS)
+        day = (start - slack).date()
+        last = (end + slack).date()
+        while day <= last:
+            yield day
+            day += timedelta(days=1)
+
+    def _list_day(self, day):
+        path = f"{self.root}/year={day:%Y}/month={day:%m}/day={day:%d}"
+        with self._lock:
+            cached = self._listings.get(path)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        selector = pafs.FileSelector(path, allow_not_found=True, recursive=False)
+        files = [
+            (info.path, info.size, info.mtime_ns)
+            for info in self.filesystem.get_file_info(selector)
+            if info.type == pafs.FileType.File and info.path.endswith('.parquet')
+            # Hidden objects (_compacting-* staging files...) are skipped, as Athena and pyarrow do
+            and not info.base_name.startswith(('_', '.'))
+        ]
+        with self._lock:
+            self._listings[path] = (time.monotonic() + LISTING_TTL, files)
+        return files
+
+    def _fragment(self, file):
+        with self._lock:
+            fragment = self._metadata.get(file)
+            if fragment is not None:
+                self._metadata.move_to_end(file)
+                return fragment
+        fragment = self.format.make_fragment(file[0], self.filesystem)
+        fragment.ensure_complete_metadata()
+        with self._lock:
+            self._metadata[file] = fragment
+            while len(self._metadata) > METADATA_ENTRIES:
+                self._metadata.popitem(last=False)
+        return fragment
+
+    def _row_groups(self, file, time_filter):
+        fragment = self._fragment(file)
+        if 'event_minute' not in fragment.physical_schema.names:
+            return None
+        # Row group statistics on event_minute drop everything outside the range
+        return [(file, piece.row_groups[0].id, piece) for piece in fragment.split_by_row_group(time_filter)]
+
+    def _read(self, file, row_group, piece):
+        key = (self.source, file, row_group)
+        table = self.cache.get(key)
+        if table is not None:
+            return table, True
+        table = _reduce(piece.to_table(columns=self._columns(), use_threads=False), self.source)
+        self.cache.put(key, table)
+        return table, False
+
+    def load(self, start, end):
+        """Reduced rows with start <= event_minute <= end, and read statistics."""
+        first = start.replace(second=0, microsecond=0)
+        lower = pa.scalar(first, pa.timestamp('ms'))
+        upper = pa.scalar(end, pa.timestamp('ms'))
+        time_filter = (ds.field('event_minute') >= lower) & (ds.field('event_minute') <= upper)
+        try:
+            return self._load(start, end, time_filter, lower, upper)
+        except FileNotFoundError:
+            # A listed file was replaced (e.g. by compaction): list again once
+            with self._lock:
+                self._listings.clear()
+            return self._load(start, end, time_filter, lower, upper)
+
+    def _load(self, start, end, time_filter, lower, upper):
+        files = [file for day in self._days(start, end) for file in self._list_day(day)]
+        pieces = []
+        skipped = 0
+        for row_groups in self.pool.map(lambda file: self._row_groups(file, time_filter), files):
+            if row_groups is None:
+                skipped += 1
+            else:
+                pieces.extend(row_groups)
+        results = list(self.pool.map(lambda piece: self._read(*piece), pieces))
+        tables = [table for table, _ in results if table.num_rows]
+        table = pa.concat_tables(tables) if tables else _REDUCED_SCHEMA.empty_table()
+        table = table.filter(pc.and_(pc.greater_equal(table['event_minute'], lower),
+                                     pc.less_equal(table['event_minute'], upper)))
+        stats = {
+            'files': len(files),
+            'skipped_files': skipped,
+            'row_groups': len(pieces),
+            'cached_row_groups': sum(1 for _, cached in results if cached),
+        }
+        return table, stats
+
+
+def parse_time(value, default):
+    if not value:
+        return default
+    if value.isdigit():
+        # Grafana's ${__from} / ${__to} are epoch milliseconds
+        return datetime.utcfromtimestamp(int(value) / 1000)
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise QueryError(f"Invalid time: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def default_step(start, end):
+    # Same buckets as the dashboard: minutes up to 24 hours, then hours
+    return 'minute' if end - start <= timedelta(hours=24) else 'hour'
+
+
+def _bucketed(table, step, keys=()):
+    times = pc.floor_temporal(table['event_minute'], unit=step)
+    table = table.append_column('time', times)
+    grouped = table.group_by(['time'] + list(keys), use_threads=False).aggregate(
+        [('requests', 'sum'), ('response_bytes', 'sum')]
+    )
+    grouped = grouped.set_column(grouped.schema.get_field_index('time'), 'time', pc.cast(grouped['time'], pa.int64()))
+    return grouped.sort_by([('time', 'ascending')] + [(key, 'ascending') for key in keys]).to_pylist()
+
+
+def _channel_label(channel_id):
+    # Same label as the "Total Request per channel" panel
+    return f"ch{int(channel_id):02d}" if channel_id else 'unknown'
+
+
+def kpi_requests(table, step, start, end):
+    seconds = STEP_SECONDS[step]
+    return [{'time': row['time'], 'requests': row['requests_sum'],
+             'requests_per_second': round(row['requests_sum'] / seconds, 3)} for row in _bucketed(table, step)]
+
+
+def kpi_bandwidth(table, step, start, end):
+    seconds = STEP_SECONDS[step]
+    return [{'time': row['time'], 'bytes': row['response_bytes_sum'],
+             'mbps': round(row['response_bytes_sum'] * 8 / (1024 * 1024) / seconds, 3)}
+            for row in _bucketed(table, step)]
+
+
+def kpi_cache(table, step, start, end):
+    table = table.filter(pc.not_equal(table['cache_status'], '-'))
+    buckets = OrderedDict()
+    for row in _bucketed(table, step, ['cache_status']):
+        counts = buckets.setdefault(row['time'], {})
+        counts[row['cache_status']] = row['requests_sum']
+    rows = []
+    for bucket, counts in buckets.items():
+        total = sum(counts.values()) or 1
+        rows.append({
+            'time': bucket,
+            'hit_ratio': round(sum(counts.get(status, 0) for status in CACHE_HIT) * 100.0 / total, 2),
+            'miss_ratio': round(counts.get('MISS', 0) * 100.0 / total, 2),
+            'expired_ratio': round(counts.get('EXPIRED', 0) * 100.0 / total, 2),
+        })
+    return rows
+
+
+def kpi_status(table, step, start, end):
+    grouped = table.group_by(['http_status'], use_threads=False).aggregate([('requests', 'sum')])
+    total = sum(grouped['requests_sum'].to_pylist()) or 1
+    rows = [{'status': row['http_status'], 'requests': row['requests_sum'],
+             'percentage': round(row['requests_sum'] * 100.0 / total, 2)} for row in grouped.to_pylist()]
+    return sorted(rows, key=lambda row: -row['requests'])
+
+
+def kpi_channels(table, step, start, end):
+    return [{'time': row['time'], 'channel': _channel_label(row['channel_id']), 'requests': row['requests_sum']}
+            for row in _bucketed(table, step, ['channel_id'])]
+
+
+def kpi_summary(table, step, start, end):
+    requests = pc.sum(table['requests']).as_py() or 0
+    response_bytes = pc.sum(table['response_bytes']).as_py() or 0
+    cached = table.filter(pc.not_equal(table['cache_status'], '-'))
+    hits = cached.filter(pc.is_in(cached['cache_status'], pa.array(CACHE_HIT)))
+    errors = table.filter(pc.greater_equal(table['http_status'], 400))
+    cached_requests = pc.sum(cached['requests']).as_py() or 0
+    seconds = max((end - start).total_seconds(), 1)
+    return {
+        'requests': requests,
+        'response_bytes': response_bytes,
+        'requests_per_second': round(requests / seconds, 3),
+        'mbps': round(response_bytes * 8 / (1024 * 1024) / seconds, 3),
+        'cache_hit_ratio': round((pc.sum(hits['requests']).as_py() or 0) * 100.0 / cached_requests, 2)
+        if cached_requests else None,
+        'error_ratio': round((pc.sum(errors['requests']).as_py() or 0) * 100.0 / requests, 2) if requests else None,
+        'channels': len(pc.unique(table['channel_id'])),
+    }
+
+
+ENDPOINTS = {
+    '/kpi/requests': kpi_requests,
+    '/kpi/bandwidth': kpi_bandwidth,
+    '/kpi/cache': kpi_cache,
+    '/kpi/status': kpi_status,
+    '/kpi/channels': kpi_channels,
+    '/kpi/summary': kpi_summary,
+}
+
+
+def answer(store, path, params):
+    """Run one endpoint. Returns the JSON-serialisable response body."""
+    started = time.perf_counter()
+    if path not in ENDPOINTS:
+        raise KeyError(path)
+    end = parse_time(params.get('to'), datetime.utcnow())
+    start = parse_time(params.get('from'), end - timedelta(hours=1))
+    if start >= end:
+        raise QueryError("'from' must be before 'to'")
+    step = params.get('step') or default_step(start, end)
+    if step not in STEP_SECONDS:
+        raise QueryError(f"Invalid step: {step} (minute, hour or day)")
+    if params.get('playlist') and store.source != 'parquet':
+        raise QueryError("playlist filters need --source parquet (rollups have no playlist column)")
+
+    table, stats = store.load(start, end)
+    if params.get('channel'):
+        # "ch05", "05" and "5" all select channel_id 05
+        channel = params['channel'].lower().lstrip('ch').lstrip('0')
+        table = table.filter(pc.equal(pc.utf8_ltrim(table['channel_id'], '0'), channel))
+    if params.get('playlist'):
+        table = table.filter(pc.equal(table['playlist'], params['playlist']))
+
+    rows = ENDPOINTS[path](table, step, start, end)
+    stats['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return {
+        'from': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'to': end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'step': step,
+        'source': store.source,
+        'data': rows,
+        'stats': stats,
+    }
+
+
+def make_handler(store):
+    class KpiHandler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if url.path == '/health':
+                self._send(200, {'status': 'ok', 'source': store.source, 'cache': store.cache.stats()})
+                return
+            try:
+                body = answer(store, url.path.rstrip('/'), params)
+            except KeyError:
+                self._send(404, {'error': f"Unknown endpoint {url.path}", 'endpoints': sorted(ENDPOINTS)})
+                return
+            except QueryError as e:
+                self._send(400, {'error': str(e)})
+                return
+            except Exception as e:
+                print(f"❌ {url.path} failed: {e}")
+                self._send(500, {'error': str(e)})
+                return
+            self._send(200, body)
+            stats = body['stats']
+            print(f"⚡ {url.path} {body['from']} → {body['to']}: {stats['elapsed_ms']}ms, "
+                  f"{stats['row_groups']} row groups ({stats['cached_row_groups']} cached)")
+
+        def log_message(self, format, *args):
+            # Requests are already logged by do_GET
+            pass
+
+    return KpiHandler
+
+
+def open_filesystem(root, profile):
+    """(filesystem, path) for an s3://bucket/prefix URI or a local directory."""
+    if root.startswith('s3://'):
+        session = boto3.Session(profile_name=profile)
+        credentials = session.get_credentials().get_frozen_credentials()
+        filesystem = pafs.S3FileSystem(
+            access_key=credentials.access_key,
+            secret_key=credentials.secret_key,
+            session_token=credentials.token,
+            region=session.region_name or 'me-central-1',
+        )
+        return filesystem, root[len('s3://'):]
+    return pafs.LocalFileSystem(), os.path.abspath(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve dashboard KPIs from the Parquet lake as JSON')
+    parser.add_argument('--source', choices=sorted(SOURCE_PREFIXES), default='parquet',
+                        help='Per-request Parquet files or the per-minute rollups')
+    parser.add_argument('--bucket', default=DEFAULT_BUCKET)
+    parser.add_argument('--root', help='Override the dataset root: s3://bucket/prefix or a local directory')
+    parser.add_argument('--profile', default='spl')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--cache-mb', type=int, default=CACHE_MB)
+    parser.add_argument('--workers', type=int, default=READ_WORKERS)
+    args = parser.parse_args()
+
+    root = args.root or f"s3://{args.bucket}/{SOURCE_PREFIXES[args.source]}"
+    filesystem, path = open_filesystem(root, args.profile)
+    store = KpiStore(filesystem, path, args.source, args.cache_mb, args.workers)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(store))
+    print(f"🚀 KPI server on http://{args.host}:{args.port} over {root} "
+          f"(cache {args.cache_mb}MB, {args.workers} read workers)")
+    print(f"   Endpoints: {', '.join(sorted(ENDPOINTS))}, /health")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stopping")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Rebuild Parquet partitions from the raw logs, with the Lambda's converter.
+
+Unlike Tools/convert-s3-logs-to-parquet.py (one Athena CTAS over a
+RegexSerDe table, whose regex differs from parse_log_line and which cannot
+be rerun), this streams every raw .gz object of each day through
+converter.convert_blocks, the code path of the converter Lambda, so
+parser and schema changes can be applied to history:
+
+    python Tools/reconvert-partitions.py --start-date 2025-07-01 --end-date 2025-09-30
+    python Tools/reconvert-partitions.py --start-date 2025-10-01 --workers 16 --compact
+
+- Files are converted in --workers processes (default: all cores), one
+  source file per process, into a staging prefix
+  (alibaba-cdn/_staging/reconvert/<run-id>/) that no table reads.
+- A day is swapped in only when all of its files converted: Parquet, rollup,
+  sketch and quarantine outputs are published with compaction's journal
+  (compaction.swap_in), then the objects the day had before are deleted.
+  A swap interrupted midway is finished by the next reconversion or
+  compaction run of that day, so a partition never loses data.
+- Days with a failed file keep their current data and are listed at the end.
+  The script then exits with status 1.
+
+Run it on closed days: objects written to a partition while it is being
+reconverted are kept, so a file converted concurrently by the Lambda could
+end up twice.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT, 'lib', 'lambda', 'parquet_converter'),
+    os.path.join(ROOT, 'lib', 'lambda', 'shared'),
+]
+
+import boto3
+
+from compaction import (JOURNAL_NAME, compact_partition, delete_keys, get_days, list_objects, partition_prefix,
+                        swap_in)
+from converter import COMPACTED_INDEX_NAME, PARQUET_PREFIX, convert_blocks
+from partitions import PartitionRegistrar
+from quarantine import QUARANTINE_PREFIX
+from rollups import ROLLUP_KEYS, ROLLUP_PREFIX, merge_rollups
+from s3_reader import iter_log_blocks
+from sketches import SKETCH_KEYS, SKETCH_PREFIX, merge_sketches
+
+BUCKET = 'spl-live-cdn-logs'
+RAW_PREFIX = 'alibaba-cdn/alibaba-cdn_partitioned'
+STAGING_PREFIX = 'alibaba-cdn/_staging/reconvert'
+# Every output family convert_blocks writes, swapped together per day
+OUTPUT_PREFIXES = [PARQUET_PREFIX, ROLLUP_PREFIX, SKETCH_PREFIX, QUARANTINE_PREFIX]
+
+_s3_client = None
+
+
+def _init_worker(profile):
+    global _s3_client
+    _s3_client = boto3.Session(profile_name=profile).client('s3')
+
+
+def reconvert_file(bucket, key, size, year, month, day, staging):
+    # Runs in a pool process; parsing stays inline, the pool already uses every core
+    started = time.monotonic()
+    base_filename = key.split('/')[-1].replace('.gz', '')
+    blocks = iter_log_blocks(_s3_client, bucket, key, size=size)
+    result = convert_blocks(_s3_client, bucket, blocks, year, month, day, base_filename, workers=1,
+                            staging_prefix=staging)
+    return {'rows': result['rows'], 'dropped': result['dropped'], 'quarantined': result['quarantined'],
+            'seconds': time.monotonic() - started}
+
+
+def live_objects(s3_client, bucket, year, month, day):
+    # Visible outputs of a day, without journals and hidden compaction files
+    return {
+        prefix: [o['Key'] for o in list_objects(s3_client, bucket, partition_prefix(year, month, day, prefix))
+                 if not o['Key'].rsplit('/', 1)[-1].startswith(('_', '.'))]
+        for prefix in OUTPUT_PREFIXES
+    }
+
+
+def finish_interrupted(s3_client, bucket, year, month, day):
+    for prefix in OUTPUT_PREFIXES:
+        journal_key = partition_prefix(year, month, day, prefix) + JOURNAL_NAME
+        try:
+            journal = json.loads(s3_client.get_object(Bucket=bucket, Key=journal_key)['Body'].read())
+        except s3_client.exceptions.NoSuchKey:
+            continue
+        print(f"♻️  Finishing interrupted swap in {partition_prefix(year, month, day, prefix)}")
+        swap_in(s3_client, bucket, journal_key, journal)
+
+
+def swap_day(s3_client, bucket, year, month, day, staging, before, run_id):
+    published = 0
+    for prefix in OUTPUT_PREFIXES:
+        part_prefix = partition_prefix(year, month, day, prefix)
+        staged = [o['Key'] for o in list_objects(s3_client, bucket, f"{staging}/{part_prefix}")]
+        outputs = [(key, key[len(staging) + 1:]) for key in staged]
+        final_keys = {final for _, final in outputs}
+        # A key rewritten under the same name is replaced by the copy, not deleted after it
+        inputs = [key for key in before[prefix] if key not in final_keys]
+        if not outputs and not inputs:
+            continue
+        # The compacted files go too, so their sources may be converted again
+        inputs.append(part_prefix + COMPACTED_INDEX_NAME)
+        journal = {'run_id': run_id, 'inputs': inputs, 'outputs': outputs}
+        journal_key = part_prefix + JOURNAL_NAME
+        s3_client.put_object(Bucket=bucket, Key=journal_key, Body=json.dumps(journal).encode('utf-8'),
+                             ContentType='application/json')
+        swap_in(s3_client, bucket, journal_key, journal)
+        published += len(outputs)
+    return published
+
+
+def reconvert_day(s3_client, pool, bucket, year, month, day, staging, run_id):
+    finish_interrupted(s3_client, bucket, year, month, day)
+    # Snapshot before converting: only these objects are replaced
+    before = live_objects(s3_client, bucket, year, month, day)
+    raw = [o for o in list_objects(s3_client, bucket, partition_prefix(year, month, day, RAW_PREFIX))
+           if o['Key'].endswith('.gz')]
+    if not raw:
+        print(f"⏭️  {year}-{month}-{day}: no raw logs")
+        return {'day': f"{year}-{month}-{day}", 'files': 0, 'failed': []}
+
+    print(f"🔁 {year}-{month}-{day}: reconverting {len(raw)} files "
+          f"({sum(o['Size'] for o in raw) / (1024 ** 2):.1f}MB)")
+    # Largest files first, so one big file does not finish the day alone
+    futures = {
+        pool.submit(reconvert_file, bucket, o['Key'], o['Size'], year, month, day, staging): o['Key']
+        for o in sorted(raw, key=lambda o: -o['Size'])
+    }
+    rows, failed = 0, []
+    for future in as_completed(futures):
+        key = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"❌ {key}: {e}")
+            failed.append(key)
+            continue
+        rows += result['rows']
+        print(f"   ✅ {key.rsplit('/', 1)[-1]}: {result['rows']} rows ({result['dropped']} dropped, "
+              f"{result['quarantined']} quarantined) in {result['seconds']:.1f}s")
+
+    day_staging = [f"{staging}/{partition_prefix(year, month, day, prefix)}" for prefix in OUTPUT_PREFIXES]
+    if failed:
+        print(f"⚠️  {year}-{month}-{day}: {len(failed)} files failed, keeping the current partition")
+        for prefix in day_staging:
+            delete_keys(s3_client, bucket, [o['Key'] for o in list_objects(s3_client, bucket, prefix)])
+        return {'day': f"{year}-{month}-{day}", 'files': len(raw), 'failed': failed}
+
+    published = swap_day(s3_client, bucket, year, month, day, staging, before, run_id)
+    print(f"✅ {year}-{month}-{day}: {rows} rows, {published} objects swapped in "
+          f"({sum(len(keys) for keys in before.values())} replaced)")
+    return {'day': f"{year}-{month}-{day}", 'files': len(raw), 'rows': rows, 'failed': []}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild Parquet partitions from the raw CDN logs')
+    parser.add_argument('--start-date', required=True, help='First day (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='Last day, inclusive (default: start date)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Converter processes')
+    parser.add_argument('--compact', action='store_true', help='Compact each day after the swap')
+    parser.add_argument('--no-register', action='store_true', help='Do not register the partitions in Glue')
+    parser.add_argument('--bucket', default=BUCKET)
+    parser.add_argument('--profile', default='spl')
+    args = parser.parse_args()
+
+    days = get_days({'start_date': args.start_date, 'end_date': args.end_date or args.start_date})
+    run_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    staging = f"{STAGING_PREFIX}/{run_id}"
+
+    session = boto3.Session(profile_name=args.profile)
+    s3_client = session.client('s3')
+    registrar = None if args.no_register else PartitionRegistrar(s3_client, session.client('glue'), args.bucket)
+    print(f"🚀 Reconverting {len(days)} days with {args.workers} workers (staging s3://{args.bucket}/{staging}/)")
+
+    started = time.monotonic()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.profile,)) as pool:
+        for year, month, day in days:
+            result = reconvert_day(s3_client, pool, args.bucket, year, month, day, staging, run_id)
+            results.append(result)
+            if result['failed'] or not result['files']:
+                continue
+            if args.compact:
+                compact_partition(s3_client, args.bucket, year, month, day)
+                compact_partition(s3_client, args.bucket, year, month, day, prefix=ROLLUP_PREFIX,
+                                  transform=merge_rollups, sort_columns=ROLLUP_KEYS)
+                compact_partition(s3_client, args.bucket, year, month, day, prefix=SKETCH_PREFIX,
+                                  transform=merge_sketches, sort_columns=SKETCH_KEYS)
+            if registrar is not None:
+                registrar.add(year, month, day)
+    if registrar is not None:
+        registrar.flush()
+
+    failed = [result for result in results if result['failed']]
+    converted = [result for result in results if result['files'] and not result['failed']]
+    print(f"\n📊 {len(converted)}/{len(results)} days reconverted "
+          f"({sum(result.get('rows', 0) for result in results)} rows) in {(time.monotonic() - started) / 60:.1f} min")
+    for result in failed:
+        print(f"   ❌ {result['day']}: {len(result['failed'])} files failed, partition unchanged")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
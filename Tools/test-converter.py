@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Offline correctness checks for the Parquet converter, against moto's
+in-memory S3 (pip install moto). Logs are generated like the benchmark's
+and cut into blocks by s3_reader.iter_line_blocks, as the Lambdas do, so
+multi-block files and the memoryview blocks it yields are covered:
+
+    python Tools/test-converter.py
+
+Exits 1 when a check fails.
+"""
+import asyncio
+import contextlib
+import functools
+import gzip
+import http.server
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT, 'lib', 'lambda', 'parquet_converter'),
+    os.path.join(ROOT, 'lib', 'lambda', 'shared'),
+    os.path.join(ROOT, 'lib', 'lambda', 'log_downloader'),
+]
+
+import boto3
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from moto import mock_aws
+
+import compaction
+import fused_pipeline
+from converter import convert_blocks
+from log_parser import COLUMNS, parse_log_block, parse_log_line, parse_log_line_lenient
+from s3_reader import BLOCK_SIZE, iter_line_blocks
+
+TEST_BUCKET = 'test-cdn-logs'
+# Enough lines for two full iter_line_blocks blocks plus a partial one
+MULTI_BLOCK_LINES = 150000
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+
+
+def load_script(name, *path):
+    # Hyphenated scripts, and the downloader's lambda_function, which the
+    # converter's module of the same name would shadow on sys.path
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, *path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+benchmark = load_script('benchmark_converter', 'Tools', 'benchmark-converter.py')
+
+
+@functools.lru_cache(maxsize=None)
+def multi_block_logs():
+    # (log bytes, expected escaped (referrer, user_agent) pairs), shared by the checks
+    return with_escaped_quotes(benchmark.generate_logs(MULTI_BLOCK_LINES))
+
+
+def chunked(data, size=STREAM_CHUNK_BYTES):
+    # The byte stream as iter_gunzip / the HTTP download hands it over
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def counted(blocks, seen):
+    for block in blocks:
+        seen.append(type(block).__name__)
+        yield block
+
+
+def with_escaped_quotes(data):
+    """
+    Append lines with \\" in a quoted field (referrer, user agent). Returns
+    (data, expected (referrer, user_agent) pairs). An escaped quote just before
+    the closing one is what the CSV tokenizer splits wrongly.
+    """
+    fields = data[:data.index(b'\n')].decode('utf-8').split('"')
+    # Quoted fields: 1 referrer, 3 request, 5 user agent, 7 file type
+    cases = [(1, 'https://example.com/?q=\\"live\\"'), (5, 'Player \\"beta\\"')]
+    lines, expected = [], []
+    for index, value in cases:
+        line = list(fields)
+        line[index] = value
+        lines.append('"'.join(line))
+        expected.append((line[1], line[5]))
+    return data + ('\n'.join(lines) + '\n').encode('utf-8'), expected
+
+
+def read_outputs(s3_client, keys):
+    tables = [pq.read_table(io.BytesIO(s3_client.get_object(Bucket=TEST_BUCKET, Key=key)['Body'].read()))
+              for key in keys]
+    return [row for table in tables for row in table.to_pylist()]
+
+
+def tokenizer_edge_cases(line):
+    # Lines the CSV tokenizer splits differently from LOG_PATTERN
+    fields = line.split('"')
+    # Quoted fields: 1 referrer, 3 request, 5 user agent, 7 file type
+    method, url = fields[3].split(' ', 1)
+    variants = [(1, 'he said "hi"'), (5, 'Mo"zilla'), (3, f"{method}  {url}"), (3, f"{method}\t{url}"),
+                (3, f" {method} {url}"), (3, f"{method} {url} extra"), (3, f"{method} ")]
+    cases = []
+    for index, value in variants:
+        case = list(fields)
+        case[index] = value
+        cases.append('"'.join(case))
+    return cases
+
+
+def check_parser_parity(s3_client):
+    """parse_log_block stores what the regex tiers return, also on lines the tokenizer splits differently."""
+    lines = benchmark.generate_logs(2000).decode('utf-8').splitlines()
+    lines += tokenizer_edge_cases(lines[0])
+    table, _ = parse_log_block(('\n'.join(lines) + '\n').encode('utf-8'))
+    stored = sorted(tuple(str(row[name]) for name in COLUMNS) for row in table.to_pylist())
+    parsed = [parse_log_line(line) or parse_log_line_lenient(line) for line in lines]
+    expected = sorted(tuple(row[name] for name in COLUMNS) for row in parsed if row)
+    if stored != expected:
+        differing = sorted(set(stored) ^ set(expected))[:4]
+        return [f"{len(stored)} rows stored, {len(expected)} expected; differing: {differing}"]
+    return []
+
+
+def check_multi_block_inline(s3_client):
+    """A log of several blocks converts on the inline path (workers=1), escaped quotes intact."""
+    data, expected = multi_block_logs()
+    seen = []
+    blocks = counted(iter_line_blocks(chunked(data)), seen)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = convert_blocks(s3_client, TEST_BUCKET, blocks, '2025', '10', '10', 'multi-block', workers=1)
+    rows = read_outputs(s3_client, result['output_keys'])
+
+    errors = []
+    if len(data) <= BLOCK_SIZE or seen.count('memoryview') < 2:
+        errors.append(f"expected at least two memoryview blocks, got {seen}")
+    if result['rows'] != MULTI_BLOCK_LINES + len(expected) or len(rows) != result['rows']:
+        errors.append(f"{result['rows']} rows converted, {len(rows)} stored, "
+                      f"expected {MULTI_BLOCK_LINES + len(expected)}")
+    escaped = sorted((row['referrer'], row['user_agent']) for row in rows
+                     if '\\"' in row['referrer'] + row['user_agent'])
+    if escaped != sorted(expected):
+        errors.append(f"escaped quotes parsed as {escaped}, expected {sorted(expected)}")
+    return errors
+
+
+def check_fused_multi_block(s3_client):
+    """Fused ingest archives and converts a log of several blocks (inline parsing)."""
+    data, expected = multi_block_logs()
+    compressed = gzip.compress(data, 1)
+    raw_key = 'alibaba-cdn/alibaba-cdn_partitioned/year=2025/month=10/day=10/fused.gz'
+
+    async def ingest():
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=4) as io_pool, ThreadPoolExecutor(max_workers=1) as convert_pool:
+            return await fused_pipeline.ingest_stream(loop, io_pool, convert_pool, chunked(compressed), s3_client,
+                                                      TEST_BUCKET, raw_key, '2025', '10', '10', 'fused')
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(ingest())
+    conversion = result['conversion']
+    rows = read_outputs(s3_client, conversion['output_keys'])
+    archived = s3_client.get_object(Bucket=TEST_BUCKET, Key=raw_key)['Body'].read()
+
+    errors = []
+    if conversion['chunks'] < 2:
+        errors.append(f"expected several blocks, converted {conversion['chunks']}")
+    if archived != compressed:
+        errors.append(f"archive holds {len(archived)} bytes, expected {len(compressed)}")
+    if len(rows) != MULTI_BLOCK_LINES + len(expected):
+        errors.append(f"{len(rows)} rows stored, expected {MULTI_BLOCK_LINES + len(expected)}")
+    return errors
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    # Serves the logs the stubbed DescribeCdnDomainLogs listing points at
+    def log_message(self, format, *args):
+        pass
+
+
+def check_realtime_multi_block(s3_client):
+    """A realtime poll converts an hourly log of several blocks and moves the watermark past it."""
+    downloader = load_script('log_downloader', 'lib', 'lambda', 'log_downloader', 'lambda_function.py')
+    s3_client.create_bucket(Bucket=downloader.S3_BUCKET)
+    data, expected = multi_block_logs()
+    start = (datetime.utcnow() - timedelta(hours=2)).replace(minute=0, second=0, microsecond=0)
+    end = start + timedelta(hours=1)
+    name = f"alibaba-live.servers8.com_{start:%Y_%m_%d_%H%M%S}_{end:%H%M%S}.gz"
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(gzip.compress(data, 1))
+        handler = functools.partial(QuietHandler, directory=directory)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log_info = {'url': f"http://127.0.0.1:{server.server_port}/{name}", 'name': name,
+                    'size': os.path.getsize(os.path.join(directory, name)),
+                    'start': start.strftime('%Y-%m-%dT%H:%M:%SZ'), 'end': end.strftime('%Y-%m-%dT%H:%M:%SZ')}
+        downloader.configure_aliyun_client = lambda: None
+        downloader.get_cdn_log_infos = lambda domain, start_time, end_time: [log_info]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = downloader.lambda_handler({'realtime': True}, None)
+        finally:
+            server.shutdown()
+
+    body = json.loads(response['body'])
+    state = json.loads(s3_client.get_object(
+        Bucket=downloader.S3_BUCKET, Key='alibaba-cdn/_manifests/realtime/watermark.json')['Body'].read())
+    report = [(entry['file'], entry['status']) for entry in body.get('report', [])]
+
+    errors = []
+    if body.get('mode') != 'fused' or report != [(name, 'uploaded')]:
+        errors.append(f"{body.get('mode')} poll reported {report}")
+    if state.get('watermark') != log_info['end']:
+        errors.append(f"watermark at {state.get('watermark')}, expected {log_info['end']}")
+    return errors
+
+
+def check_reconvert_multi_block(s3_client):
+    """reconvert-partitions.py rebuilds a day from a raw log of several blocks."""
+    reconvert = load_script('reconvert_partitions', 'Tools', 'reconvert-partitions.py')
+    reconvert._s3_client = s3_client
+    data, expected = multi_block_logs()
+    part_prefix = reconvert.partition_prefix('2025', '10', '10')
+    raw_key = reconvert.partition_prefix('2025', '10', '10', reconvert.RAW_PREFIX) + 'reconvert.gz'
+    stale_key = part_prefix + 'stale.parquet'
+    s3_client.put_object(Bucket=TEST_BUCKET, Key=raw_key, Body=gzip.compress(data, 1))
+    s3_client.put_object(Bucket=TEST_BUCKET, Key=stale_key, Body=b'old conversion')
+
+    # Threads instead of the tool's process pool, so the moto S3 is shared
+    with ThreadPoolExecutor(max_workers=1) as pool, contextlib.redirect_stdout(io.StringIO()):
+        result = reconvert.reconvert_day(s3_client, pool, TEST_BUCKET, '2025', '10', '10',
+                                         f"{reconvert.STAGING_PREFIX}/test", 'test')
+    keys = [o['Key'] for o in reconvert.list_objects(s3_client, TEST_BUCKET, part_prefix)
+            if o['Key'].endswith('.parquet')]
+    if result['failed'] or stale_key in keys:
+        return [f"reconversion returned {result}, partition still holds {keys}"]
+
+    rows = read_outputs(s3_client, keys)
+    if result['rows'] != MULTI_BLOCK_LINES + len(expected) or len(rows) != result['rows']:
+        return [f"{result['rows']} rows converted, {len(rows)} stored, expected {MULTI_BLOCK_LINES + len(expected)}"]
+    return []
+
+
+def check_compaction_decoded_cap(s3_client):
+    """Compaction cuts a bin once its decoded tables reach max_decoded_bytes, losing no rows."""
+    sources = 5
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(sources):
+            blocks = iter_line_blocks(chunked(benchmark.generate_logs(2000, seed=index)))
+            convert_blocks(s3_client, TEST_BUCKET, blocks, '2025', '10', '10', f"small-{index}", workers=1)
+        part_prefix = compaction.partition_prefix('2025', '10', '10')
+        keys = [o['Key'] for o in compaction.list_objects(s3_client, TEST_BUCKET, part_prefix)]
+        one_file = pq.read_table(io.BytesIO(s3_client.get_object(Bucket=TEST_BUCKET, Key=keys[0])['Body'].read()))
+        # Room for two decoded files per bin, while the compressed target would take all five
+        result = compaction.compact_partition(s3_client, TEST_BUCKET, '2025', '10', '10',
+                                              max_decoded_bytes=int(one_file.nbytes * 2.5))
+    keys = [o['Key'] for o in compaction.list_objects(s3_client, TEST_BUCKET, part_prefix)]
+    index = json.loads(s3_client.get_object(
+        Bucket=TEST_BUCKET, Key=part_prefix + compaction.COMPACTED_INDEX_NAME)['Body'].read())
+    rows = read_outputs(s3_client, [key for key in keys if key.endswith('.parquet')])
+
+    errors = []
+    if result['inputs'] != sources or result['outputs'] != 3:
+        errors.append(f"expected {sources} files in 3 bins, got {result}")
+    if len(rows) != sources * one_file.num_rows:
+        errors.append(f"{len(rows)} rows after compaction, expected {sources * one_file.num_rows}")
+    if sorted(index) != [f"small-{i}" for i in range(sources)] or not set(index.values()) <= set(keys):
+        errors.append(f"compacted index {index} does not match {keys}")
+    return errors
+
+
+CHECKS = [
+    check_parser_parity,
+    check_multi_block_inline,
+    check_fused_multi_block,
+    check_realtime_multi_block,
+    check_reconvert_multi_block,
+    check_compaction_decoded_cap,
+]
+
+
+def main():
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    failed = 0
+    for check in CHECKS:
+        with mock_aws():
+            s3_client = boto3.client('s3')
+            s3_client.create_bucket(Bucket=TEST_BUCKET)
+            try:
+                errors = check(s3_client)
+            except Exception as e:
+                errors = [f"{type(e).__name__}: {e}"]
+        if errors:
+            failed += 1
+            print(f"❌ {check.__name__}: {check.__doc__.strip()}")
+            for error in errors:
+                print(f"   {error}")
+        else:
+            print(f"✅ {check.__name__}")
+    if failed:
+        print(f"❌ {failed} of {len(CHECKS)} checks failed")
+        sys.exit(1)
+    print(f"✅ All {len(CHECKS)} checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,25 @@
 
 set -e
 
+# Shared Python modules used by both Lambdas (installed under /opt/python)
+echo "📦 Building shared code layer..."
+rm -rf layers/shared
+mkdir -p layers/shared/python
+cp lib/lambda/shared/*.py layers/shared/python/
+# Conversion core for the downloader's fused mode (not the converter's lambda_function.py)
+for module in converter log_parser parquet_writer rollups sketches parse_pool quarantine; do
+    cp "lib/lambda/parquet_converter/${module}.py" layers/shared/python/
+done
+# ISA-L inflate for the S3 read path (s3_reader falls back to zlib without it)
+pip install isal -t layers/shared/python/ --platform manylinux2014_aarch64 \
+    --only-binary=:all: --python-version 3.12 --implementation cp --quiet \
+    || echo "⚠️  isal not installed, s3_reader will use zlib"
+
+if [ "$1" = "shared" ]; then
+    echo "✅ Shared code layer built successfully!"
+    exit 0
+fi
+
 echo "🔨 Building Aliyun CLI layer..."
 
 # Build Aliyun CLI layer
@@ -2,6 +2,9 @@
 
 echo "Deploying Parquet Conversion Stack..."
 
+# Build the shared code layer
+./build-layers.sh shared
+
 # Deploy the stack
 npx cdk deploy ParquetConversionStack --require-approval never
 
@@ -122,6 +122,14 @@ export class AlibabaCdnAthenaStack extends cdk.Stack {
             { name: 'user_agent', type: 'string' },
             { name: 'file_type', type: 'string' },
             { name: 'access_ip', type: 'string' },
+            { name: 'event_time', type: 'timestamp' },
+            { name: 'event_minute', type: 'timestamp' },
+            { name: 'event_hour', type: 'timestamp' },
+            { name: 'channel_id', type: 'string' },
+            { name: 'request_kind', type: 'string' },
+            { name: 'playlist', type: 'string' },
+            { name: 'status_class', type: 'string' },
+            { name: 'session_token', type: 'string' },
             { name: 'year', type: 'string' },
             { name: 'month', type: 'string' },
             { name: 'day', type: 'string' }
@@ -0,0 +1,131 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import requests
+
+CDN_ENDPOINT = 'https://cdn.aliyuncs.com/'
+CDN_API_VERSION = '2018-05-10'
+# DescribeCdnDomainLogs accepts up to 1000 entries per page
+PAGE_SIZE = 1000
+# Widest StartTime/EndTime window sent in one request
+MAX_SPAN = timedelta(hours=int(os.environ.get('ALIYUN_MAX_SPAN_HOURS', '24')))
+RETRYABLE_CODES = ('Throttling', 'Throttling.User', 'Throttling.Api', 'ServiceUnavailable')
+
+
+class AliyunApiError(Exception):
+    def __init__(self, code, message, request_id=None):
+        super().__init__(f"{code}: {message} (RequestId: {request_id})")
+        self.code = code
+        self.request_id = request_id
+
+
+class RequestsTransport:
+    """Keep-alive HTTPS transport shared by every call of one client."""
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def __call__(self, url, params):
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, {'Code': 'InvalidResponse', 'Message': response.text[:500]}
+
+
+def percent_encode(value):
+    return quote(str(value), safe='~')
+
+
+def sign_rpc_params(params, access_key_secret, method='GET'):
+    # Alibaba Cloud RPC signature (SignatureVersion 1.0, HMAC-SHA1)
+    canonical = '&'.join(f"{percent_encode(k)}={percent_encode(v)}" for k, v in sorted(params.items()))
+    string_to_sign = f"{method}&{percent_encode('/')}&{percent_encode(canonical)}"
+    digest = hmac.new(f"{access_key_secret}&".encode('utf-8'), string_to_sign.encode('utf-8'), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+class CdnLogClient:
+    """
+    In-process DescribeCdnDomainLogs client.
+
+    Requests are signed locally and sent through a pluggable transport, a
+    callable (url, params) -> (status_code, json_body). The default transport
+    reuses one requests.Session, so every page and window shares the same
+    TLS connection. Tests can pass their own transport or point endpoint at
+    a local fake server.
+    """
+
+    def __init__(self, access_key_id, access_key_secret, endpoint=CDN_ENDPOINT,
+                 transport=None, max_retries=3):
+        self.access_key_id = access_key_id
+        self.access_key_secret = access_key_secret
+        self.endpoint = endpoint
+        self.transport = transport or RequestsTransport()
+        self.max_retries = max_retries
+        self.calls = 0
+
+    def call(self, action, **params):
+        for attempt in range(self.max_retries + 1):
+            request_params = {
+                'Format': 'JSON',
+                'Version': CDN_API_VERSION,
+                'AccessKeyId': self.access_key_id,
+                'SignatureMethod': 'HMAC-SHA1',
+                'SignatureVersion': '1.0',
+                'SignatureNonce': uuid.uuid4().hex,
+                'Timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'Action': action,
+            }
+            request_params.update({k: v for k, v in params.items() if v is not None})
+            request_params['Signature'] = sign_rpc_params(request_params, self.access_key_secret)
+
+            self.calls += 1
+            status, body = self.transport(self.endpoint, request_params)
+            if status == 200 and 'Code' not in body:
+                return body
+
+            error = AliyunApiError(body.get('Code', f'HTTP{status}'), body.get('Message', ''), body.get('RequestId'))
+            if (error.code in RETRYABLE_CODES or status >= 500) and attempt < self.max_retries:
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            raise error
+
+    def describe_domain_logs(self, domain, start_time, end_time):
+        # Yield every LogInfoDetail for one window, following PageNumber
+        page_number = 1
+        while True:
+            data = self.call('DescribeCdnDomainLogs', DomainName=domain, StartTime=start_time,
+                             EndTime=end_time, PageNumber=page_number, PageSize=PAGE_SIZE)
+            total = 0
+            for domain_detail in data.get('DomainLogDetails', {}).get('DomainLogDetail', []):
+                total = max(total, int(domain_detail.get('PageInfos', {}).get('Total', 0)))
+                for log_info in domain_detail.get('LogInfos', {}).get('LogInfoDetail', []):
+                    yield log_info
+            if page_number * PAGE_SIZE >= total:
+                break
+            page_number += 1
+
+    def list_logs(self, domain, start, end, max_span=MAX_SPAN):
+        # Cover [start, end] with as few windows as the API allows and
+        # de-duplicate files reported by two adjacent windows
+        seen = set()
+        logs = []
+        window_start = start
+        while window_start <= end:
+            window_end = min(window_start + max_span - timedelta(seconds=1), end)
+            for log_info in self.describe_domain_logs(domain, window_start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                                      window_end.strftime('%Y-%m-%dT%H:%M:%SZ')):
+                name = log_info.get('LogName') or log_info.get('LogPath')
+                if name not in seen:
+                    seen.add(name)
+                    logs.append(log_info)
+            window_start = window_end + timedelta(seconds=1)
+        return logs
@@ -0,0 +1,122 @@
+"""
+Fused ingest: stream one Alibaba log from the CDN exactly once.
+
+The download loop reads the HTTP body in STREAM_CHUNK_SIZE pieces. Each
+piece goes to the archival multipart upload (the raw .gz under the
+partitioned prefix) and onto a bounded asyncio.Queue. A converter thread
+drains the queue through gunzip -> line blocks -> convert_blocks, so Parquet,
+rollup and quarantine outputs are produced while the file is still arriving.
+
+Backpressure: the queue holds at most FUSED_QUEUE_CHUNKS pieces, and the
+multipart writer has at most MULTIPART_MAX_INFLIGHT parts in flight. A slow
+converter therefore slows the download instead of growing memory.
+
+The archived object is tagged with CONVERTED_METADATA, so the S3-triggered
+converter skips it instead of reading it back. The conversion outputs are
+published first and the archive last. If completing the archive fails, the
+outputs are deleted again and the file is retried on the next run. A run
+killed between the two leaves outputs without an archive; the retry then
+rewrites them under the same keys.
+"""
+import asyncio
+import os
+from s3_multipart import S3MultipartWriter
+from s3_reader import iter_gunzip, iter_line_blocks
+from converter import CONVERTED_METADATA, compacted_into, convert_blocks, discard_outputs
+import metrics
+
+# Raw chunks buffered between download and conversion, per file
+FUSED_QUEUE_CHUNKS = int(os.environ.get('FUSED_QUEUE_CHUNKS', '8'))
+# Files are already converted concurrently; forking parse workers from a
+# threaded process is not safe, so conversion parses inline by default
+FUSED_PARSE_WORKERS = int(os.environ.get('FUSED_PARSE_WORKERS', '1'))
+# Files converted at once: each holds a row group (PARQUET_ROW_GROUP_ROWS)
+# and its sorted copy in memory, so this stays far below the download workers
+FUSED_CONVERT_WORKERS = int(os.environ.get('FUSED_CONVERT_WORKERS', '2'))
+
+_DONE = object()
+
+
+def _queue_iter(queue, loop):
+    # Blocking iterator over an asyncio.Queue, for use from a worker thread
+    while True:
+        item = asyncio.run_coroutine_threadsafe(queue.get(), loop).result()
+        if item is _DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+async def _download(loop, io_pool, chunks, archive, queue):
+    iterator = iter(chunks)
+    try:
+        while True:
+            with metrics.span('download'):
+                chunk = await loop.run_in_executor(io_pool, next, iterator, None)
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            with metrics.span('upload'):
+                await loop.run_in_executor(io_pool, archive.write, chunk)
+            await queue.put(chunk)
+    except Exception as e:
+        # Fail the converter too, so a truncated stream is never committed
+        await queue.put(e)
+        raise
+    await queue.put(_DONE)
+
+
+async def ingest_stream(loop, io_pool, convert_pool, chunks, s3_client, bucket, raw_key,
+                        year, month, day, base_filename, queue_chunks=FUSED_QUEUE_CHUNKS):
+    """
+    Archive `chunks` (raw gzip bytes) to raw_key and convert them in one pass.
+    Returns {'s3_key', 'bytes', 'etag', 'conversion'}.
+    """
+    queue = asyncio.Queue(maxsize=max(queue_chunks, 1))
+    archive = S3MultipartWriter(s3_client, bucket, raw_key, content_type='application/gzip',
+                                metadata={CONVERTED_METADATA: 'true'})
+
+    def convert():
+        compacted = compacted_into(s3_client, bucket, year, month, day, base_filename)
+        if compacted is not None:
+            # Converted and compacted before: archive the file again, but keep its rows once
+            print(f"⏭️  Already compacted into {compacted}: {raw_key}")
+            for _ in _queue_iter(queue, loop):
+                pass
+            return {'rows': 0, 'dropped': 0, 'chunks': 0, 'output_keys': [], 'quarantined': 0,
+                    'published_keys': []}
+        blocks = iter_line_blocks(iter_gunzip(_queue_iter(queue, loop)))
+        return convert_blocks(s3_client, bucket, blocks, year, month, day, base_filename,
+                              workers=FUSED_PARSE_WORKERS)
+
+    download = asyncio.ensure_future(_download(loop, io_pool, chunks, archive, queue))
+    conversion = loop.run_in_executor(convert_pool, convert)
+    try:
+        done, _ = await asyncio.wait([download, conversion], return_when=asyncio.FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+        result = await conversion
+        await download
+        try:
+            with metrics.span('upload'):
+                await loop.run_in_executor(io_pool, archive.close)
+        except BaseException:
+            # Without its archive the file is downloaded and converted again
+            await loop.run_in_executor(io_pool, discard_outputs, s3_client, bucket, result['published_keys'])
+            raise
+    except BaseException:
+        download.cancel()
+        # Fail the converter if it is still waiting for chunks, and let it
+        # abort its outputs before the archive upload is aborted
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RuntimeError(f"Fused ingest of {raw_key} aborted"))
+        await asyncio.gather(conversion, return_exceptions=True)
+        await loop.run_in_executor(io_pool, archive.abort)
+        raise
+
+    metrics.count('bytes_transferred', archive.tell(), 'Bytes')
+    return {'s3_key': raw_key, 'bytes': archive.tell(), 'etag': archive.etag, 'conversion': result}
@@ -1,27 +1,74 @@
+import asyncio
 import json
 import os
-import subprocess
 import boto3
 import re
-import gzip
-import io
-import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
 import requests
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import multiprocessing
 from functools import partial
+from s3_multipart import S3MultipartWriter
+from manifest import IngestManifest
+from aliyun_client import CdnLogClient
+import metrics
+from partitions import PartitionRegistrar
+from realtime import RealtimeWatermark
+
+
+# Concurrency limits for the download/upload engine (overridable per event)
+MAX_WORKERS = int(os.environ.get('DOWNLOAD_MAX_WORKERS', '16'))
+MAX_PER_HOST = int(os.environ.get('DOWNLOAD_MAX_PER_HOST', '8'))
+LIST_WORKERS = int(os.environ.get('LIST_MAX_WORKERS', '4'))
+STREAM_CHUNK_SIZE = 1024 * 1024
+# 'fused' archives and converts each file in one streaming pass (see fused_pipeline.py)
+FUSED_MODE = os.environ.get('INGEST_MODE', 'standard') == 'fused'
+
+S3_BUCKET = 'spl-live-cdn-logs'
+RAW_PREFIX = 'alibaba-cdn/alibaba-cdn_partitioned'
+
+# Listing window per DescribeCdnDomainLogs query (must divide 24)
+LIST_WINDOW_HOURS = int(os.environ.get('LIST_WINDOW_HOURS', '24'))
+
+_s3_client = None
+_http_session = None
+_http_pool_size = 0
+_aliyun_client = None
+_client_lock = threading.Lock()
 
 
 def lambda_handler(event, context):
+    stats = metrics.start('log_downloader')
+    realtime = None
     try:
         domain = event.get('domain', 'alibaba-live.servers8.com')
+        # Explicit listing window (realtime polls, backfill shards) instead of whole days
+        window = None
         
         # Handle scheduled execution
-        if event.get('scheduled'):
+        if event.get('realtime'):
+            # Micro-batch: only the logs published since the last poll
+            now = datetime.utcnow()
+            realtime = RealtimeWatermark(get_s3_client(), S3_BUCKET).load()
+            if realtime.is_running(now) and not event.get('force'):
+                print("⏭️  Another realtime run is still in progress")
+                return {'statusCode': 200, 'body': json.dumps({'message': 'Realtime run already in progress'})}
+            window = realtime.window(now)
+            remaining = context.get_remaining_time_in_millis() if context else 15 * 60 * 1000
+            realtime.claim(now + timedelta(milliseconds=remaining))
+            start_date = window[0].strftime('%Y-%m-%d')
+            end_date = window[1].strftime('%Y-%m-%d')
+            print(f"Realtime execution: collecting logs from {window[0]} to {window[1]}")
+        elif event.get('start_time') and event.get('end_time'):
+            # One shard of a backfill (Tools/backfill-orchestrator.py), e.g. 2 hours
+            window = (datetime.strptime(event['start_time'], '%Y-%m-%dT%H:%M:%SZ'),
+                      datetime.strptime(event['end_time'], '%Y-%m-%dT%H:%M:%SZ'))
+            start_date = window[0].strftime('%Y-%m-%d')
+            end_date = window[1].strftime('%Y-%m-%d')
+            print(f"Shard execution: collecting logs from {event['start_time']} to {event['end_time']}")
+        elif event.get('scheduled'):
             now = datetime.utcnow()
             yesterday = now - timedelta(days=1)
             start_date = yesterday.strftime('%Y-%m-%d')
@@ -34,145 +81,381 @@ def lambda_handler(event, context):
                 raise ValueError("start_date and end_date are required")
             print(f"Manual execution: collecting logs from {start_date} to {end_date}")
         
-        configure_aliyun_cli()
+        max_workers = int(event.get('max_workers', MAX_WORKERS))
+        max_per_host = int(event.get('max_per_host', MAX_PER_HOST))
         
-        # Process each date in 2-hour windows
-        all_uploaded_files = []
-        current_date = datetime.strptime(start_date, '%Y-%m-%d')
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
+        configure_aliyun_client()
         
-        while current_date <= end_date_obj:
-            date_str = current_date.strftime('%Y-%m-%d')
-            print(f"Processing date: {date_str}")
-            
-            # Process in 2-hour blocks
-            hour_blocks = [
-                ('00', '01:59:59'), ('02', '03:59:59'), ('04', '05:59:59'),
-                ('06', '07:59:59'), ('08', '09:59:59'), ('10', '11:59:59'),
-                ('12', '13:59:59'), ('14', '15:59:59'), ('16', '17:59:59'),
-                ('18', '19:59:59'), ('20', '21:59:59'), ('22', '23:59:59')
-            ]
-            
-            for hour_start, hour_end in hour_blocks:
-                start_time = f"{date_str}T{hour_start}:00:00Z"
-                end_time = f"{date_str}T{hour_end}Z"
-                
-                print(f"Processing 2-hour block: {start_time} to {end_time}")
-                
-                try:
-                    log_urls = get_cdn_log_urls(domain, start_time, end_time)
-                    print(f"Found {len(log_urls)} log files for this 2-hour block")
-                    
-                    if log_urls:
-                        for i, url in enumerate(log_urls, 1):
-                            try:
-                                print(f"Processing file {i}/{len(log_urls)}: {os.path.basename(url)}")
-                                s3_key = upload_log_file(url)
-                                all_uploaded_files.append(s3_key)
-                            except Exception as e:
-                                print(f"Error processing {url}: {str(e)}")
-                                continue
-                    
-                except Exception as e:
-                    print(f"Error processing 2-hour block {start_time}-{end_time}: {str(e)}")
-                    continue
-            
-            current_date += timedelta(days=1)
+        if window is not None:
+            blocks = [(window[0].strftime('%Y-%m-%dT%H:%M:%SZ'), window[1].strftime('%Y-%m-%dT%H:%M:%SZ'))]
+        else:
+            blocks = get_time_blocks(start_date, end_date, int(event.get('list_window_hours', LIST_WINDOW_HOURS)))
+        started = time.monotonic()
+        
+        # Skip files already ingested by earlier runs unless forced
+        manifest = None
+        if not event.get('force'):
+            # Log names carry the CDN's UTC+8 date, which can be a day ahead of the listed range
+            last_day = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+            days = {tuple(day[0][:10].split('-'))
+                    for day in get_time_blocks(start_date, last_day.strftime('%Y-%m-%d'), 24)}
+            with metrics.span('manifest_load'):
+                manifest = IngestManifest(get_s3_client(), S3_BUCKET, RAW_PREFIX).load(days)
         
-        print(f"Processing complete: {len(all_uploaded_files)} files uploaded successfully")
+        # Realtime runs convert while downloading, so panels see the rows straight away
+        fused = event.get('fused', FUSED_MODE or realtime is not None)
+        try:
+            if fused:
+                report = transfer_logs_fused(domain, blocks, max_workers, max_per_host, manifest)
+            else:
+                report = transfer_logs(domain, blocks, max_workers, max_per_host, manifest)
+        finally:
+            if manifest is not None:
+                with metrics.span('manifest_save'):
+                    manifest.save()
+        if realtime is not None:
+            realtime.advance(report, window)
+        elapsed = time.monotonic() - started
+        
+        all_uploaded_files = [r['s3_key'] for r in report if r['status'] == 'uploaded']
+        skipped = [r for r in report if r['status'] == 'skipped']
+        failed = [r for r in report if r['status'] not in ('uploaded', 'skipped')]
+        
+        print(f"Processing complete: {len(all_uploaded_files)} files uploaded successfully, "
+              f"{len(skipped)} already ingested, {len(failed)} failed in {elapsed:.1f}s")
+        metrics.count('files_uploaded', len(all_uploaded_files))
+        metrics.count('files_skipped', len(skipped))
+        metrics.count('files_failed', len(failed))
+        metrics.count('aliyun_api_calls', _aliyun_client.calls if _aliyun_client else 0)
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': f'Uploaded {len(all_uploaded_files)} files',
-                'uploaded_files': all_uploaded_files
+                'mode': 'fused' if fused else 'standard',
+                'realtime': realtime is not None,
+                'uploaded_files': all_uploaded_files,
+                'skipped_count': len(skipped),
+                'failed_count': len(failed),
+                'elapsed_seconds': round(elapsed, 3),
+                'metrics': stats.summary(),
+                'report': report
             })
         }
         
     except Exception as e:
+        metrics.count('errors')
+        if realtime is not None and realtime.running_until is not None:
+            # Let the next poll retry straight away
+            try:
+                realtime.release()
+            except Exception as release_error:
+                print(f"⚠️  Could not release the realtime run: {str(release_error)}")
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
+    finally:
+        stats.emit()
 
 
-def configure_aliyun_cli():
-    client = boto3.client('secretsmanager')
-    secret = json.loads(client.get_secret_value(SecretId='aliyun-credentials')['SecretString'])
+def get_time_blocks(start_date, end_date, window_hours=LIST_WINDOW_HOURS):
+    blocks = []
+    current = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
     
-    os.environ['ALIBABA_CLOUD_ACCESS_KEY_ID'] = secret['access_key_id']
-    os.environ['ALIBABA_CLOUD_ACCESS_KEY_SECRET'] = secret['access_key_secret']
-    os.environ['ALIBABA_CLOUD_REGION_ID'] = secret.get('region', 'cn-hangzhou')
+    while current < end:
+        window_end = current + timedelta(hours=window_hours) - timedelta(seconds=1)
+        blocks.append((current.strftime('%Y-%m-%dT%H:%M:%SZ'), window_end.strftime('%Y-%m-%dT%H:%M:%SZ')))
+        current += timedelta(hours=window_hours)
     
-    print(f"Configured Aliyun CLI with region: {os.environ['ALIBABA_CLOUD_REGION_ID']}")
-    print(f"Access Key ID: {os.environ['ALIBABA_CLOUD_ACCESS_KEY_ID'][:8]}...")
+    return blocks
 
-def get_cdn_log_urls(domain, start_time, end_time):
-    cmd = ['/opt/aliyun/aliyun', 'cdn', 'DescribeCdnDomainLogs',
-           '--DomainName', domain, '--StartTime', start_time, '--EndTime', end_time]
-    
-    print(f"Running command: {' '.join(cmd)}")
+
+def report_entry(log_info, block, status):
+    # log_start / log_end: the hour the file covers, for the realtime watermark
+    entry = {'file': log_info['name'], 'block': block[0], 'status': status,
+             'log_start': log_info.get('start'), 'log_end': log_info.get('end')}
+    if status == 'uploaded':
+        entry['s3_key'] = None
+    return entry
+
+
+def transfer_logs(domain, blocks, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST, manifest=None):
+    # Listing calls run in their own small pool so transfers for early blocks
+    # start while later blocks are still being listed. Returns one report
+    # entry per file (or per failed block listing). Files found in the
+    # manifest with the same size are reported as skipped.
+    host_limits = {}
+    host_lock = threading.Lock()
     
-    env = os.environ.copy()
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=60, env=env)
+    def host_semaphore(url):
+        host = urlparse(url if url.startswith('http') else f'https://{url}').netloc
+        with host_lock:
+            if host not in host_limits:
+                host_limits[host] = threading.BoundedSemaphore(max_per_host)
+            return host_limits[host]
     
-    if result.returncode != 0:
-        print(f"Command failed with return code {result.returncode}")
-        print(f"stderr: {result.stderr}")
-        raise Exception(f"Failed to get CDN logs: {result.stderr}")
+    def transfer_one(log_info, block):
+        url = log_info['url']
+        entry = report_entry(log_info, block, 'uploaded')
+        with host_semaphore(url):
+            started = time.monotonic()
+            try:
+                result = stream_log_file(url)
+                entry['s3_key'] = result['s3_key']
+                entry['bytes'] = result['bytes']
+                if manifest is not None:
+                    manifest.add(get_partition_date(log_info['name']), log_info['name'],
+                                 result['bytes'], result['etag'], result['s3_key'])
+            except Exception as e:
+                print(f"Error processing {url}: {str(e)}")
+                entry['status'] = 'failed'
+                entry['error'] = str(e)
+            entry['seconds'] = round(time.monotonic() - started, 3)
+        return entry
     
-    logs_data = json.loads(result.stdout)
-    urls = []
+    report = []
+    print(f"🚀 Listing {len(blocks)} blocks with {LIST_WORKERS} listers, "
+          f"transferring with {max_workers} workers ({max_per_host} per host)")
+    get_http_session(max_workers)
     
-    total_logs = 0
-    for domain_detail in logs_data.get('DomainLogDetails', {}).get('DomainLogDetail', []):
-        domain_name = domain_detail.get('DomainName', 'Unknown')
-        log_count = domain_detail.get('LogCount', 0)
-        total_logs += log_count
-        print(f"Domain: {domain_name}, Log Count: {log_count}")
+    with ThreadPoolExecutor(max_workers=LIST_WORKERS) as list_pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as transfer_pool:
+        listings = {
+            list_pool.submit(get_cdn_log_infos, domain, start_time, end_time): (start_time, end_time)
+            for start_time, end_time in blocks
+        }
+        transfers = []
+        
+        for future in as_completed(listings):
+            block = listings[future]
+            try:
+                log_infos = future.result()
+            except Exception as e:
+                print(f"Error processing 2-hour block {block[0]}-{block[1]}: {str(e)}")
+                report.append({'file': None, 'block': block[0], 'status': 'list_failed', 'error': str(e)})
+                continue
+            
+            print(f"Found {len(log_infos)} log files for block {block[0]}")
+            for log_info in log_infos:
+                if manifest is not None and manifest.contains(log_info['name'], log_info['size']):
+                    report.append(report_entry(log_info, block, 'skipped'))
+                    continue
+                transfers.append(transfer_pool.submit(transfer_one, log_info, block))
         
-        for log_info in domain_detail.get('LogInfos', {}).get('LogInfoDetail', []):
-            if 'LogPath' in log_info:
-                urls.append(log_info['LogPath'])
+        print(f"⏭️  Skipped {sum(1 for r in report if r['status'] == 'skipped')} files already in the manifest")
+        for future in as_completed(transfers):
+            entry = future.result()
+            print(f"{'✅' if entry['status'] == 'uploaded' else '❌'} {entry['file']} ({entry['seconds']}s)")
+            report.append(entry)
     
-    print(f"Total logs found: {total_logs}")
-    return urls
+    report.sort(key=lambda r: (r['block'], r['file'] or ''))
+    return report
+
+
+def transfer_logs_fused(domain, blocks, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST, manifest=None):
+    # Same listing, manifest and report as transfer_logs, but every file is
+    # archived and converted to Parquet while it streams (no second S3 read)
+    return asyncio.run(_transfer_logs_fused(domain, blocks, max_workers, max_per_host, manifest))
+
+
+async def _transfer_logs_fused(domain, blocks, max_workers, max_per_host, manifest):
+    # Imported here: the converter stack (pyarrow, pandas) only loads for fused runs
+    import fused_pipeline
+
+    loop = asyncio.get_running_loop()
+    list_limit = asyncio.Semaphore(LIST_WORKERS)
+    # A file is downloaded only while it can be converted, so the cap on
+    # conversions (memory bound) is also the cap on fused transfers
+    max_workers = max(1, min(max_workers, fused_pipeline.FUSED_CONVERT_WORKERS))
+    transfer_limit = asyncio.Semaphore(max_workers)
+    host_limits = {}
+    partitions = PartitionRegistrar(get_s3_client(), boto3.client('glue'), S3_BUCKET)
+    report = []
+
+    def host_semaphore(url):
+        host = urlparse(url if url.startswith('http') else f'https://{url}').netloc
+        if host not in host_limits:
+            host_limits[host] = asyncio.Semaphore(max_per_host)
+        return host_limits[host]
+
+    async def transfer_one(log_info, block):
+        url = log_info['url'] if log_info['url'].startswith('http') else f"https://{log_info['url']}"
+        filename = os.path.basename(urlparse(url).path.split('?')[0])
+        entry = report_entry(log_info, block, 'uploaded')
+        async with transfer_limit, host_semaphore(url):
+            started = time.monotonic()
+            year, month, day = get_partition_date(filename)
+            raw_key = f"{RAW_PREFIX}/year={year}/month={month}/day={day}/{filename}"
+            print(f"📥 Streaming {url} -> s3://{S3_BUCKET}/{raw_key} (+ Parquet)")
+            response = None
+            try:
+                response = await loop.run_in_executor(
+                    io_pool, partial(get_http_session().get, url, stream=True, timeout=(10, 300))
+                )
+                response.raise_for_status()
+                result = await fused_pipeline.ingest_stream(
+                    loop, io_pool, convert_pool, response.iter_content(chunk_size=STREAM_CHUNK_SIZE),
+                    get_s3_client(), S3_BUCKET, raw_key, year, month, day, filename.replace('.gz', '')
+                )
+                entry['s3_key'] = result['s3_key']
+                entry['bytes'] = result['bytes']
+                entry['rows'] = result['conversion']['rows']
+                partitions.add(year, month, day)
+                if manifest is not None:
+                    manifest.add(get_partition_date(log_info['name']), log_info['name'],
+                                 result['bytes'], result['etag'], result['s3_key'])
+            except Exception as e:
+                print(f"Error processing {url}: {str(e)}")
+                entry['status'] = 'failed'
+                entry['error'] = str(e)
+            finally:
+                if response is not None:
+                    response.close()
+            entry['seconds'] = round(time.monotonic() - started, 3)
+        print(f"{'✅' if entry['status'] == 'uploaded' else '❌'} {entry['file']} ({entry['seconds']}s)")
+        return entry
+
+    async def list_and_transfer(block):
+        try:
+            async with list_limit:
+                log_infos = await loop.run_in_executor(io_pool, get_cdn_log_infos, domain, block[0], block[1])
+        except Exception as e:
+            print(f"Error processing 2-hour block {block[0]}-{block[1]}: {str(e)}")
+            return [{'file': None, 'block': block[0], 'status': 'list_failed', 'error': str(e)}]
+
+        print(f"Found {len(log_infos)} log files for block {block[0]}")
+        entries = []
+        transfers = []
+        for log_info in log_infos:
+            if manifest is not None and manifest.contains(log_info['name'], log_info['size']):
+                entries.append(report_entry(log_info, block, 'skipped'))
+                continue
+            transfers.append(transfer_one(log_info, block))
+        return entries + list(await asyncio.gather(*transfers))
+
+    print(f"🚀 Fused ingest of {len(blocks)} blocks with {max_workers} workers ({max_per_host} per host, "
+          f"FUSED_CONVERT_WORKERS={fused_pipeline.FUSED_CONVERT_WORKERS})")
+    # Downloads, part uploads and listings block in io_pool; each in-flight file
+    # holds one convert_pool thread for its whole conversion
+    get_http_session(max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers * 2 + LIST_WORKERS) as io_pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as convert_pool:
+        for entries in await asyncio.gather(*(list_and_transfer(block) for block in blocks)):
+            report.extend(entries)
+
+        print(f"⏭️  Skipped {sum(1 for r in report if r['status'] == 'skipped')} files already in the manifest")
+        # Only new days reach the catalog, in one batch
+        try:
+            with metrics.span('add_partition'):
+                partitions.flush()
+        except Exception as e:
+            print(f"⚠️  Could not register partitions: {str(e)}")
+
+    report.sort(key=lambda r: (r['block'], r['file'] or ''))
+    return report
+
+
+def get_s3_client():
+    global _s3_client
+    with _client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.client('s3')
+        return _s3_client
+
+
+def get_http_session(pool_size=0):
+    # One pooled connection per concurrent transfer: callers pass their
+    # effective worker count and the pool grows to fit it
+    global _http_session, _http_pool_size
+    with _client_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+        if _http_pool_size == 0 or pool_size > _http_pool_size:
+            _http_pool_size = max(pool_size, _http_pool_size, 10)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=_http_pool_size)
+            _http_session.mount('https://', adapter)
+            _http_session.mount('http://', adapter)
+        return _http_session
+
+
+def configure_aliyun_client():
+    global _aliyun_client
+    if _aliyun_client is not None:
+        return _aliyun_client
+    
+    client = boto3.client('secretsmanager')
+    secret_name = os.environ.get('ALIYUN_SECRET_NAME', 'aliyun-credentials')
+    secret = json.loads(client.get_secret_value(SecretId=secret_name)['SecretString'])
+    
+    _aliyun_client = CdnLogClient(secret['access_key_id'], secret['access_key_secret'])
+    
+    print(f"Configured Aliyun CDN client for region: {secret.get('region', 'cn-hangzhou')}")
+    print(f"Access Key ID: {secret['access_key_id'][:8]}...")
+    return _aliyun_client
+
+def get_cdn_log_urls(domain, start_time, end_time):
+    return [log_info['url'] for log_info in get_cdn_log_infos(domain, start_time, end_time)]
+
+def get_cdn_log_infos(domain, start_time, end_time):
+    start = datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%SZ')
+    end = datetime.strptime(end_time, '%Y-%m-%dT%H:%M:%SZ')
+    
+    print(f"Listing logs for {domain}: {start_time} to {end_time}")
+    with metrics.span('list'):
+        log_infos = [
+            {
+                'url': log_info['LogPath'],
+                'name': log_info.get('LogName') or os.path.basename(urlparse(log_info['LogPath']).path),
+                'size': log_info.get('LogSize'),
+                'start': log_info.get('StartTime'),
+                'end': log_info.get('EndTime'),
+            }
+            for log_info in configure_aliyun_client().list_logs(domain, start, end)
+            if 'LogPath' in log_info
+        ]
+    
+    print(f"Total logs found: {len(log_infos)}")
+    return log_infos
+
+def get_partition_date(filename):
+    # Extract date from filename
+    match = re.search(r'([0-9]{4})_([0-9]{2})_([0-9]{2})_', filename)
+    if match:
+        return match.groups()
+    print(f"⚠️  Could not extract date from {filename}, using current date")
+    now = datetime.utcnow()
+    return str(now.year), f"{now.month:02d}", f"{now.day:02d}"
 
 def upload_log_file(log_url):
+    return stream_log_file(log_url)['s3_key']
+
+def stream_log_file(log_url):
     if not log_url.startswith('http'):
         log_url = f'https://{log_url}'
     
-    print(f"📥 Downloading file from: {log_url}")
-    response = requests.get(log_url, timeout=300)
-    response.raise_for_status()
-    
     filename = os.path.basename(urlparse(log_url).path.split('?')[0])
     print(f"📁 Processing file: {filename}")
     
-    # Extract date from filename
-    match = re.search(r'([0-9]{4})_([0-9]{2})_([0-9]{2})_', filename)
-    if match:
-        year, month, day = match.groups()
-        print(f"📅 Extracted date: year={year}/month={month}/day={day}")
-    else:
-        print(f"⚠️  Could not extract date from {filename}, using current date")
-        now = datetime.utcnow()
-        year, month, day = str(now.year), f"{now.month:02d}", f"{now.day:02d}"
+    year, month, day = get_partition_date(filename)
+    print(f"📅 Extracted date: year={year}/month={month}/day={day}")
     
     # Create partitioned S3 path
-    s3_bucket = 'spl-live-cdn-logs'
-    s3_prefix = 'alibaba-cdn/alibaba-cdn_partitioned'
-    dest_key = f"{s3_prefix}/year={year}/month={month}/day={day}/{filename}"
-    
-    print(f"📤 Uploading to S3: s3://{s3_bucket}/{dest_key}")
-    
-    # Upload to S3
-    s3_client = boto3.client('s3')
-    s3_client.upload_fileobj(
-        io.BytesIO(response.content),
-        s3_bucket,
-        dest_key,
-        ExtraArgs={'ContentType': 'application/gzip'}
-    )
-    
-    print(f"✅ Successfully uploaded: {filename}")
-    return dest_key
\ No newline at end of file
+    dest_key = f"{RAW_PREFIX}/year={year}/month={month}/day={day}/{filename}"
+    
+    print(f"📥 Streaming {log_url} -> s3://{S3_BUCKET}/{dest_key}")
+    
+    # Stream download chunks straight into a multipart upload. 'download' is
+    # time waiting on the CDN, 'upload' time blocked on S3 (part uploads overlap)
+    with get_http_session().get(log_url, stream=True, timeout=(10, 300)) as response:
+        response.raise_for_status()
+        with S3MultipartWriter(get_s3_client(), S3_BUCKET, dest_key, content_type='application/gzip') as writer:
+            for chunk in metrics.timed(response.iter_content(chunk_size=STREAM_CHUNK_SIZE), 'download'):
+                with metrics.span('upload'):
+                    writer.write(chunk)
+            with metrics.span('upload'):
+                writer.close()
+    metrics.count('bytes_transferred', writer.tell(), 'Bytes')
+    
+    print(f"✅ Successfully uploaded: {filename} ({writer.tell()} bytes)")
+    return {'s3_key': dest_key, 'bytes': writer.tell(), 'etag': writer.etag}
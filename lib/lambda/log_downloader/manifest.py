@@ -0,0 +1,124 @@
+import gzip
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+MANIFEST_PREFIX = 'alibaba-cdn/_manifests/ingest'
+# Merge a day's segments into one once it has accumulated this many
+COMPACT_THRESHOLD = 20
+
+
+class IngestManifest:
+    """
+    Record of raw log files already copied to S3, keyed by log filename.
+
+    Each day lives under its own prefix as a set of immutable gzipped JSON
+    segments. A run only ever adds a new segment, and a single PUT is atomic,
+    so concurrent runs never overwrite each other's entries. Readers merge
+    every segment of a day. A day that has no segments yet is seeded from the
+    raw objects already under the partitioned prefix, so history ingested
+    before the manifest existed is skipped as well.
+    """
+
+    def __init__(self, s3_client, bucket, raw_prefix, prefix=MANIFEST_PREFIX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.raw_prefix = raw_prefix
+        self.prefix = prefix
+        self.entries = {}
+        self._segments = {}
+        self._pending = {}
+
+    def _day_prefix(self, day):
+        year, month, dd = day
+        return f"{self.prefix}/year={year}/month={month}/day={dd}/"
+
+    def _list_keys(self, prefix):
+        objects = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects.extend(page.get('Contents', []))
+        return objects
+
+    def _load_day(self, day):
+        entries = {}
+        segments = [o['Key'] for o in self._list_keys(self._day_prefix(day)) if o['Key'].endswith('.json.gz')]
+        for key in sorted(segments):
+            body = self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+            entries.update(json.loads(gzip.decompress(body)))
+
+        if not segments:
+            year, month, dd = day
+            raw_prefix = f"{self.raw_prefix}/year={year}/month={month}/day={dd}/"
+            for obj in self._list_keys(raw_prefix):
+                entries[obj['Key'].rsplit('/', 1)[-1]] = {
+                    'size': obj['Size'],
+                    'etag': obj['ETag'].strip('"'),
+                    's3_key': obj['Key'],
+                }
+            if entries:
+                self._pending[day] = dict(entries)
+
+        return day, segments, entries
+
+    def load(self, days, max_workers=8):
+        # One list (plus a few small GETs) per day, fetched in parallel
+        days = sorted(set(days))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for day, segments, entries in pool.map(self._load_day, days):
+                self._segments[day] = segments
+                for filename, entry in entries.items():
+                    self.entries[filename] = entry
+        print(f"📒 Manifest loaded: {len(self.entries)} files across {len(days)} days")
+        return self
+
+    def contains(self, filename, size=None):
+        entry = self.entries.get(filename)
+        if entry is None:
+            return False
+        return size is None or entry.get('size') is None or int(entry['size']) == int(size)
+
+    def add(self, day, filename, size, etag, s3_key):
+        entry = {
+            'size': size,
+            'etag': (etag or '').strip('"'),
+            's3_key': s3_key,
+            'ingested_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+        self.entries[filename] = entry
+        self._pending.setdefault(day, {})[filename] = entry
+
+    def _put_segment(self, day, entries):
+        run_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        key = f"{self._day_prefix(day)}part-{run_id}.json.gz"
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=gzip.compress(json.dumps(entries, separators=(',', ':')).encode('utf-8')),
+            ContentType='application/gzip',
+        )
+        return key
+
+    def save(self):
+        # Write one new segment per touched day, compacting busy days
+        written = 0
+        for day, entries in list(self._pending.items()):
+            segments = self._segments.get(day, [])
+            if len(segments) + 1 >= COMPACT_THRESHOLD:
+                # Re-read so entries written by concurrent runs are kept
+                _, segments, merged = self._load_day(day)
+                merged.update(entries)
+                self._put_segment(day, merged)
+                for start in range(0, len(segments), 1000):
+                    self.s3_client.delete_objects(
+                        Bucket=self.bucket,
+                        Delete={'Objects': [{'Key': k} for k in segments[start:start + 1000]], 'Quiet': True},
+                    )
+            else:
+                self._segments.setdefault(day, []).append(self._put_segment(day, entries))
+            written += len(entries)
+        self._pending = {}
+        if written:
+            print(f"📒 Manifest updated with {written} entries")
+        return written
@@ -0,0 +1,248 @@
+"""
+Compact the small Parquet objects of a day partition into a few large files.
+
+Runs as a scheduled Lambda (handler compaction.lambda_handler) or locally:
+
+    python compaction.py --start-date 2025-10-01 --end-date 2025-10-07 --profile spl
+
+Small files are grouped in key (chronological) order into bins of about
+COMPACTION_TARGET_MB of input. A bin is cut short once its decoded Arrow tables
+reach COMPACTION_MAX_DECODED_MB, since zstd files can expand tenfold in memory.
+Each bin is read, sorted (SORT_COLUMNS) and written to a hidden `_compacting-*`
+object, which Athena ignores. A journal object
+then records inputs and outputs before the swap: outputs are published under
+their final name and only then are the originals deleted. If a run dies
+mid-swap, the next run finds the journal and finishes the swap first, so a
+partition never loses data.
+
+The swap also records which source files each compacted object holds in
+COMPACTED_INDEX_NAME (a hidden object in the partition). The converter
+Lambda and the fused ingest skip those sources, so a duplicate S3 event, a
+forced re-download or a backfill never adds their rows a second time.
+
+The per-minute rollups under ROLLUP_PREFIX and the sketches under
+SKETCH_PREFIX are compacted the same way, except that each bin is merged
+(merge_rollups / merge_sketches) instead of concatenated.
+"""
+import io
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from converter import COMPACTED_INDEX_NAME, load_compacted_index, source_name
+from log_parser import conform_table
+from parquet_writer import SORT_COLUMNS, RollingParquetWriter, sort_for_output
+from rollups import ROLLUP_KEYS, ROLLUP_PREFIX, merge_rollups
+from sketches import SKETCH_KEYS, SKETCH_PREFIX, merge_sketches
+
+BUCKET = 'spl-live-cdn-logs'
+PARQUET_PREFIX = 'alibaba-cdn/alibaba-cdn_parquet'
+TARGET_BYTES = int(os.environ.get('COMPACTION_TARGET_MB', '256')) * 1024 * 1024
+# Decoded size at which a bin is cut short; sorting it needs about as much again
+MAX_DECODED_BYTES = int(os.environ.get('COMPACTION_MAX_DECODED_MB', '2048')) * 1024 * 1024
+# Files at least this large are considered compacted already
+SMALL_FILE_BYTES = TARGET_BYTES // 2
+JOURNAL_NAME = '_compaction_journal.json'
+
+
+def lambda_handler(event, context):
+    s3_client = boto3.client('s3')
+    days = get_days(event)
+    bucket = event.get('bucket', BUCKET)
+    results = [compact_partition(s3_client, bucket, *day) for day in days]
+    # Rollup files are tiny: merge each day's into one, re-aggregating minutes
+    # that were split across source files
+    results += [compact_partition(s3_client, bucket, *day, prefix=ROLLUP_PREFIX, transform=merge_rollups,
+                                  sort_columns=ROLLUP_KEYS)
+                for day in days]
+    results += [compact_partition(s3_client, bucket, *day, prefix=SKETCH_PREFIX, transform=merge_sketches,
+                                  sort_columns=SKETCH_KEYS)
+                for day in days]
+    return {'statusCode': 200, 'body': json.dumps(results)}
+
+
+def get_days(event):
+    # Scheduled runs compact the two previous (closed) days
+    if event.get('scheduled') or not (event.get('start_date') or event.get('date')):
+        today = datetime.utcnow().date()
+        dates = [today - timedelta(days=2), today - timedelta(days=1)]
+    else:
+        start = datetime.strptime(event.get('start_date') or event['date'], '%Y-%m-%d').date()
+        end = datetime.strptime(event.get('end_date') or event.get('date') or event['start_date'], '%Y-%m-%d').date()
+        dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    return [(d.strftime('%Y'), d.strftime('%m'), d.strftime('%d')) for d in dates]
+
+
+def partition_prefix(year, month, day, prefix=PARQUET_PREFIX):
+    return f"{prefix}/year={year}/month={month}/day={day}/"
+
+
+def list_objects(s3_client, bucket, prefix):
+    objects = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get('Contents', []))
+    return objects
+
+
+def delete_keys(s3_client, bucket, keys):
+    for start in range(0, len(keys), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': k} for k in keys[start:start + 1000]], 'Quiet': True},
+        )
+
+
+def plan_bins(objects, target_bytes=TARGET_BYTES):
+    bins = []
+    current, size = [], 0
+    for obj in sorted(objects, key=lambda o: o['Key']):
+        if current and size + obj['Size'] > target_bytes:
+            bins.append(current)
+            current, size = [], 0
+        current.append(obj['Key'])
+        size += obj['Size']
+    if current:
+        bins.append(current)
+    return bins
+
+
+def read_bins(s3_client, bucket, bins, max_decoded_bytes=MAX_DECODED_BYTES):
+    # Yields (keys, tables) per bin, splitting a bin whose decoded tables
+    # would exceed max_decoded_bytes; a single file is never split
+    for keys in bins:
+        current, tables, decoded = [], [], 0
+        for key in keys:
+            table = pq.read_table(io.BytesIO(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()))
+            if tables and decoded + table.nbytes > max_decoded_bytes:
+                yield current, tables
+                current, tables, decoded = [], [], 0
+            current.append(key)
+            tables.append(table)
+            decoded += table.nbytes
+        if tables:
+            yield current, tables
+
+
+def swap_in(s3_client, bucket, journal_key, journal):
+    # Publish outputs first, then drop the originals: readers may briefly see
+    # both copies but never neither. Outputs are staged next to the journal
+    # (compaction) or under a separate staging prefix (reconversion)
+    existing = set()
+    for tmp_dir in {tmp.rsplit('/', 1)[0] + '/' for tmp, _ in journal['outputs']}:
+        existing.update(o['Key'] for o in list_objects(s3_client, bucket, tmp_dir))
+    for tmp_key, final_key in journal['outputs']:
+        if tmp_key in existing:
+            s3_client.copy({'Bucket': bucket, 'Key': tmp_key}, bucket, final_key)
+    if journal.get('sources'):
+        update_compacted_index(s3_client, bucket, journal_key.rsplit('/', 1)[0] + '/', journal['sources'])
+    delete_keys(s3_client, bucket, journal['inputs'] + [tmp for tmp, _ in journal['outputs']])
+    s3_client.delete_object(Bucket=bucket, Key=journal_key)
+
+
+def update_compacted_index(s3_client, bucket, part_prefix, moved):
+    # moved: input key -> compacted key. Sources compacted earlier follow their
+    # compacted file when it is compacted again
+    index = load_compacted_index(s3_client, bucket, part_prefix)
+    index = {source: moved.get(target, target) for source, target in index.items()}
+    for input_key, final_key in moved.items():
+        if not input_key.rsplit('/', 1)[-1].startswith('compacted-'):
+            index[source_name(input_key)] = final_key
+    s3_client.put_object(Bucket=bucket, Key=part_prefix + COMPACTED_INDEX_NAME,
+                         Body=json.dumps(index, sort_keys=True).encode('utf-8'), ContentType='application/json')
+
+
+def compact_partition(s3_client, bucket, year, month, day, target_bytes=TARGET_BYTES,
+                      prefix=PARQUET_PREFIX, small_file_bytes=None, transform=None, sort_columns=SORT_COLUMNS,
+                      max_decoded_bytes=MAX_DECODED_BYTES):
+    part_prefix = partition_prefix(year, month, day, prefix)
+    journal_key = part_prefix + JOURNAL_NAME
+    small_file_bytes = target_bytes // 2 if small_file_bytes is None else small_file_bytes
+
+    objects = list_objects(s3_client, bucket, part_prefix)
+    if any(o['Key'] == journal_key for o in objects):
+        print(f"♻️  Finishing interrupted compaction in {part_prefix}")
+        journal = json.loads(s3_client.get_object(Bucket=bucket, Key=journal_key)['Body'].read())
+        swap_in(s3_client, bucket, journal_key, journal)
+        objects = list_objects(s3_client, bucket, part_prefix)
+
+    # Leftover hidden outputs from a run that died before writing its journal
+    stale = [o['Key'] for o in objects if o['Key'].rsplit('/', 1)[-1].startswith('_compacting-')]
+    if stale:
+        delete_keys(s3_client, bucket, stale)
+
+    candidates = [
+        o for o in objects
+        if o['Key'].endswith('.parquet')
+        and not o['Key'].rsplit('/', 1)[-1].startswith(('_', '.'))
+        and o['Size'] < small_file_bytes
+    ]
+    if len(candidates) < 2:
+        print(f"✅ {part_prefix}: nothing to compact ({len(candidates)} small files)")
+        return {'partition': part_prefix, 'inputs': 0, 'outputs': 0}
+
+    run_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    bins = plan_bins(candidates, target_bytes)
+    print(f"🧱 {part_prefix}: compacting {len(candidates)} files "
+          f"({sum(o['Size'] for o in candidates)} bytes) into about {len(bins)} files")
+
+    outputs, written = [], []
+    for index, (keys, tables) in enumerate(read_bins(s3_client, bucket, bins, max_decoded_bytes)):
+        if transform is not None:
+            table = transform(tables)
+        else:
+            # Older files still have plain strings and 64-bit ints
+            tables[:] = [conform_table(t) for t in tables]
+            table = sort_for_output(pa.concat_tables(tables, promote_options='permissive'), sort_columns)
+        # read_bins still holds this list: empty it so the inputs are freed before the write
+        tables.clear()
+
+        tmp_key = f"{part_prefix}_compacting-{run_id}-{index:04d}.parquet"
+        final_key = f"{part_prefix}compacted-{run_id}-{index:04d}.parquet"
+        # The whole bin is sorted, so row groups are ordered across the file too
+        writer = RollingParquetWriter(s3_client, bucket, tmp_key, sort_columns=sort_columns, presorted=True)
+        try:
+            writer.write_table(table)
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        outputs.append((tmp_key, final_key))
+        written.append(keys)
+        del table
+
+    journal = {
+        'run_id': run_id,
+        'inputs': [key for keys in written for key in keys],
+        'outputs': outputs,
+        # Lets the converters skip a source whose rows are already compacted
+        'sources': {key: final_key for keys, (_, final_key) in zip(written, outputs) for key in keys},
+    }
+    s3_client.put_object(Bucket=bucket, Key=journal_key, Body=json.dumps(journal).encode('utf-8'),
+                         ContentType='application/json')
+    swap_in(s3_client, bucket, journal_key, journal)
+
+    print(f"✅ {part_prefix}: {len(journal['inputs'])} files -> {len(outputs)} files")
+    return {'partition': part_prefix, 'inputs': len(journal['inputs']), 'outputs': len(outputs)}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compact small Parquet files per day partition')
+    parser.add_argument('--start-date', required=True)
+    parser.add_argument('--end-date')
+    parser.add_argument('--bucket', default=BUCKET)
+    parser.add_argument('--profile', default='spl')
+    args = parser.parse_args()
+
+    client = boto3.Session(profile_name=args.profile).client('s3')
+    for partition in get_days({'start_date': args.start_date, 'end_date': args.end_date or args.start_date}):
+        compact_partition(client, args.bucket, *partition)
+        compact_partition(client, args.bucket, *partition, prefix=ROLLUP_PREFIX, transform=merge_rollups,
+                          sort_columns=ROLLUP_KEYS)
+        compact_partition(client, args.bucket, *partition, prefix=SKETCH_PREFIX, transform=merge_sketches,
+                          sort_columns=SKETCH_KEYS)
@@ -0,0 +1,198 @@
+"""
+Conversion core shared by the converter Lambda and the downloader's fused
+pipeline: blocks of raw log lines in, Parquet + rollup + quarantine out.
+
+build-layers.sh copies this module (and the modules it imports) into the
+shared layer, so the downloader can convert a log while it streams it.
+"""
+import json
+import re
+from log_parser import parse_log_block
+from parquet_writer import SourceFileWriter
+from rollups import ROLLUP_ENABLED, ROLLUP_PREFIX, RollupWriter
+from parse_pool import PARSE_WORKERS, ParsePool
+from quarantine import QUARANTINE_PREFIX, QuarantineWriter
+from sketches import SKETCH_PREFIX, SKETCHES_ENABLED, SketchWriter
+import metrics
+
+PARQUET_PREFIX = 'alibaba-cdn/alibaba-cdn_parquet'
+# Raw objects carrying this metadata were already converted by the fused pipeline
+CONVERTED_METADATA = 'parquet-converted'
+# Per partition directory, written by compaction: source file name -> the
+# compacted object that now holds its rows
+COMPACTED_INDEX_NAME = '_compacted_sources.json'
+_HOUR_SUFFIX = re.compile(r'_h\d{2}$')
+
+
+def convert_blocks(s3_client, bucket, blocks, year, month, day, base_filename, workers=PARSE_WORKERS,
+                   staging_prefix=None):
+    """
+    Convert an iterable of log line blocks into the outputs of one source file
+    (Parquet, rollup, sketches and quarantine).
+
+    Outputs only become visible once every block has been converted; on any
+    error they are aborted. The Parquet, rollup, sketch and quarantine objects
+    are published one after the other, so if publishing one of them fails the
+    ones already published are deleted again. With staging_prefix, every
+    output key is written under <staging_prefix>/ instead of in place.
+    Returns a summary dict, with every published key in 'published_keys'.
+    """
+    root = f'{staging_prefix}/' if staging_prefix else ''
+    # One Parquet output per source file, row groups appended as chunks are parsed
+    output_prefix = f'{root}{PARQUET_PREFIX}/year={year}/month={month}/day={day}/{base_filename}'
+    writer = SourceFileWriter(s3_client, bucket, output_prefix)
+    # Per-minute KPI rollup of the same rows, for dashboards over long ranges
+    rollup = None
+    if ROLLUP_ENABLED:
+        rollup_key = f'{root}{ROLLUP_PREFIX}/year={year}/month={month}/day={day}/{base_filename}.parquet'
+        rollup = RollupWriter(s3_client, bucket, rollup_key)
+    # Distinct-viewer and latency quantile sketches, mergeable over any range
+    sketches = None
+    if SKETCHES_ENABLED:
+        sketch_key = f'{root}{SKETCH_PREFIX}/year={year}/month={month}/day={day}/{base_filename}.parquet'
+        sketches = SketchWriter(s3_client, bucket, sketch_key)
+    # Lines no parsing tier accepts are counted and sampled, not silently dropped
+    quarantine = QuarantineWriter(
+        s3_client, bucket, f'{root}{QUARANTINE_PREFIX}/year={year}/month={month}/day={day}/{base_filename}.txt.gz'
+    )
+
+    closing = False
+    try:
+        total_processed, total_dropped, chunk_num = stream_chunks(blocks, writer, rollup, workers, quarantine,
+                                                                  sketches)
+        with metrics.span('close'):
+            closing = True
+            output_keys = writer.close()
+            published = list(output_keys)
+            if rollup is not None and rollup.close():
+                published.append(rollup.key)
+            if sketches is not None and sketches.close():
+                published.append(sketches.key)
+            if quarantine.close():
+                published.append(quarantine.key)
+    except BaseException:
+        writer.abort()
+        if rollup is not None:
+            rollup.abort()
+        if sketches is not None:
+            sketches.abort()
+        if closing:
+            # Never leave Parquet rows without their rollup and sketches
+            keys = [w.key for w in writer.writers.values()] + [quarantine.key]
+            keys += [w.key for w in (rollup, sketches) if w is not None]
+            discard_outputs(s3_client, bucket, keys)
+        raise
+
+    metrics.count('rows', total_processed)
+    metrics.count('dropped_lines', total_dropped)
+    metrics.count('quarantined_lines', quarantine.rejected)
+    for tier, recovered in quarantine.recovered.items():
+        metrics.count(f'recovered_{tier}_lines', recovered)
+    metrics.count('parquet_files', len(output_keys))
+
+    return {
+        'rows': total_processed,
+        'dropped': total_dropped,
+        'chunks': chunk_num,
+        'output_keys': output_keys,
+        'quarantined': quarantine.rejected,
+        'published_keys': published,
+    }
+
+
+def source_name(key):
+    # .../<base>.parquet or .../<base>_hHH.parquet (hour mode) -> <base>
+    return _HOUR_SUFFIX.sub('', key.rsplit('/', 1)[-1].rsplit('.parquet', 1)[0])
+
+
+def load_compacted_index(s3_client, bucket, part_prefix):
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=part_prefix + COMPACTED_INDEX_NAME)['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return {}
+    return json.loads(body)
+
+
+def compacted_into(s3_client, bucket, year, month, day, base_filename):
+    """
+    The compacted object already holding the rows of this source file, or
+    None. Converting such a source again would count its rows twice.
+    """
+    for prefix in (PARQUET_PREFIX, ROLLUP_PREFIX, SKETCH_PREFIX):
+        index = load_compacted_index(s3_client, bucket, f'{prefix}/year={year}/month={month}/day={day}/')
+        if base_filename in index:
+            return index[base_filename]
+    return None
+
+
+def discard_outputs(s3_client, bucket, keys):
+    # Delete published outputs again (missing keys are ignored)
+    for start in range(0, len(keys), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True},
+        )
+
+
+def stream_chunks(blocks, writer, rollup=None, workers=PARSE_WORKERS, quarantine=None, sketches=None):
+    # blocks: ~16 MB pieces of decompressed log lines, each ending on a newline
+    chunk_num = 0
+    total_processed = 0
+    total_dropped = 0
+
+    if workers > 1:
+        # Decompress here while worker processes parse; write results in order
+        with ParsePool(workers, with_rollup=rollup is not None, with_sketches=sketches is not None) as pool:
+            # 'parse_wait' is time blocked on the workers (it includes 'read')
+            for table, partial, sketch, dropped, report in metrics.timed(pool.imap(blocks), 'parse_wait'):
+                processed = write_chunk(writer, table, rollup, partial, sketches, sketch)
+                if quarantine is not None:
+                    quarantine.add(report)
+                total_processed += processed
+                total_dropped += dropped
+                chunk_num += 1
+                print(f"📦 Processed chunk {chunk_num}: {processed} entries")
+        # Worker-side busy time, comparable to 'parse_seconds' of the inline path
+        metrics.count('parse_seconds', pool.parse_seconds, 'Seconds')
+        metrics.count('decompressed_bytes', pool.block_bytes, 'Bytes')
+    else:
+        for block in blocks:
+            processed, dropped = process_chunk(writer, block, rollup, quarantine, sketches)
+            total_processed += processed
+            total_dropped += dropped
+            chunk_num += 1
+            print(f"📦 Processed chunk {chunk_num}: {processed} entries")
+
+    return total_processed, total_dropped, chunk_num
+
+
+def process_chunk(writer, block, rollup=None, quarantine=None, sketches=None):
+    # Parse raw bytes straight into typed Arrow columns and append them to the output
+    metrics.count('decompressed_bytes', len(block), 'Bytes')
+    report = {} if quarantine is not None else None
+    with metrics.span('parse'):
+        table, dropped = parse_log_block(block, report)
+    if quarantine is not None:
+        quarantine.add(report)
+    return write_chunk(writer, table, rollup, sketches=sketches), dropped
+
+
+def write_chunk(writer, table, rollup=None, partial=None, sketches=None, sketch=None):
+    if table is None:
+        return 0
+
+    with metrics.span('write'):
+        writer.write_table(table)
+    if rollup is not None:
+        with metrics.span('rollup'):
+            if partial is not None:
+                rollup.add_rollup(partial)
+            else:
+                rollup.write_table(table)
+    if sketches is not None:
+        with metrics.span('sketch'):
+            if sketch is not None:
+                sketches.add_sketch(sketch)
+            else:
+                sketches.write_table(table)
+    return table.num_rows
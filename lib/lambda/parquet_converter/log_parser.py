@@ -0,0 +1,426 @@
+import os
+import re
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+# Output columns, in the order the Parquet files have always used
+COLUMNS = [
+    'date_time', 'timezone', 'client_ip', 'proxy_ip', 'response_time', 'referrer',
+    'http_method', 'request_url', 'http_status', 'request_bytes', 'response_bytes',
+    'cache_status', 'user_agent', 'file_type', 'access_ip'
+]
+
+# Space separated fields as the CSV tokenizer sees them ("METHOD URL" is one quoted field)
+RAW_COLUMNS = [
+    'date_time', 'timezone', 'client_ip', 'proxy_ip', 'response_time', 'referrer',
+    'request', 'http_status', 'request_bytes', 'response_bytes',
+    'cache_status', 'user_agent', 'file_type', 'access_ip'
+]
+QUOTED_RAW_COLUMNS = ('referrer', 'request', 'user_agent', 'file_type')
+
+# (column, arrow type, value used when the field is not numeric)
+INT_COLUMNS = [
+    ('response_time', pa.int32(), 0),
+    ('http_status', pa.int16(), 200),
+    ('request_bytes', pa.int64(), 0),
+    ('response_bytes', pa.int64(), 0),
+]
+
+_DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+# Arrow types of every output column. Low-cardinality strings are dictionary
+# encoded and integers are sized to their values; the Athena DDL keeps the
+# wider INT/BIGINT types, which read both these files and older ones.
+LOG_SCHEMA = pa.schema([
+    ('date_time', pa.string()),
+    ('timezone', _DICTIONARY),
+    ('client_ip', pa.string()),
+    ('proxy_ip', _DICTIONARY),
+    ('response_time', pa.int32()),
+    ('referrer', pa.string()),
+    ('http_method', _DICTIONARY),
+    ('request_url', pa.string()),
+    ('http_status', pa.int16()),
+    ('request_bytes', pa.int64()),
+    ('response_bytes', pa.int64()),
+    ('cache_status', _DICTIONARY),
+    ('user_agent', pa.string()),
+    ('file_type', _DICTIONARY),
+    ('access_ip', pa.string()),
+    ('event_time', pa.timestamp('ms')),
+    ('event_minute', pa.timestamp('ms')),
+    ('event_hour', pa.timestamp('ms')),
+    ('channel_id', _DICTIONARY),
+    ('request_kind', _DICTIONARY),
+    ('playlist', _DICTIONARY),
+    ('status_class', _DICTIONARY),
+    ('session_token', pa.string()),
+])
+
+# date_time is local time ("10/Oct/2025:09:42:11") next to a "+0800" style offset
+DATE_FORMAT = '%d/%b/%Y:%H:%M:%S'
+# Alibaba CDN logs are written in UTC+8, used when the offset is unreadable
+DEFAULT_UTC_OFFSET = '+0800'
+# Also store event_minute / event_hour buckets next to event_time
+TIME_BUCKETS = os.environ.get('TIME_BUCKET_COLUMNS', 'true').lower() in ('1', 'true', 'yes')
+
+# Columns derived once at ingest instead of regexp_extract/LIKE in every dashboard query
+DERIVED_COLUMNS = ['channel_id', 'request_kind', 'playlist', 'status_class', 'session_token']
+# Master playlists, as grouped by the "Response Time per type" panel
+MASTER_PLAYLISTS = ('index.m3u8', 'index-720p.m3u8', 'manifest.mpd')
+FRAGMENT_EXTENSIONS = ('.mp4', '.ts', '.m4s', '.aac', '.m4a', '.vtt')
+# Playlist names tracked by the "New Sessions Over Time" panel
+PLAYLIST_NAMES = ('ll-index.m3u8', 'index-720p.m3u8', 'index.m3u8')
+STATUS_CLASSES = pa.array(['other', 'other', '2xx', '3xx', '4xx', '5xx', 'other'])
+
+LOG_PATTERN = re.compile(
+    r'\[([^\s]+)\s+([^\]]+)\]\s+([^\s]+)\s+([^\s]+)\s+([^\s]+)\s+"([^"]*)"\s+"([^\s]+)\s+([^"]*?)"\s+([^\s]+)\s+([^\s]+)\s+([^\s]+)\s+([^\s]+)\s+"([^"]*)"\s+"([^"]*)"\s+([^\s]+)'
+)
+
+# Last tier for lines both the tokenizer and LOG_PATTERN reject: escaped quotes
+# in referrer/user agent, a request without method, a missing timezone or a
+# truncated access_ip
+_QUOTED = r'"((?:[^"\\]|\\.)*)"'
+LENIENT_PATTERN = re.compile(
+    r'\[(\S+)(?:\s+([^\]]*))?\]\s+(\S+)\s+(\S+)\s+(\S+)\s+' + _QUOTED +
+    r'\s+"(?:(\S+)\s+)?((?:[^"\\]|\\.)*?)"\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s+' + _QUOTED +
+    r'\s+' + _QUOTED + r'(?:\s+(\S+))?'
+)
+LENIENT_DEFAULTS = {'timezone': DEFAULT_UTC_OFFSET, 'http_method': '-', 'access_ip': '-'}
+
+_READ_OPTIONS = dict(column_names=RAW_COLUMNS, block_size=8 * 1024 * 1024)
+_CONVERT_OPTIONS = pv.ConvertOptions(
+    column_types={name: pa.string() for name in RAW_COLUMNS},
+    strings_can_be_null=False,
+    quoted_strings_can_be_null=False,
+)
+
+
+def parse_log_line(line):
+    match = LOG_PATTERN.match(line)
+    if not match:
+        return None
+    return dict(zip(COLUMNS, match.groups()))
+
+
+def _to_int(array, arrow_type, default):
+    # Same result as pd.to_numeric(errors='coerce').fillna(default).astype(...)
+    if pc.all(pc.match_substring_regex(array, r'^-?[0-9]+$')).as_py() is not False:
+        return _narrow_int(pc.cast(array, pa.int64()), arrow_type)
+    numeric = pc.match_substring_regex(array, r'^\s*-?([0-9]+\.?[0-9]*|\.[0-9]+)\s*$')
+    cleaned = pc.if_else(numeric, pc.utf8_trim_whitespace(array), str(default))
+    return _narrow_int(pc.cast(cleaned, pa.float64()), arrow_type)
+
+
+def _narrow_int(values, arrow_type):
+    # Clamp out-of-range values (a corrupt line) instead of failing the cast
+    if not pa.types.is_integer(values.type):
+        values = pc.cast(values, pa.int64(), safe=False)
+    if values.type == arrow_type:
+        return values
+    limit = 2 ** (arrow_type.bit_width - 1)
+    bounds = pc.min_max(values)
+    low, high = bounds['min'].as_py(), bounds['max'].as_py()
+    if low is not None and (low < -limit or high > limit - 1):
+        values = pc.max_element_wise(pc.min_element_wise(values, limit - 1), -limit)
+    return pc.cast(values, arrow_type)
+
+
+def conform_table(table, schema=LOG_SCHEMA):
+    """
+    Cast the columns of a table to their LOG_SCHEMA types, e.g. Parquet files
+    written before the schema was narrowed. Other columns are left as they are.
+    """
+    for index, name in enumerate(table.column_names):
+        if name not in schema.names:
+            continue
+        target = schema.field(name).type
+        column = table.column(index)
+        if column.type == target:
+            continue
+        if pa.types.is_integer(target):
+            column = _narrow_int(column.combine_chunks(), target)
+        else:
+            column = column.cast(target)
+        table = table.set_column(index, name, column)
+    # Chunks with different dictionaries defeat Parquet dictionary encoding
+    return table.unify_dictionaries()
+
+
+def _offset_ms(offset):
+    sign = -1 if offset[0] == '-' else 1
+    return sign * (int(offset[1:3]) * 60 + int(offset[3:5])) * 60 * 1000
+
+
+def utc_event_time(date_time, timezone):
+    # Parse the local date_time in bulk and shift it by its UTC offset. A log
+    # file only holds a few thousand distinct seconds, so strptime runs on the
+    # dictionary of unique values and the result is gathered back per row.
+    if isinstance(date_time, pa.ChunkedArray):
+        date_time = date_time.combine_chunks()
+    if isinstance(timezone, pa.ChunkedArray):
+        timezone = timezone.combine_chunks()
+    encoded = pc.dictionary_encode(date_time)
+    parsed = pc.strptime(encoded.dictionary, format=DATE_FORMAT, unit='ms', error_is_null=True)
+    local = pc.take(parsed, encoded.indices)
+    offsets = pc.unique(timezone).to_pylist()
+    if len(offsets) == 1:
+        offset = offsets[0] if re.match(r'^[+-][0-9]{4}$', offsets[0] or '') else DEFAULT_UTC_OFFSET
+        return pc.subtract(local, pa.scalar(_offset_ms(offset), pa.duration('ms')))
+
+    valid = pc.match_substring_regex(timezone, r'^[+-][0-9]{4}$')
+    timezone = pc.if_else(valid, timezone, DEFAULT_UTC_OFFSET)
+    sign = pc.if_else(pc.starts_with(timezone, '-'), -60 * 1000, 60 * 1000)
+    minutes = pc.add(
+        pc.multiply(pc.cast(pc.utf8_slice_codeunits(timezone, 1, 3), pa.int64()), 60),
+        pc.cast(pc.utf8_slice_codeunits(timezone, 3, 5), pa.int64()),
+    )
+    offset = pc.cast(pc.multiply(minutes, sign), pa.duration('ms'))
+    return pc.subtract(local, offset)
+
+
+def _ends_with_any(values, suffixes):
+    result = pc.ends_with(values, suffixes[0])
+    for suffix in suffixes[1:]:
+        result = pc.or_(result, pc.ends_with(values, suffix))
+    return result
+
+
+def derive_columns(request_url, http_status):
+    # Same definitions as the dashboard SQL, computed once per row at ingest.
+    # Like the panels' LIKE '%...' filters, suffixes are matched on the whole
+    # request_url, query string included:
+    #   channel_id    regexp_extract(request_url, 'ch([0-9]+)', 1)
+    #   session_token regexp_extract(request_url, '/([^/]+)/live/', 1)
+    #   playlist      index.m3u8 / ll-index.m3u8 / index-720p.m3u8
+    #   request_kind  master / child (other .m3u8) / fragment / other
+    #   status_class  2xx / 3xx / 4xx / 5xx / other
+    if isinstance(request_url, pa.ChunkedArray):
+        request_url = request_url.combine_chunks()
+
+    channel = pc.struct_field(pc.extract_regex(request_url, r'ch(?P<channel>[0-9]+)'), [0])
+    # Plain splits are ~2x cheaper than the equivalent regex for the token
+    live_split = pc.split_pattern(request_url, '/live/', max_splits=1)
+    has_live = pc.equal(pc.list_value_length(live_split), 2)
+    before_live = pc.binary_join_element_wise('/', pc.list_element(live_split, 0), '')  # always has a '/'
+    token = pc.list_element(pc.split_pattern(before_live, '/', max_splits=1, reverse=True), 1)
+    token = pc.if_else(pc.and_(has_live, pc.not_equal(token, '')), token, None)
+
+    is_master = _ends_with_any(request_url, MASTER_PLAYLISTS)
+    is_child = pc.and_(pc.ends_with(request_url, '.m3u8'), pc.invert(is_master))
+    is_fragment = _ends_with_any(request_url, FRAGMENT_EXTENSIONS)
+    request_kind = pc.case_when(
+        pc.make_struct(is_master, is_child, is_fragment),
+        'master', 'child', 'fragment', 'other'
+    )
+    playlist = pc.case_when(
+        pc.make_struct(*[pc.ends_with(request_url, name) for name in PLAYLIST_NAMES]),
+        *PLAYLIST_NAMES
+    )
+
+    status_index = pc.min_element_wise(pc.max_element_wise(pc.divide(http_status, 100), 0), 6)
+    status_class = pc.take(STATUS_CLASSES, status_index)
+
+    return {
+        'channel_id': pc.dictionary_encode(channel),
+        'request_kind': pc.dictionary_encode(request_kind),
+        'playlist': pc.dictionary_encode(playlist),
+        'status_class': pc.dictionary_encode(status_class),
+        'session_token': token,
+    }
+
+
+def _finish(columns):
+    # Cast numeric columns and return a table in COLUMNS order plus time columns
+    for name, arrow_type, default in INT_COLUMNS:
+        columns[name] = _to_int(columns[name], arrow_type, default)
+    output = {name: columns[name] for name in COLUMNS}
+    output['event_time'] = utc_event_time(columns['date_time'], columns['timezone'])
+    if TIME_BUCKETS:
+        output['event_minute'] = pc.floor_temporal(output['event_time'], unit='minute')
+        output['event_hour'] = pc.floor_temporal(output['event_time'], unit='hour')
+    output.update(derive_columns(output['request_url'], output['http_status']))
+    return conform_table(pa.table(output))
+
+
+def parse_log_line_lenient(line):
+    match = LENIENT_PATTERN.match(line)
+    if not match:
+        return None
+    row = dict(zip(COLUMNS, match.groups()))
+    for name, default in LENIENT_DEFAULTS.items():
+        if not row[name]:
+            row[name] = default
+    return row
+
+
+def _parse_fallback(lines, report=None):
+    # Regex tiers for the few lines the tokenizer rejects (extra spaces,
+    # trailing fields, escaped quotes...). Lines no tier accepts go to
+    # report['rejected'] when a report is given.
+    rows = []
+    recovered = {'regex': 0, 'lenient': 0}
+    for line in lines:
+        line = line.strip()
+        parsed = parse_log_line(line)
+        if parsed:
+            recovered['regex'] += 1
+        else:
+            parsed = parse_log_line_lenient(line)
+            if parsed:
+                recovered['lenient'] += 1
+        if parsed:
+            rows.append(parsed)
+        elif report is not None and line:
+            report.setdefault('rejected', []).append(line)
+    if report is not None:
+        for tier, count in recovered.items():
+            report.setdefault('recovered', {})[tier] = report.get('recovered', {}).get(tier, 0) + count
+    if not rows:
+        return None
+    columns = {name: pa.array([row[name] for row in rows], pa.string()) for name in COLUMNS}
+    return _finish(columns)
+
+
+def _rebuild_lines(raw):
+    # Tokenized rows that failed validation have no original text; rebuild it
+    # (quoting the quoted fields again) so they take the fallback tiers too
+    parts = []
+    for name in RAW_COLUMNS:
+        parts.extend(['"', raw[name], '"'] if name in QUOTED_RAW_COLUMNS else [raw[name]])
+        parts.append(' ')
+    return pc.binary_join_element_wise(*parts[:-1], '').to_pylist()
+
+
+def _split_escaped(data):
+    # The tokenizer has no escape character: a quoted field with \" would be
+    # split and stored corrupted instead of rejected, so such lines skip it
+    kept, escaped = [], []
+    for line in data.split(b'\n'):
+        (escaped if b'\\"' in line else kept).append(line)
+    return b'\n'.join(kept), [line.decode('utf-8', errors='replace') for line in escaped]
+
+
+def _has_bytes(column, *needles):
+    # memchr over the value buffers, far cheaper than a per-row kernel
+    for chunk in column.chunks:
+        values = chunk.buffers()[2]
+        if values is not None and any(needle in values.to_pybytes() for needle in needles):
+            return True
+    return False
+
+
+def _suspect_rows(raw, method, url):
+    # Rows the tokenizer accepted but LOG_PATTERN rejects or reads differently:
+    # an empty method or whitespace in it, whitespace at the start of the URL
+    # ("GET  http://..."), or a stray quote merged into a quoted field
+    # ("Mo"zilla"). Returns their mask, or None when there are none. The
+    # per-row checks for tabs and quotes only run when the bytes occur at all.
+    suspect = pc.or_(pc.equal(pc.utf8_length(method), 0), pc.utf8_is_space(pc.utf8_slice_codeunits(url, 0, 1)))
+    if _has_bytes(raw['request'], b'\t', b'\r', b'\x0b', b'\x0c'):
+        suspect = pc.or_(suspect, pc.match_substring_regex(method, r'\s'))
+    for name in QUOTED_RAW_COLUMNS:
+        if _has_bytes(raw[name], b'"'):
+            suspect = pc.or_(suspect, pc.match_substring(raw[name], '"'))
+    return suspect if pc.any(suspect).as_py() else None
+
+
+def _read_block(data, rejected):
+    def on_invalid_row(row):
+        if row.text:
+            rejected.append(row.text)
+        return 'skip'
+
+    parse_options = pv.ParseOptions(
+        delimiter=' ', quote_char='"', double_quote=False, escape_char=False,
+        newlines_in_values=False, ignore_empty_lines=True, invalid_row_handler=on_invalid_row,
+    )
+    return pv.read_csv(
+        pa.py_buffer(data),
+        read_options=pv.ReadOptions(**_READ_OPTIONS),
+        parse_options=parse_options,
+        convert_options=_CONVERT_OPTIONS,
+    )
+
+
+def parse_log_block(data, report=None):
+    """
+    Parse a block of raw log bytes (whole lines) into a typed Arrow table.
+
+    The bytes go straight through Arrow's C++ CSV tokenizer (space separated,
+    double-quoted fields). Only the rare lines it rejects or reads differently
+    from LOG_PATTERN (see _suspect_rows), and lines with an escaped quote (\\"),
+    which it cannot split correctly, are decoded and run through the regex
+    tiers. Returns (table, dropped_lines), where table may be None when
+    nothing parsed. Pass a dict as report to also get the lines no
+    tier could parse (report['rejected']) and the per-tier recovery counts
+    (report['recovered']).
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    elif not isinstance(data, bytes):
+        # iter_line_blocks yields memoryviews, which have neither strip() nor
+        # a working `in` for byte strings
+        data = bytes(data)
+    escaped = []
+    if b'\\"' in data:
+        data, escaped = _split_escaped(data)
+    rejected = []
+    raw = None
+    try:
+        if data.strip():
+            raw = _read_block(data, rejected)
+    except pa.ArrowInvalid as e:
+        if 'UTF8' not in str(e) and 'utf8' not in str(e).lower():
+            raise
+        # Invalid bytes: replace them rather than failing the whole file
+        rejected = []
+        raw = _read_block(bytes(data).decode('utf-8', errors='replace').encode('utf-8'), rejected)
+
+    tables = []
+    dropped = 0
+    if raw is not None and raw.num_rows:
+        date_time = raw['date_time']
+        timezone = raw['timezone']
+        request = raw['request']
+        # Keep the rows the regex would have accepted: [date tz] and "METHOD URL"
+        valid = pc.and_(
+            pc.and_(pc.starts_with(date_time, '['), pc.ends_with(timezone, ']')),
+            pc.match_substring(request, ' ')
+        )
+        if not pc.all(valid).as_py():
+            rejected.extend(_rebuild_lines(raw.filter(pc.invert(valid))))
+            raw = raw.filter(valid)
+            date_time, timezone, request = raw['date_time'], raw['timezone'], raw['request']
+
+        if raw.num_rows:
+            method_url = pc.split_pattern(request, ' ', max_splits=1)
+            method, url = pc.list_element(method_url, 0), pc.list_element(method_url, 1)
+            suspect = _suspect_rows(raw, method, url)
+            if suspect is not None:
+                rejected.extend(_rebuild_lines(raw.filter(suspect)))
+                keep = pc.invert(suspect)
+                raw, method, url = raw.filter(keep), method.filter(keep), url.filter(keep)
+
+        if raw.num_rows:
+            columns = {name: raw[name] for name in RAW_COLUMNS if name != 'request'}
+            columns['date_time'] = pc.utf8_ltrim(raw['date_time'], '[')
+            columns['timezone'] = pc.utf8_rtrim(raw['timezone'], ']')
+            columns['http_method'] = method
+            columns['request_url'] = url
+            tables.append(_finish(columns))
+
+    rejected.extend(escaped)
+    if rejected:
+        fallback = _parse_fallback(rejected, report)
+        if fallback is not None:
+            tables.append(fallback)
+            dropped += len(rejected) - fallback.num_rows
+        else:
+            dropped += len(rejected)
+
+    if not tables:
+        return None, dropped
+    if len(tables) == 1:
+        return tables[0], dropped
+    return pa.concat_tables(tables), dropped
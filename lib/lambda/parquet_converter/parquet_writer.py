@@ -0,0 +1,170 @@
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from s3_multipart import S3MultipartWriter
+
+PARQUET_CODEC = os.environ.get('PARQUET_CODEC', 'zstd')
+PARQUET_COMPRESSION_LEVEL = os.environ.get('PARQUET_COMPRESSION_LEVEL')
+ROW_GROUP_ROWS = int(os.environ.get('PARQUET_ROW_GROUP_ROWS', '500000'))
+# 'file': one Parquet object per source .gz, 'hour': one per source file and hour
+OUTPUT_MODE = os.environ.get('PARQUET_OUTPUT_MODE', 'file')
+# Row order inside each row group: time buckets first, then channel, so min/max
+# statistics and the page index can skip data on time ranges and channel lookups
+SORT_COLUMNS = [c for c in os.environ.get('PARQUET_SORT_COLUMNS', 'event_minute,channel_id,event_time').split(',') if c]
+# Column index + offset index per page (Athena/Trino prune pages, not just row groups)
+PAGE_INDEX = os.environ.get('PARQUET_PAGE_INDEX', 'true').lower() in ('1', 'true', 'yes')
+
+
+def sort_keys(schema, columns=SORT_COLUMNS):
+    keys = [c for c in columns if c in schema.names]
+    # Files written before event_time existed only have the raw timestamp
+    if not keys and 'date_time' in schema.names:
+        keys = ['date_time']
+    return keys
+
+
+def sort_for_output(table, columns=SORT_COLUMNS):
+    keys = sort_keys(table.schema, columns)
+    if not keys:
+        return table
+    # sort_indices does not take dictionary columns; order on their values instead
+    values = pa.table({
+        key: table[key].cast(table.schema.field(key).type.value_type)
+        if pa.types.is_dictionary(table.schema.field(key).type) else table[key]
+        for key in keys
+    })
+    return table.take(pc.sort_indices(values, sort_keys=[(key, 'ascending') for key in keys]))
+
+
+class RollingParquetWriter:
+    """
+    Stream Arrow tables into a single Parquet object on S3.
+
+    Incoming tables are buffered until ROW_GROUP_ROWS rows are available, then
+    written as one row group. The Parquet bytes go straight into a multipart
+    upload, so memory is bounded by one row group plus the in-flight parts,
+    however large the output gets. Nothing becomes visible in S3 until
+    close(). abort() discards the upload.
+
+    With sort_columns, each row group is sorted by them (unless the caller
+    passes presorted=True because its input is already in that order) and the
+    order is recorded as the row groups' sorting_columns.
+    """
+
+    def __init__(self, s3_client, bucket, key, codec=PARQUET_CODEC,
+                 compression_level=PARQUET_COMPRESSION_LEVEL, row_group_rows=ROW_GROUP_ROWS,
+                 sort_columns=None, presorted=False, page_index=PAGE_INDEX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.codec = codec
+        self.compression_level = int(compression_level) if compression_level else None
+        self.row_group_rows = row_group_rows
+        self.sort_columns = sort_columns
+        self.presorted = presorted
+        self.page_index = page_index
+        self.rows = 0
+        self.row_groups = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._sink = None
+        self._writer = None
+
+    def write_table(self, table):
+        if table is None or table.num_rows == 0:
+            return
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        while self._pending_rows >= self.row_group_rows:
+            self._flush(self.row_group_rows)
+
+    def _flush(self, max_rows=None):
+        if not self._pending_rows:
+            return
+        # One dictionary per column across the buffered blocks, or Parquet's
+        # dictionary encoding falls back to plain pages
+        table = pa.concat_tables(self._pending).unify_dictionaries()
+        if max_rows is not None and table.num_rows > max_rows:
+            table, rest = table.slice(0, max_rows), table.slice(max_rows)
+            self._pending = [rest]
+        else:
+            self._pending = []
+        self._pending_rows = sum(t.num_rows for t in self._pending)
+        if self.sort_columns and not self.presorted:
+            table = sort_for_output(table, self.sort_columns)
+
+        if self._writer is None:
+            sorting_columns = None
+            if self.sort_columns:
+                sorting_columns = pq.SortingColumn.from_ordering(
+                    table.schema, [(key, 'ascending') for key in sort_keys(table.schema, self.sort_columns)]
+                ) or None
+            self._sink = S3MultipartWriter(self.s3_client, self.bucket, self.key)
+            self._writer = pq.ParquetWriter(
+                self._sink, table.schema,
+                compression=self.codec, compression_level=self.compression_level,
+                write_page_index=self.page_index, sorting_columns=sorting_columns,
+            )
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self.rows += table.num_rows
+        self.row_groups += 1
+
+    def close(self):
+        self._flush()
+        if self._writer is None:
+            return False
+        self._writer.close()
+        self._sink.close()
+        print(f"🗂️  Wrote s3://{self.bucket}/{self.key}: {self.rows} rows in {self.row_groups} row groups "
+              f"({self._sink.tell()} bytes, {self.codec})")
+        return True
+
+    def abort(self):
+        self._pending = []
+        self._pending_rows = 0
+        if self._sink is not None:
+            self._sink.abort()
+
+
+class SourceFileWriter:
+    """
+    Route the rows of one source log file to its Parquet output(s).
+
+    In 'file' mode everything goes to <base>.parquet. In 'hour' mode rows are
+    split on the hour of date_time into <base>_hHH.parquet, each with its
+    own rolling writer. Row groups are sorted by SORT_COLUMNS.
+    """
+
+    def __init__(self, s3_client, bucket, key_prefix, mode=OUTPUT_MODE, **writer_options):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        self.mode = mode
+        self.writer_options = {'sort_columns': SORT_COLUMNS, **writer_options}
+        self.writers = {}
+
+    def _writer_for(self, suffix):
+        if suffix not in self.writers:
+            self.writers[suffix] = RollingParquetWriter(
+                self.s3_client, self.bucket, f"{self.key_prefix}{suffix}.parquet", **self.writer_options
+            )
+        return self.writers[suffix]
+
+    def write_table(self, table):
+        if table is None or table.num_rows == 0:
+            return
+        if self.mode != 'hour':
+            self._writer_for('').write_table(table)
+            return
+        # date_time looks like 10/Oct/2025:09:42:11, the hour is at offset 12
+        hours = pc.utf8_slice_codeunits(table['date_time'], 12, 14)
+        for hour in pc.unique(hours).to_pylist():
+            self._writer_for(f"_h{hour}").write_table(table.filter(pc.equal(hours, hour)))
+
+    def close(self):
+        return [w.key for w in self.writers.values() if w.close()]
+
+    def abort(self):
+        for writer in self.writers.values():
+            writer.abort()
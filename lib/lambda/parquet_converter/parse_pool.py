@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import time
+import traceback
+from log_parser import parse_log_block
+from rollups import rollup_table
+from sketches import sketch_table
+
+# Lambda gives ~1 vCPU per 1769 MB, so the 8 GB converter has 4-5 cores
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', str(os.cpu_count() or 1)))
+
+
+def _worker(conn, with_rollup, with_sketches):
+    # Parse blocks until the empty sentinel, one reply per block
+    while True:
+        try:
+            block = conn.recv_bytes()
+        except EOFError:
+            break
+        if not block:
+            break
+        started = time.perf_counter()
+        try:
+            report = {}
+            table, dropped = parse_log_block(block, report)
+            rollup = rollup_table(table) if with_rollup and table is not None else None
+            sketch = sketch_table(table) if with_sketches and table is not None else None
+            conn.send(('ok', table, rollup, sketch, dropped, report, len(block), time.perf_counter() - started))
+        except Exception:
+            conn.send(('error', traceback.format_exc(), None, None, 0, None, 0, 0))
+    conn.close()
+
+
+class ParsePool:
+    """
+    Parse raw log blocks on several processes and hand results back in order.
+
+    Lambda has no /dev/shm, so multiprocessing.Pool and ProcessPoolExecutor
+    cannot start there; each worker is a plain Process with its own Pipe.
+    Block N always goes to worker N % workers, and a worker only receives a
+    new block once its previous result has been collected, so results come
+    back in input order and neither side can block the other on a full pipe.
+    While the workers parse, the caller keeps reading and decompressing the
+    next blocks.
+    """
+
+    def __init__(self, workers=PARSE_WORKERS, with_rollup=False, with_sketches=False):
+        self.workers = max(1, workers)
+        self.with_rollup = with_rollup
+        self.with_sketches = with_sketches
+        self._conns = []
+        self._processes = []
+        # Totals reported by the workers, for metrics
+        self.parse_seconds = 0.0
+        self.block_bytes = 0
+
+    def __enter__(self):
+        context = multiprocessing.get_context('fork')
+        for _ in range(self.workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker, args=(child_conn, self.with_rollup, self.with_sketches), daemon=True)
+            process.start()
+            # Drop our copy so recv() raises EOFError if the worker dies
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+        return self
+
+    def _result(self, index):
+        try:
+            status, table, rollup, sketch, dropped, report, size, seconds = self._conns[index].recv()
+        except EOFError:
+            raise RuntimeError(f"Parse worker {index} exited (exit code {self._processes[index].exitcode})")
+        if status != 'ok':
+            raise RuntimeError(f"Parse worker {index} failed:\n{table}")
+        self.parse_seconds += seconds
+        self.block_bytes += size
+        return table, rollup, sketch, dropped, report
+
+    def imap(self, blocks):
+        # Yield (table, rollup, sketch, dropped, report) for each block, in order
+        sent = 0
+        received = 0
+        for block in blocks:
+            index = sent % self.workers
+            if sent >= self.workers:
+                yield self._result(index)
+                received += 1
+            self._conns[index].send_bytes(block)
+            sent += 1
+        while received < sent:
+            yield self._result(received % self.workers)
+            received += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        for conn, process in zip(self._conns, self._processes):
+            if exc_type is None:
+                try:
+                    conn.send_bytes(b'')
+                except OSError:
+                    pass
+            else:
+                process.terminate()
+            conn.close()
+        for process in self._processes:
+            process.join(timeout=10)
+        return False
@@ -0,0 +1,66 @@
+import gzip
+import os
+import random
+
+QUARANTINE_PREFIX = os.environ.get('QUARANTINE_PREFIX', 'alibaba-cdn/alibaba-cdn_quarantine')
+# Lines kept per source file; beyond that a uniform sample is kept
+QUARANTINE_SAMPLE_LINES = int(os.environ.get('QUARANTINE_SAMPLE_LINES', '10000'))
+
+
+class QuarantineWriter:
+    """
+    Collect the lines of one source file that no parsing tier accepted and
+    store them as a gzipped text object under the file's partition:
+
+        <QUARANTINE_PREFIX>/year=/month=/day=/<source file>.txt.gz
+
+    Every rejected line is counted, but only QUARANTINE_SAMPLE_LINES are
+    kept (reservoir sampling, so a burst of bad lines late in the file is
+    represented too). Counts are stored as object metadata, and nothing is
+    written for a file that parsed cleanly.
+    """
+
+    def __init__(self, s3_client, bucket, key, sample_lines=QUARANTINE_SAMPLE_LINES):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.sample_lines = sample_lines
+        self.rejected = 0
+        self.recovered = {}
+        self._sample = []
+        self._random = random.Random(key)
+
+    def add(self, report):
+        # report as filled by parse_log_block(data, report)
+        if not report:
+            return
+        for tier, count in report.get('recovered', {}).items():
+            self.recovered[tier] = self.recovered.get(tier, 0) + count
+        for line in report.get('rejected', []):
+            if len(self._sample) < self.sample_lines:
+                self._sample.append(line)
+            else:
+                slot = self._random.randint(0, self.rejected)
+                if slot < self.sample_lines:
+                    self._sample[slot] = line
+            self.rejected += 1
+
+    def summary(self):
+        return {'rejected': self.rejected, 'sampled': len(self._sample), 'recovered': dict(self.recovered)}
+
+    def close(self):
+        if not self.rejected:
+            return None
+        metadata = {'rejected-lines': str(self.rejected), 'sampled-lines': str(len(self._sample))}
+        metadata.update({f'recovered-{tier}': str(count) for tier, count in self.recovered.items()})
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=gzip.compress(('\n'.join(self._sample) + '\n').encode('utf-8')),
+            ContentType='text/plain',
+            ContentEncoding='gzip',
+            Metadata=metadata,
+        )
+        print(f"🚧 Quarantined {self.rejected} unparseable lines ({len(self._sample)} kept) "
+              f"to s3://{self.bucket}/{self.key}")
+        return self.key
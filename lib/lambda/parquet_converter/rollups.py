@@ -0,0 +1,124 @@
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from parquet_writer import RollingParquetWriter
+
+ROLLUP_ENABLED = os.environ.get('ROLLUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ROLLUP_PREFIX = os.environ.get('ROLLUP_PREFIX', 'alibaba-cdn/alibaba-cdn_rollups')
+
+# One rollup row per minute x channel x file_type x cache_status x http_status
+ROLLUP_KEYS = ['event_minute', 'channel_id', 'file_type', 'cache_status', 'http_status']
+# Upper bounds (ms, exclusive) of the "Response Time Distribution" panel buckets
+HISTOGRAM_BOUNDS = [100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+HISTOGRAM_COLUMNS = [f'rt_lt_{bound}' for bound in HISTOGRAM_BOUNDS] + [f'rt_ge_{HISTOGRAM_BOUNDS[-1]}']
+
+# Measures are sums or maxes, so rollups merge exactly across files
+SUM_COLUMNS = ['requests', 'request_bytes', 'response_bytes', 'response_time_sum'] + HISTOGRAM_COLUMNS
+MAX_COLUMNS = ['response_time_max']
+
+
+def _measures(table):
+    # Per-row measures; aggregating them with sum/max gives the rollup
+    response_time = pc.cast(table['response_time'], pa.int64())
+    columns = {
+        'requests': pa.array(np.ones(table.num_rows, dtype=np.int64)),
+        'request_bytes': table['request_bytes'],
+        'response_bytes': table['response_bytes'],
+        'response_time_sum': response_time,
+        'response_time_max': response_time,
+    }
+    bucket = pc.cast(pc.greater_equal(response_time, HISTOGRAM_BOUNDS[0]), pa.int8())
+    for bound in HISTOGRAM_BOUNDS[1:]:
+        bucket = pc.add(bucket, pc.cast(pc.greater_equal(response_time, bound), pa.int8()))
+    for index, name in enumerate(HISTOGRAM_COLUMNS):
+        columns[name] = pc.cast(pc.equal(bucket, index), pa.int64())
+    return columns
+
+
+def _aggregate(table, keys):
+    aggregations = [(name, 'sum') for name in SUM_COLUMNS] + [(name, 'max') for name in MAX_COLUMNS]
+    result = table.group_by(keys, use_threads=False).aggregate(aggregations)
+    # group_by names outputs "<column>_<agg>" and puts the keys last
+    renamed = {f'{name}_{agg}': name for name, agg in aggregations}
+    result = result.rename_columns([renamed.get(name, name) for name in result.column_names])
+    return result.select(keys + SUM_COLUMNS + MAX_COLUMNS).sort_by([(key, 'ascending') for key in keys])
+
+
+def rollup_table(table):
+    """Aggregate parsed log rows (parse_log_block output) into minute rollup rows."""
+    if 'event_minute' in table.column_names:
+        event_minute = table['event_minute']
+    else:
+        event_minute = pc.floor_temporal(table['event_time'], unit='minute')
+    columns = {
+        'event_minute': event_minute,
+        # Plain types, so rollups of old and new files merge without promotion
+        'channel_id': pc.cast(table['channel_id'], pa.string()),
+        'file_type': pc.cast(table['file_type'], pa.string()),
+        'cache_status': pc.cast(table['cache_status'], pa.string()),
+        'http_status': pc.cast(table['http_status'], pa.int32()),
+    }
+    columns.update(_measures(table))
+    return _aggregate(pa.table(columns), ROLLUP_KEYS)
+
+
+def merge_rollups(tables, granularity='minute'):
+    """
+    Merge rollup tables from any number of files into one.
+
+    Every measure is a sum or a max, so partial rollups of the same minute
+    (e.g. from two source files) combine exactly. With granularity='hour'
+    the minutes are folded into an event_hour column instead.
+    """
+    tables = [t for t in tables if t is not None and t.num_rows]
+    if not tables:
+        return None
+    table = pa.concat_tables(tables, promote_options='permissive')
+    keys = list(ROLLUP_KEYS)
+    if granularity == 'hour':
+        hours = pc.floor_temporal(table['event_minute'], unit='hour')
+        table = table.drop_columns(['event_minute']).append_column('event_hour', hours)
+        keys[0] = 'event_hour'
+    return _aggregate(table, keys)
+
+
+class RollupWriter:
+    """
+    Accumulate the rollup of one source file and write it next to the
+    Parquet output. Each parsed chunk is reduced straight away, so only a few
+    thousand rows are held however large the file is.
+    """
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self._partials = []
+
+    def write_table(self, table):
+        if table is None or table.num_rows == 0:
+            return
+        self._partials.append(rollup_table(table))
+
+    def add_rollup(self, partial):
+        # Chunk rollup already computed elsewhere (e.g. by a parse worker)
+        if partial is not None and partial.num_rows:
+            self._partials.append(partial)
+
+    def close(self):
+        table = merge_rollups(self._partials)
+        self._partials = []
+        if table is None:
+            return False
+        # merge_rollups output is ordered by ROLLUP_KEYS already
+        writer = RollingParquetWriter(self.s3_client, self.bucket, self.key, sort_columns=ROLLUP_KEYS, presorted=True)
+        try:
+            writer.write_table(table)
+            return writer.close()
+        except Exception:
+            writer.abort()
+            raise
+
+    def abort(self):
+        self._partials = []
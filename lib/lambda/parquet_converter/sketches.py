@@ -0,0 +1,316 @@
+"""
+Mergeable sketches of distinct viewers and response time quantiles.
+
+Next to each Parquet output the converter writes, per minute and channel:
+  - HyperLogLog registers of session_token and client_ip, for distinct
+    counts ("New Sessions Over Time", unique viewers), and
+  - DDSketch buckets of response_time, for p50/p95/p99 within
+    QUANTILE_ACCURACY relative error.
+
+Both are stored as rows (event_minute, channel_id, sketch, key, value): an
+HLL row is one non-empty register (value = rank) and a DDSketch row one
+bucket (value = count). Merging sketches of any files, minutes or channels
+is then a group-by: max of the HLL ranks, sum of the DDSketch counts, like
+the rollups. From Python:
+
+    table = load_sketches(s3_client, bucket, start, end)
+    distinct_count(table, 'session_token', by=['channel_id'])
+    quantiles(table, [0.95, 0.99])
+
+or `python sketches.py --start 2025-10-01 --end 2025-10-07 --by channel_id`.
+
+HLL_PRECISION and QUANTILE_ACCURACY are part of the stored format: sketches
+written with different values cannot be merged.
+"""
+import io
+import math
+import os
+from datetime import datetime, timedelta
+import boto3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from parquet_writer import RollingParquetWriter
+
+SKETCHES_ENABLED = os.environ.get('SKETCHES_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SKETCH_PREFIX = os.environ.get('SKETCH_PREFIX', 'alibaba-cdn/alibaba-cdn_sketches')
+
+# 2^12 registers: ~1.6% standard error on distinct counts
+HLL_PRECISION = 12
+QUANTILE_ACCURACY = 0.01
+DISTINCT_COLUMNS = ['session_token', 'client_ip']
+QUANTILE_COLUMN = 'response_time'
+
+SKETCH_KEYS = ['event_minute', 'channel_id', 'sketch', 'key']
+SKETCH_SCHEMA = pa.schema([
+    ('event_minute', pa.timestamp('ms')),
+    ('channel_id', pa.string()),
+    ('sketch', pa.string()),
+    ('key', pa.int32()),
+    ('value', pa.int64()),
+])
+# Log file names carry the CDN's UTC+8 date, so a UTC range can reach the next day
+PARTITION_SLACK = timedelta(hours=8)
+
+_REGISTERS = 1 << HLL_PRECISION
+_RANK_BITS = 64 - HLL_PRECISION
+_GAMMA = (1 + QUANTILE_ACCURACY) / (1 - QUANTILE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# Bucket key of response times <= 0 (they have no logarithm)
+_ZERO_BUCKET = -1
+_BUCKET_SPAN = 1 << 16
+
+
+def _groups(table):
+    # One integer per (minute, channel) and the decoded minute / channel of each
+    if 'event_minute' in table.column_names:
+        minutes = table['event_minute']
+    else:
+        minutes = pc.floor_temporal(table['event_time'], unit='minute')
+    minutes = pc.cast(pc.cast(minutes, pa.timestamp('ms')), pa.int64()).to_numpy(zero_copy_only=False)
+    channels = pc.dictionary_encode(pc.cast(table['channel_id'], pa.string()), null_encoding='encode')
+    if isinstance(channels, pa.ChunkedArray):
+        channels = channels.combine_chunks()
+    codes = channels.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    combined = minutes * max(len(channels.dictionary), 1) + codes
+    unique, inverse = np.unique(combined, return_inverse=True)
+    width = max(len(channels.dictionary), 1)
+    group_minutes = pa.array(unique // width, pa.int64()).cast(pa.timestamp('ms'))
+    group_channels = channels.dictionary.take(pa.array(unique % width))
+    return inverse, group_minutes, group_channels
+
+
+def _hash(values):
+    # 64-bit hash per row (nulls dropped); each distinct value is hashed once
+    encoded = pc.dictionary_encode(values)
+    if isinstance(encoded, pa.ChunkedArray):
+        encoded = encoded.combine_chunks()
+    valid = encoded.indices.is_valid().to_numpy(zero_copy_only=False)
+    indices = encoded.indices.fill_null(0).to_numpy(zero_copy_only=False)
+    hashes = pd.util.hash_array(encoded.dictionary.to_numpy(zero_copy_only=False).astype(object), categorize=False)
+    return hashes[indices[valid]] if len(hashes) else np.zeros(0, np.uint64), valid
+
+
+def _hll(values, groups):
+    # (group, register, rank) of the highest rank seen in each register
+    hashes, valid = _hash(values)
+    groups = groups[valid]
+    registers = (hashes >> np.uint64(_RANK_BITS)).astype(np.int64)
+    rest = hashes & np.uint64((1 << _RANK_BITS) - 1)
+    # rest < 2^52, so frexp gives its exact bit length
+    ranks = _RANK_BITS + 1 - np.frexp(rest.astype(np.float64))[1]
+    cells = groups * _REGISTERS + registers
+    order = np.lexsort((ranks, cells))
+    cells, ranks = cells[order], ranks[order]
+    last = np.ones(len(cells), dtype=bool)
+    last[:-1] = cells[1:] != cells[:-1]
+    cells, ranks = cells[last], ranks[last]
+    return cells // _REGISTERS, cells % _REGISTERS, ranks
+
+
+def _ddsketch(values, groups):
+    # (group, bucket, count) with bucket = ceil(log_gamma(value))
+    values = pc.cast(values, pa.float64()).fill_null(0).to_numpy(zero_copy_only=False)
+    with np.errstate(divide='ignore'):
+        buckets = np.where(values > 0, np.ceil(np.log(np.maximum(values, 1e-9)) / _LOG_GAMMA), _ZERO_BUCKET)
+    cells, counts = np.unique(groups * _BUCKET_SPAN + (buckets.astype(np.int64) - _ZERO_BUCKET),
+                              return_counts=True)
+    return cells // _BUCKET_SPAN, cells % _BUCKET_SPAN + _ZERO_BUCKET, counts
+
+
+def sketch_table(table):
+    """Per-minute, per-channel sketches of parsed log rows (parse_log_block output)."""
+    if table is None or table.num_rows == 0:
+        return None
+    inverse, group_minutes, group_channels = _groups(table)
+    parts = [(name, _hll(table[name], inverse)) for name in DISTINCT_COLUMNS if name in table.column_names]
+    parts.append((QUANTILE_COLUMN, _ddsketch(table[QUANTILE_COLUMN], inverse)))
+
+    tables = []
+    for name, (groups, keys, values) in parts:
+        group_index = pa.array(groups, pa.int64())
+        tables.append(pa.table({
+            'event_minute': group_minutes.take(group_index),
+            'channel_id': group_channels.take(group_index),
+            'sketch': pa.array([name] * len(groups), pa.string()),
+            'key': pa.array(keys, pa.int32()),
+            'value': pa.array(values, pa.int64()),
+        }, schema=SKETCH_SCHEMA))
+    # Unsorted: merge_sketches sorts once per file
+    return pa.concat_tables(tables)
+
+
+def _aggregate(table, keys, aggregation):
+    result = table.group_by(keys, use_threads=False).aggregate([('value', aggregation)])
+    return result.rename_columns([name if name != f'value_{aggregation}' else 'value' for name in result.column_names])
+
+
+def merge_sketches(tables, keys=('event_minute', 'channel_id')):
+    """
+    Merge sketch tables from any number of files into one row set per
+    `keys` group. keys=() merges everything into one sketch per column;
+    keys=['channel_id'] keeps channels apart across the whole range.
+    """
+    tables = [t for t in tables if t is not None and t.num_rows]
+    if not tables:
+        return None
+    table = pa.concat_tables(tables, promote_options='permissive')
+    keys = list(keys) + ['sketch', 'key']
+    is_quantile = pc.equal(table['sketch'], QUANTILE_COLUMN)
+    merged = pa.concat_tables([
+        _aggregate(table.filter(pc.invert(is_quantile)), keys, 'max'),
+        _aggregate(table.filter(is_quantile), keys, 'sum'),
+    ])
+    return merged.select(keys + ['value']).sort_by([(key, 'ascending') for key in keys])
+
+
+def distinct_count(table, column='session_token', by=()):
+    """
+    Estimated number of distinct `column` values in a sketch table: an int,
+    or {group: int} when `by` names grouping columns (e.g. ['channel_id']).
+    """
+    by = list(by)
+    table = merge_sketches([table.filter(pc.equal(table['sketch'], column))], by)
+    if table is None:
+        return {} if by else 0
+    inverse = pc.power(2.0, pc.negate(pc.cast(table['value'], pa.float64())))
+    stats = table.append_column('inverse', inverse).group_by(by, use_threads=False).aggregate(
+        [('inverse', 'sum'), ('key', 'count')]
+    ).to_pylist()
+
+    alpha = 0.7213 / (1 + 1.079 / _REGISTERS)
+    estimates = {}
+    for row in stats:
+        zeros = _REGISTERS - row['key_count']
+        estimate = alpha * _REGISTERS ** 2 / (row['inverse_sum'] + zeros)
+        if estimate <= 2.5 * _REGISTERS and zeros:
+            # Small range correction (linear counting)
+            estimate = _REGISTERS * math.log(_REGISTERS / zeros)
+        group = tuple(row[name] for name in by)
+        estimates[group[0] if len(by) == 1 else group] = int(round(estimate))
+    return estimates if by else estimates.get((), 0)
+
+
+def quantiles(table, qs=(0.5, 0.95, 0.99), by=()):
+    """
+    Estimated response_time quantiles (ms) from a sketch table: {q: value},
+    or {group: {q: value}} when `by` names grouping columns.
+    """
+    by = list(by)
+    table = merge_sketches([table.filter(pc.equal(table['sketch'], QUANTILE_COLUMN))], by)
+    if table is None:
+        return {}
+    results = {}
+    groups = table.group_by(by, use_threads=False).aggregate([]) if by else None
+    for group in (groups.to_pylist() if by else [{}]):
+        rows = table
+        for name in by:
+            rows = rows.filter(pc.equal(rows[name], group[name]))
+        keys = rows['key'].to_numpy()
+        counts = np.cumsum(rows['value'].to_numpy())
+        values = {}
+        for q in qs:
+            # Same rank convention as DDSketch: the bucket holding q * (n - 1)
+            bucket = keys[np.searchsorted(counts, q * (counts[-1] - 1), side='right')]
+            values[q] = 0.0 if bucket == _ZERO_BUCKET else round(2 * _GAMMA ** float(bucket) / (_GAMMA + 1), 1)
+        key = tuple(group[name] for name in by)
+        results[key[0] if len(by) == 1 else key] = values
+    return results if by else results[()]
+
+
+class SketchWriter:
+    """
+    Accumulate the sketches of one source file and write them next to its
+    Parquet output, like RollupWriter. Partial sketches are merged as they
+    pile up, so memory stays bounded by minutes x channels x registers.
+    """
+
+    MERGE_EVERY = 16
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self._partials = []
+
+    def write_table(self, table):
+        self.add_sketch(sketch_table(table))
+
+    def add_sketch(self, partial):
+        # Chunk sketch already computed elsewhere (e.g. by a parse worker)
+        if partial is not None and partial.num_rows:
+            self._partials.append(partial)
+            if len(self._partials) >= self.MERGE_EVERY:
+                self._partials = [merge_sketches(self._partials)]
+
+    def close(self):
+        table = merge_sketches(self._partials)
+        self._partials = []
+        if table is None:
+            return False
+        writer = RollingParquetWriter(self.s3_client, self.bucket, self.key, sort_columns=SKETCH_KEYS,
+                                      presorted=True)
+        try:
+            writer.write_table(table)
+            return writer.close()
+        except Exception:
+            writer.abort()
+            raise
+
+    def abort(self):
+        self._partials = []
+
+
+def load_sketches(s3_client, bucket, start, end, prefix=SKETCH_PREFIX, channels=None):
+    """Sketch rows with start <= event_minute <= end (naive UTC datetimes) from S3."""
+    tables = []
+    day = (start - PARTITION_SLACK).date()
+    while day <= (end + PARTITION_SLACK).date():
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/year={day:%Y}/month={day:%m}/day={day:%d}/"):
+            for obj in page.get('Contents', []):
+                name = obj['Key'].rsplit('/', 1)[-1]
+                if not name.endswith('.parquet') or name.startswith(('_', '.')):
+                    continue
+                body = s3_client.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read()
+                table = pq.read_table(io.BytesIO(body))
+                mask = pc.and_(pc.greater_equal(table['event_minute'], pa.scalar(start, pa.timestamp('ms'))),
+                               pc.less_equal(table['event_minute'], pa.scalar(end, pa.timestamp('ms'))))
+                if channels:
+                    mask = pc.and_(mask, pc.is_in(table['channel_id'], pa.array(channels, pa.string())))
+                tables.append(table.filter(mask))
+        day += timedelta(days=1)
+    return pa.concat_tables(tables, promote_options='permissive') if tables else SKETCH_SCHEMA.empty_table()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Distinct viewers and response time quantiles from the sketches')
+    parser.add_argument('--start', required=True, help='YYYY-MM-DD or YYYY-MM-DDTHH:MM (UTC)')
+    parser.add_argument('--end', required=True)
+    parser.add_argument('--by', action='append', default=[], help='Group by column, e.g. channel_id')
+    parser.add_argument('--channel', action='append', help='Only these channel_id values')
+    parser.add_argument('--bucket', default='spl-live-cdn-logs')
+    parser.add_argument('--profile', default='spl')
+    args = parser.parse_args()
+
+    def parse_time(value, end=False):
+        if len(value) == 10:
+            day = datetime.strptime(value, '%Y-%m-%d')
+            return day + timedelta(days=1, minutes=-1) if end else day
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M')
+
+    client = boto3.Session(profile_name=args.profile).client('s3')
+    sketches = load_sketches(client, args.bucket, parse_time(args.start), parse_time(args.end, True),
+                             channels=args.channel)
+    print(f"📐 {sketches.num_rows} sketch rows")
+    report = {
+        'sessions': distinct_count(sketches, 'session_token', args.by),
+        'client_ips': distinct_count(sketches, 'client_ip', args.by),
+        'response_time_ms': quantiles(sketches, by=args.by),
+    }
+    print(json.dumps(report, indent=2, default=str))
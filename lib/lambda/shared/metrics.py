@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AlibabaCdnLogs')
+# Optional JSON-lines file that also receives every summary (local runs, benchmarks)
+METRICS_FILE = os.environ.get('METRICS_FILE')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+
+class Metrics:
+    """
+    Per-invocation timings and counters, emitted once as a CloudWatch
+    Embedded Metric Format (EMF) log line.
+
+    span(name) adds the wall time of a block to <name>_seconds and bumps
+    <name>_calls. Spans opened by several threads at once add up, so the
+    totals are busy time per stage rather than elapsed time. count() adds to a
+    counter with a CloudWatch unit (Count, Bytes...). Every update is a dict
+    increment under a lock, cheap enough for per-chunk use on the hot path.
+    """
+
+    def __init__(self, service, namespace=METRICS_NAMESPACE, sink_path=METRICS_FILE, **dimensions):
+        self.service = service
+        self.namespace = namespace
+        self.sink_path = sink_path
+        self.dimensions = {'Service': service, **dimensions}
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, unit='Count'):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.values[f'{name}_seconds'] = self.values.get(f'{name}_seconds', 0) + elapsed
+                self.units[f'{name}_seconds'] = 'Seconds'
+                self.values[f'{name}_calls'] = self.values.get(f'{name}_calls', 0) + 1
+                self.units[f'{name}_calls'] = 'Count'
+
+    def timed(self, iterable, name):
+        # Time how long each next() of an iterator takes (reads, decompression...)
+        iterator = iter(iterable)
+        while True:
+            with self.span(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def set_property(self, name, value):
+        # Searchable in CloudWatch Logs Insights but not a metric
+        self.properties[name] = value
+
+    def summary(self):
+        with self._lock:
+            values = {name: round(value, 3) if isinstance(value, float) else value
+                      for name, value in self.values.items()}
+        values['invocation_seconds'] = round(time.monotonic() - self.started, 3)
+        return values
+
+    def emit(self):
+        if not METRICS_ENABLED:
+            return None
+        values = self.summary()
+        units = dict(self.units, invocation_seconds='Seconds')
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': units.get(name, 'None')} for name in sorted(values)],
+                }],
+            },
+            **self.dimensions,
+            **self.properties,
+            **values,
+        }
+        line = json.dumps(document, default=str)
+        # Lambda ships stdout to CloudWatch Logs, which extracts EMF lines as metrics
+        print(line)
+        if self.sink_path:
+            with open(self.sink_path, 'a') as sink:
+                sink.write(line + '\n')
+        return document
+
+
+_current = Metrics('default')
+
+
+def start(service, **dimensions):
+    # Reset the module-level metrics at the start of an invocation
+    global _current
+    _current = Metrics(service, **dimensions)
+    return _current
+
+
+def current():
+    return _current
+
+
+def span(name):
+    return _current.span(name)
+
+
+def count(name, value=1, unit='Count'):
+    _current.count(name, value, unit)
+
+
+def timed(iterable, name):
+    return _current.timed(iterable, name)
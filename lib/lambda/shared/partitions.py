@@ -0,0 +1,208 @@
+"""
+Register the day partitions written by the Lambdas with the Glue catalog.
+
+Every converted file used to fire its own Athena `ALTER TABLE ... ADD IF NOT
+EXISTS PARTITION`, hundreds of identical queued and billed DDL queries a
+day. PartitionRegistrar collects the partitions touched during an
+invocation and registers only the new ones, in one Glue BatchCreatePartition
+call per 100 partitions:
+
+    registrar = PartitionRegistrar(s3_client, glue_client, bucket)
+    registrar.add('2025', '10', '10')      # once per file, deduplicated
+    registrar.flush()                       # once per invocation
+
+Partitions already registered are remembered in the Lambda container and
+as empty marker objects under PARTITION_CACHE_PREFIX (per table creation
+time, so recreating the table resets them), and later invocations skip
+them after a single HEAD. When the table uses partition projection
+there is nothing to register and flush() returns straight away. Switch a
+table to projection with:
+
+    python partitions.py --enable-projection --profile spl
+"""
+import os
+from datetime import datetime, timedelta
+import boto3
+from botocore.exceptions import ClientError
+
+PARTITION_DATABASE = os.environ.get('PARTITION_DATABASE', 'cdn_logs_alibaba_partitioned')
+PARTITION_TABLE = os.environ.get('PARTITION_TABLE', 'cdn_logs_parquet')
+PARTITION_LOCATION_PREFIX = os.environ.get('PARTITION_LOCATION_PREFIX', 'alibaba-cdn/alibaba-cdn_parquet')
+PARTITION_CACHE_PREFIX = os.environ.get('PARTITION_CACHE_PREFIX', 'alibaba-cdn/_manifests/partitions')
+# BatchCreatePartition accepts at most 100 partitions per call
+GLUE_BATCH_SIZE = 100
+
+# Partitions registered by this container, kept across warm invocations
+_registered = set()
+
+
+class PartitionRegistrar:
+    """
+    Deduplicate and batch-register (year, month, day) partitions of one
+    Glue table. add() is cheap and can be called per file; flush() does the
+    catalog work. A failed registration is only logged, not cached, so the
+    next invocation that writes to the same day retries it.
+    """
+
+    def __init__(self, s3_client, glue_client, bucket, database=PARTITION_DATABASE, table=PARTITION_TABLE,
+                 location_prefix=PARTITION_LOCATION_PREFIX, cache_prefix=PARTITION_CACHE_PREFIX):
+        self.s3_client = s3_client
+        self.glue_client = glue_client
+        self.bucket = bucket
+        self.database = database
+        self.table = table
+        self.location_prefix = location_prefix
+        self.cache_prefix = cache_prefix
+        self._pending = set()
+        self._table = None
+
+    def add(self, year, month, day):
+        partition = (str(year), str(month), str(day))
+        if (self.database, self.table, partition) not in _registered:
+            self._pending.add(partition)
+
+    def _location(self, partition):
+        year, month, day = partition
+        return f"s3://{self.bucket}/{self.location_prefix}/year={year}/month={month}/day={day}/"
+
+    def _marker_key(self, partition):
+        year, month, day = partition
+        # Keyed by the table's creation time: a recreated table starts with no markers
+        created = int(self._get_table()['CreateTime'].timestamp()) if 'CreateTime' in self._get_table() else 0
+        return f"{self.cache_prefix}/{self.database}.{self.table}/{created}/year={year}/month={month}/day={day}"
+
+    def _is_cached(self, partition):
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self._marker_key(partition))
+            return True
+        except ClientError:
+            return False
+
+    def _remember(self, partition):
+        _registered.add((self.database, self.table, partition))
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._marker_key(partition), Body=b'')
+
+    def _get_table(self):
+        if self._table is None:
+            self._table = self.glue_client.get_table(DatabaseName=self.database, Name=self.table)['Table']
+        return self._table
+
+    def uses_projection(self):
+        return self._get_table().get('Parameters', {}).get('projection.enabled', '').lower() == 'true'
+
+    def _partition_input(self, partition):
+        # Partitions share the table's storage descriptor, only the location differs
+        descriptor = dict(self._get_table()['StorageDescriptor'])
+        descriptor['Location'] = self._location(partition)
+        return {'Values': list(partition), 'StorageDescriptor': descriptor}
+
+    def flush(self):
+        """Register the pending partitions. Returns the list that was newly registered."""
+        pending = sorted(self._pending)
+        self._pending = set()
+        if not pending:
+            return []
+        if self.uses_projection():
+            for partition in pending:
+                _registered.add((self.database, self.table, partition))
+            print(f"🧭 {self.database}.{self.table} uses partition projection, nothing to register")
+            return []
+
+        new = []
+        for partition in pending:
+            if self._is_cached(partition):
+                _registered.add((self.database, self.table, partition))
+            else:
+                new.append(partition)
+
+        registered = []
+        for start in range(0, len(new), GLUE_BATCH_SIZE):
+            batch = new[start:start + GLUE_BATCH_SIZE]
+            response = self.glue_client.batch_create_partition(
+                DatabaseName=self.database,
+                TableName=self.table,
+                PartitionInputList=[self._partition_input(partition) for partition in batch],
+            )
+            failed = {}
+            for error in response.get('Errors', []):
+                code = error.get('ErrorDetail', {}).get('ErrorCode')
+                if code != 'AlreadyExistsException':
+                    failed[tuple(error.get('PartitionValues', []))] = error.get('ErrorDetail', {}).get('ErrorMessage')
+            for partition in batch:
+                if partition in failed:
+                    print(f"⚠️  Could not register partition {'/'.join(partition)}: {failed[partition]}")
+                    continue
+                self._remember(partition)
+                registered.append(partition)
+
+        print(f"🗂️  Partitions for {self.database}.{self.table}: {len(registered)} registered, "
+              f"{len(pending) - len(new)} already known")
+        return registered
+
+
+def enable_projection(glue_client, database=PARTITION_DATABASE, table=PARTITION_TABLE, bucket=None,
+                      location_prefix=PARTITION_LOCATION_PREFIX, first_year=2024):
+    """
+    Turn on partition projection for a year/month/day table, so Athena derives
+    partitions from the S3 layout and no registration is needed any more.
+    """
+    current = glue_client.get_table(DatabaseName=database, Name=table)['Table']
+    if bucket is None:
+        location = current['StorageDescriptor']['Location'].rstrip('/')
+    else:
+        location = f"s3://{bucket}/{location_prefix}"
+    parameters = dict(current.get('Parameters', {}))
+    parameters.update({
+        'projection.enabled': 'true',
+        # A date projection up to NOW never runs out, unlike a fixed integer range
+        'projection.year.type': 'date',
+        'projection.year.format': 'yyyy',
+        'projection.year.range': f"{first_year},NOW",
+        'projection.year.interval': '1',
+        'projection.year.interval.unit': 'YEARS',
+        'projection.month.type': 'integer',
+        'projection.month.range': '01,12',
+        'projection.month.digits': '2',
+        'projection.day.type': 'integer',
+        'projection.day.range': '01,31',
+        'projection.day.digits': '2',
+        'storage.location.template': f"{location}/year=${{year}}/month=${{month}}/day=${{day}}/",
+    })
+    # UpdateTable takes a TableInput, which has fewer fields than GetTable returns
+    table_input = {key: current[key] for key in (
+        'Name', 'Description', 'Owner', 'Retention', 'StorageDescriptor', 'PartitionKeys',
+        'TableType', 'ViewOriginalText', 'ViewExpandedText'
+    ) if key in current}
+    table_input['Parameters'] = parameters
+    glue_client.update_table(DatabaseName=database, TableInput=table_input)
+    print(f"✅ Partition projection enabled on {database}.{table} ({parameters['storage.location.template']})")
+    return parameters
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Register or project the day partitions of the Parquet table')
+    parser.add_argument('--database', default=PARTITION_DATABASE)
+    parser.add_argument('--table', default=PARTITION_TABLE)
+    parser.add_argument('--bucket', default='spl-live-cdn-logs')
+    parser.add_argument('--enable-projection', action='store_true')
+    parser.add_argument('--start-date', help='Register every day from this date (YYYY-MM-DD)')
+    parser.add_argument('--end-date')
+    parser.add_argument('--profile', default='spl')
+    args = parser.parse_args()
+
+    session = boto3.Session(profile_name=args.profile)
+    if args.enable_projection:
+        enable_projection(session.client('glue'), args.database, args.table, args.bucket)
+    elif args.start_date:
+        registrar = PartitionRegistrar(session.client('s3'), session.client('glue'), args.bucket,
+                                       args.database, args.table)
+        day = datetime.strptime(args.start_date, '%Y-%m-%d')
+        end = datetime.strptime(args.end_date or args.start_date, '%Y-%m-%d')
+        while day <= end:
+            registrar.add(day.strftime('%Y'), day.strftime('%m'), day.strftime('%d'))
+            day += timedelta(days=1)
+        registrar.flush()
+    else:
+        parser.error('nothing to do: pass --enable-projection or --start-date')
@@ -0,0 +1,125 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# S3 requires parts of at least 5 MB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+PART_SIZE = int(os.environ.get('MULTIPART_PART_SIZE_MB', '8')) * 1024 * 1024
+MAX_INFLIGHT = int(os.environ.get('MULTIPART_MAX_INFLIGHT', '2'))
+
+
+class S3MultipartWriter:
+    """
+    Write-only file object that streams into an S3 multipart upload.
+
+    Data is buffered until a part is full, then uploaded from a small thread
+    pool while the caller keeps writing. At most MAX_INFLIGHT parts are in
+    flight, so peak memory is about (MAX_INFLIGHT + 1) * PART_SIZE whatever
+    the object size. Objects smaller than one part go through a single
+    put_object call. On error the upload is aborted and nothing is left behind.
+    """
+
+    def __init__(self, s3_client, bucket, key, content_type='application/octet-stream',
+                 part_size=PART_SIZE, max_inflight=MAX_INFLIGHT, metadata=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.metadata = metadata or {}
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.upload_id = None
+        self.etag = None
+        self.closed = False
+        self._buffer = bytearray()
+        self._position = 0
+        self._parts = []
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(max(max_inflight, 1))
+        self._pool = ThreadPoolExecutor(max_workers=max(max_inflight, 1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed S3MultipartWriter')
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit_part(part)
+        return len(data)
+
+    def _submit_part(self, body):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type, Metadata=self.metadata
+            )
+            self.upload_id = response['UploadId']
+        part_number = len(self._futures) + 1
+        # Blocks the writer while too many parts are in flight (backpressure)
+        self._slots.acquire()
+        self._futures.append(self._pool.submit(self._upload_part, part_number, body))
+
+    def _upload_part(self, part_number, body):
+        try:
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                PartNumber=part_number, Body=body
+            )
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self._slots.release()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                response = self.s3_client.put_object(
+                    Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                    ContentType=self.content_type, Metadata=self.metadata
+                )
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+                parts = [future.result() for future in self._futures]
+                response = self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={'Parts': parts}
+                )
+            self.etag = response.get('ETag')
+        except Exception:
+            self.abort()
+            raise
+        self._buffer = bytearray()
+        self.closed = True
+        self._pool.shutdown(wait=True)
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._buffer = bytearray()
+        self._pool.shutdown(wait=True)
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
@@ -0,0 +1,108 @@
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # ISA-L inflate, ~2.5x faster than zlib and API compatible (shipped in the shared layer)
+    from isal import isal_zlib as inflate
+except ImportError:
+    inflate = zlib
+
+RANGE_SIZE = int(os.environ.get('S3_READ_RANGE_MB', '8')) * 1024 * 1024
+PREFETCH = int(os.environ.get('S3_READ_PREFETCH', '4'))
+# Decompressed bytes handed to the parser at a time
+BLOCK_SIZE = 16 * 1024 * 1024
+# gzip header, any window size
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def iter_ranges(s3_client, bucket, key, size=None, range_size=RANGE_SIZE, prefetch=PREFETCH):
+    """
+    Yield the bytes of an S3 object as consecutive ranges, in order.
+
+    Up to `prefetch` ranged GETs are in flight, so the next ranges are
+    downloading while the caller decompresses and parses the current one.
+    """
+    if size is None:
+        size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    if size == 0:
+        return
+
+    def fetch(start):
+        end = min(start + range_size, size) - 1
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}')
+        return response['Body'].read()
+
+    starts = iter(range(0, size, range_size))
+    with ThreadPoolExecutor(max_workers=max(prefetch, 1)) as pool:
+        pending = deque()
+        for start in starts:
+            pending.append(pool.submit(fetch, start))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            data = pending.popleft().result()
+            next_start = next(starts, None)
+            if next_start is not None:
+                pending.append(pool.submit(fetch, next_start))
+            yield data
+
+
+def iter_gunzip(chunks, max_length=BLOCK_SIZE):
+    # Decompress a stream of gzip bytes, including files made of several
+    # concatenated gzip members, in pieces of at most max_length bytes
+    decompressor = inflate.decompressobj(GZIP_WBITS)
+    in_member = False
+    for chunk in chunks:
+        while True:
+            in_member = in_member or bool(chunk)
+            data = decompressor.decompress(chunk, max_length)
+            if data:
+                yield data
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = inflate.decompressobj(GZIP_WBITS)
+                in_member = False
+                if not chunk:
+                    break
+                continue
+            chunk = decompressor.unconsumed_tail
+            if not chunk and len(data) < max_length:
+                break
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+    if in_member:
+        # Same check as gzip.GzipFile: a cut-off download must not look complete
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+
+def iter_line_blocks(chunks, block_size=BLOCK_SIZE):
+    # Re-cut a byte stream into blocks of about block_size ending on a newline.
+    # Blocks are zero-copy memoryviews; only the partial last line is copied
+    # and carried over to the next block.
+    pieces = []
+    buffered = 0
+    for chunk in chunks:
+        pieces.append(chunk)
+        buffered += len(chunk)
+        if buffered < block_size:
+            continue
+        data = pieces[0] if len(pieces) == 1 else b''.join(pieces)
+        cut = data.rfind(b'\n') + 1
+        if cut:
+            yield memoryview(data)[:cut]
+            data = data[cut:]
+        pieces = [data] if data else []
+        buffered = len(data)
+    if buffered:
+        data = b''.join(pieces)
+        if data.strip():
+            yield data
+
+
+def iter_log_blocks(s3_client, bucket, key, size=None, block_size=BLOCK_SIZE):
+    """Yield blocks of complete lines from a gzipped S3 object."""
+    chunks = iter_ranges(s3_client, bucket, key, size=size)
+    return iter_line_blocks(iter_gunzip(chunks), block_size)
@@ -3,6 +3,8 @@ import * as s3 from 'aws-cdk-lib/aws-s3';
 import * as s3n from 'aws-cdk-lib/aws-s3-notifications';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
+import * as events from 'aws-cdk-lib/aws-events';
+import * as targets from 'aws-cdk-lib/aws-events-targets';
 import { Construct } from 'constructs';
 
 export class ParquetConversionStack extends cdk.Stack {
@@ -20,6 +22,14 @@ export class ParquetConversionStack extends cdk.Stack {
       'arn:aws:lambda:me-central-1:593833071574:layer:AWSSDKPandas-Python312-Arm64:19'
     );
 
+    // Shared Python modules (built into layers/shared by build-layers.sh)
+    const sharedLayer = new lambda.LayerVersion(this, 'SharedCodeLayer', {
+      code: lambda.Code.fromAsset('layers/shared'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      compatibleArchitectures: [lambda.Architecture.ARM_64],
+      description: 'Shared Python modules for the CDN log Lambdas',
+    });
+
     // Lambda function for Parquet conversion
     const parquetConverter = new lambda.Function(this, 'ParquetConverter', {
       runtime: lambda.Runtime.PYTHON_3_12,
@@ -28,7 +38,14 @@ export class ParquetConversionStack extends cdk.Stack {
       timeout: cdk.Duration.minutes(15),
       memorySize: 8096,
       architecture: lambda.Architecture.ARM_64,
-      layers: [pandasLayer]
+      layers: [pandasLayer, sharedLayer],
+      environment: {
+        PARQUET_CODEC: 'zstd',
+        PARQUET_ROW_GROUP_ROWS: '500000',
+        PARQUET_OUTPUT_MODE: 'file',
+        ROLLUP_ENABLED: 'true',
+        SKETCHES_ENABLED: 'true',
+      }
     });
 
     // Grant permissions
@@ -60,5 +77,32 @@ export class ParquetConversionStack extends cdk.Stack {
         suffix: '.gz'
       }
     );
+
+    // Daily compaction of the small Parquet files in closed day partitions
+    const parquetCompactor = new lambda.Function(this, 'ParquetCompactor', {
+      runtime: lambda.Runtime.PYTHON_3_12,
+      handler: 'compaction.lambda_handler',
+      code: lambda.Code.fromAsset('lib/lambda/parquet_converter'),
+      timeout: cdk.Duration.minutes(15),
+      memorySize: 8096,
+      architecture: lambda.Architecture.ARM_64,
+      layers: [pandasLayer, sharedLayer],
+      environment: {
+        PARQUET_CODEC: 'zstd',
+        COMPACTION_TARGET_MB: '256',
+        // Decoded Arrow size per bin; the sort needs about as much again
+        COMPACTION_MAX_DECODED_MB: '2048',
+      }
+    });
+    logsBucket.grantReadWrite(parquetCompactor);
+    logsBucket.grantDelete(parquetCompactor);
+
+    const compactionRule = new events.Rule(this, 'DailyParquetCompaction', {
+      schedule: events.Schedule.cron({ minute: '30', hour: '3' }),
+      description: 'Compact small Parquet files of the previous two days',
+    });
+    compactionRule.addTarget(new targets.LambdaFunction(parquetCompactor, {
+      event: events.RuleTargetInput.fromObject({ scheduled: true })
+    }));
   }
-}
\ No newline at end of file
+}
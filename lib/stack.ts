@@ -27,6 +27,14 @@ export class AlibabaCdnLogsStack extends cdk.Stack {
       description: 'Aliyun CLI binary',
     });
 
+    // Shared Python modules (built into layers/shared by build-layers.sh)
+    const sharedLayer = new lambda.LayerVersion(this, 'SharedCodeLayer', {
+      code: lambda.Code.fromAsset('layers/shared'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+      compatibleArchitectures: [lambda.Architecture.ARM_64],
+      description: 'Shared Python modules for the CDN log Lambdas',
+    });
+
     // Lambda execution role
     const lambdaRole = new iam.Role(this, 'LambdaExecutionRole', {
       assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com'),
@@ -38,9 +46,41 @@ export class AlibabaCdnLogsStack extends cdk.Stack {
           statements: [
             new iam.PolicyStatement({
               effect: iam.Effect.ALLOW,
-              actions: ['s3:PutObject', 's3:PutObjectAcl'],
+              actions: ['s3:PutObject', 's3:PutObjectAcl', 's3:AbortMultipartUpload', 's3:GetObject'],
               resources: ['arn:aws:s3:::spl-live-cdn-logs/*'],
             }),
+            // Ingest manifest: segments are compacted (deleted) and day prefixes listed
+            new iam.PolicyStatement({
+              effect: iam.Effect.ALLOW,
+              actions: ['s3:DeleteObject'],
+              resources: ['arn:aws:s3:::spl-live-cdn-logs/alibaba-cdn/_manifests/*'],
+            }),
+            // Fused ingest deletes its conversion outputs again when the raw archive fails
+            new iam.PolicyStatement({
+              effect: iam.Effect.ALLOW,
+              actions: ['s3:DeleteObject'],
+              resources: [
+                'arn:aws:s3:::spl-live-cdn-logs/alibaba-cdn/alibaba-cdn_parquet/*',
+                'arn:aws:s3:::spl-live-cdn-logs/alibaba-cdn/alibaba-cdn_rollups/*',
+                'arn:aws:s3:::spl-live-cdn-logs/alibaba-cdn/alibaba-cdn_sketches/*',
+                'arn:aws:s3:::spl-live-cdn-logs/alibaba-cdn/alibaba-cdn_quarantine/*',
+              ],
+            }),
+            new iam.PolicyStatement({
+              effect: iam.Effect.ALLOW,
+              actions: ['s3:ListBucket'],
+              resources: ['arn:aws:s3:::spl-live-cdn-logs'],
+            }),
+          ],
+        }),
+        // Fused ingest mode registers the Parquet partitions it writes (partitions.py)
+        GlueAccess: new iam.PolicyDocument({
+          statements: [
+            new iam.PolicyStatement({
+              effect: iam.Effect.ALLOW,
+              actions: ['glue:GetTable', 'glue:BatchCreatePartition'],
+              resources: ['*'],
+            }),
           ],
         }),
         SecretsAccess: new iam.PolicyDocument({
@@ -62,12 +102,14 @@ export class AlibabaCdnLogsStack extends cdk.Stack {
       handler: 'lambda_function.lambda_handler',
       code: lambda.Code.fromAsset('lib/lambda/log_downloader'),
       role: lambdaRole,
-      layers: [pandasLayer, aliyunLayer],
+      layers: [pandasLayer, aliyunLayer, sharedLayer],
       timeout: cdk.Duration.minutes(15),  // Maximum allowed timeout for Lambda
       memorySize: 3008,  // Increased memory for better performance
       environment: {
         ALIYUN_SECRET_NAME: 'aliyun-credentials',
         HOME: '/tmp',
+        // 'fused' also converts each log to Parquet while streaming it
+        INGEST_MODE: 'standard',
       },
     });
 
@@ -97,6 +139,20 @@ export class AlibabaCdnLogsStack extends cdk.Stack {
       })
     }));
 
+    // Micro-batch polling for the realtime dashboard: lists only the logs
+    // published since the watermark and converts them while streaming
+    const realtimeRule = new events.Rule(this, 'RealtimeLogCollection', {
+      schedule: events.Schedule.rate(cdk.Duration.minutes(5)),
+      description: 'Collect and convert newly published CDN logs every 5 minutes',
+    });
+
+    realtimeRule.addTarget(new targets.LambdaFunction(cdnLogProcessor, {
+      event: events.RuleTargetInput.fromObject({
+        domain: 'alibaba-live.servers8.com',
+        realtime: true
+      })
+    }));
+
     // Output function name
     new cdk.CfnOutput(this, 'FunctionName', {
       value: cdnLogProcessor.functionName,